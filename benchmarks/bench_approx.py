@@ -0,0 +1,65 @@
+# Evaluation speed of Chebyshev approximations (approximate) against the compiled
+# expressions they approximate, on a narrow interval: the setup time of approximate, its
+# pieces and degree, the largest error seen at 10000 random points of the interval, and the
+# time per point of a single call and of evaluate_many on the 10000 points (a NumPy array,
+# or a list without NumPy). The expressions include higher derivatives, which are large,
+# chars is the length of each one.
+#
+# Run from the repository root: python benchmarks/bench_approx.py
+
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import MathFunc, approximate, diff, func
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+A, B = 1.0, 1.1
+POINTS = 10000
+
+
+def expressions():
+    f = func("sin(x**2 + 1)*exp(x)/(1 + x**2)", "x")
+    g = func("ln(x**2 + 1)*tan(x/2) + sec(x)", "x")
+    return [("sin(x)*exp(x)", MathFunc("sin(x)*exp(x)", "x")),
+            ("f", f), ("f'''", diff(f, "x", n=3)), ("g", g), ("g''", diff(g, "x", n=2))]
+
+
+def per_call_ns(fn, x):
+    number = 20000
+    return min(timeit.repeat(lambda: fn(x), number=number, repeat=5)) / number * 1e9
+
+
+def per_point_ns(fn, xs):
+    return min(timeit.repeat(lambda: fn(xs), number=5, repeat=3)) / 5 / len(xs) * 1e9
+
+
+def main():
+    rng = random.Random(0)
+    xs = [rng.uniform(A, B) for _ in range(POINTS)]
+    batch = np.array(xs) if np is not None else xs
+    print(f"interval [{A}, {B}], {POINTS} points, NumPy {'on' if np is not None else 'off'}")
+    print(f"{'expression':<14} {'chars':>6} {'setup (ms)':>11} {'pieces':>7} {'degree':>7} "
+          f"{'max error':>10} {'call f (ns)':>12} {'call p (ns)':>12} {'batch f':>8} "
+          f"{'batch p':>8}")
+    for name, f in expressions():
+        start = time.perf_counter()
+        p = approximate(f, "x", A, B)
+        setup = time.perf_counter() - start
+        error = max(abs(p(x) - f(x)) for x in xs)
+        print(f"{name:<14} {len(f.expr):>6} {setup * 1e3:>11.2f} {len(p.coeffs):>7} {p.degree:>7} "
+              f"{error:>10.1e} {per_call_ns(f, 1.05):>12.0f} {per_call_ns(p, 1.05):>12.0f} "
+              f"{per_point_ns(f.evaluate_many, batch):>8.1f} "
+              f"{per_point_ns(p.evaluate_many, batch):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Reverse mode automatic differentiation (value_and_grad) against symbolic gradients
+# (gradient) for functions of 10, 100 and 1000 variables. Setup is building everything from
+# the expression string (for gradient: differentiating, simplifying and compiling all
+# partials, for value_and_grad: compiling the forward and backward sweep). Per point is one
+# evaluation of all partial derivatives (value_and_grad also returns the value).
+# The symbolic setup for 1000 variables takes about a minute per function.
+#
+# Run from the repository root: python benchmarks/bench_autodiff.py
+
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import gradient, value_and_grad, clear_diff_caches
+
+SIZES = [10, 100, 1000]
+
+
+def logsumexp(n):
+    # Every partial depends on every variable
+    return "ln(" + " + ".join(f"exp(x{i})" for i in range(n)) + ")"
+
+
+def rosenbrock(n):
+    # Each variable only interacts with its neighbours
+    return " + ".join(f"100*(x{i + 1} - x{i}**2)**2 + (1 - x{i})**2" for i in range(n - 1))
+
+
+def product(n):
+    # Partials are products of all the other variables
+    return "sin(" + "*".join(f"x{i}" for i in range(n)) + ")"
+
+
+def timed(build):
+    clear_diff_caches()
+    start = time.perf_counter()
+    result = build()
+    return result, time.perf_counter() - start
+
+
+def per_call_us(fn, point):
+    number = 200
+    best = min(timeit.repeat(lambda: fn(*point), number=number, repeat=3))
+    return best / number * 1e6
+
+
+def main():
+    print(f"{'function':<12} {'vars':>5} {'setup sym (ms)':>15} {'setup AD (ms)':>14} "
+          f"{'point sym (us)':>15} {'point AD (us)':>14} {'max diff':>9}")
+    for name, generate in (("logsumexp", logsumexp), ("rosenbrock", rosenbrock),
+                           ("product", product)):
+        for n in SIZES:
+            expr = generate(n)
+            names = [f"x{i}" for i in range(n)]
+            point = [0.5 + 0.3 / n * i for i in range(n)]
+
+            def build_symbolic():
+                g = gradient(expr, names)
+                g(*point)
+                return g
+
+            def build_ad():
+                vg = value_and_grad(expr, names)
+                vg(*point)
+                return vg
+
+            g, setup_sym = timed(build_symbolic)
+            vg, setup_ad = timed(build_ad)
+            error = max(abs(a - b) for a, b in zip(g(*point), vg(*point)[1]))
+            print(f"{name:<12} {n:>5} {setup_sym * 1e3:>15.1f} {setup_ad * 1e3:>14.1f} "
+                  f"{per_call_us(g, point):>15.1f} {per_call_us(vg, point):>14.1f} "
+                  f"{error:>9.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Ranges of functions and their derivatives on an interval: bounds (interval arithmetic on
+# adaptively split pieces) against dense sampling, the minimum and maximum of evaluate_many
+# at --points evenly spaced points (a NumPy array, or a list without NumPy). Reports both
+# ranges, the time each took, bounds' interval evaluations and error (how far its bounds
+# may be from values f takes). Sampling is only a lower estimate of the range, it misses
+# the narrow peak of the first function entirely; bounds is guaranteed to contain it.
+#
+# Run from the repository root: python benchmarks/bench_bounds.py [--points 1000000]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import bounds, diff, func
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CASES = [
+    # (name, expression, a, b)
+    ("spike", "1/(1 + (10000000*(x - 0.123456789))**2)", 0, 1),
+    ("wave", "sin(x)*exp(-x/10) + cos(3*x)/(2 + x**2)", 0, 20),
+    ("cubic", "x**3 - 3*x + sin(x)", -2, 2),
+]
+
+
+def sample(f, a, b, points):
+    if np is not None:
+        values = f.evaluate_many(np.linspace(a, b, points))
+    else:
+        values = f.evaluate_many([a + (b - a) * i / (points - 1) for i in range(points)])
+    return min(values), max(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bounds versus dense sampling")
+    parser.add_argument('--points', type=int, default=1000000)
+    args = parser.parse_args()
+
+    print(f"{args.points} sample points, NumPy {'on' if np is not None else 'off'}")
+    print(f"{'function':<10} {'interval':<9} {'sampled range':>27} {'sample (ms)':>12} "
+          f"{'bounds':>27} {'error':>8} {'evals':>6} {'bounds (ms)':>12}")
+    for name, expr, a, b in CASES:
+        f = func(expr, "x")
+        for label, g in ((name, f), (name + "'", diff(f, "x"))):
+            start = time.perf_counter()
+            lo, hi = sample(g, a, b, args.points)
+            sampled = time.perf_counter() - start
+            start = time.perf_counter()
+            r = bounds(g, "x", a, b)
+            bounded = time.perf_counter() - start
+            print(f"{label:<10} {f'[{a}, {b}]':<9} {f'[{lo:.6g}, {hi:.6g}]':>27} "
+                  f"{sampled * 1e3:>12.1f} {f'[{r.lo:.6g}, {r.hi:.6g}]':>27} "
+                  f"{r.error:>8.1e} {r.evaluations:>6} {bounded * 1e3:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
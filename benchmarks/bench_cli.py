@@ -0,0 +1,64 @@
+# Throughput and peak memory of the command line (python -m derivative) on a generated
+# input: formulas from bench_diff_many, about a third of them distinct, each line with one
+# point to evaluate at. Every run is a separate process reading the input from a file and
+# writing to /dev/null. Memory is the peak resident size of the process, which should not
+# depend on the number of lines.
+#
+# Run from the repository root: python benchmarks/bench_cli.py [lines]
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_diff_many import batch
+
+LINES = 200000
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+RUNS = [
+    ("text", []),
+    ("jsonl", ["--format", "jsonl"]),
+    ("csv", ["--format", "csv"]),
+    ("eval only", ["--eval-only", "--format", "jsonl"]),
+]
+
+
+def write_input(path, lines):
+    exprs = batch(20000)
+    with open(path, 'w') as f:
+        for i in range(lines):
+            f.write(f"{exprs[i % len(exprs)]}\t{0.5 + i % 7 / 10}\n")
+
+
+def run(args, path):
+    # Seconds and peak memory (KB) of one run of the command line
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen([sys.executable, '-m', 'derivative', path] + args,
+                                   cwd=ROOT, stdout=devnull)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"command line failed with status {process.returncode}")
+    return seconds, usage.ru_maxrss
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else LINES
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'input.txt')
+        write_input(path, lines)
+        print(f"{lines} lines")
+        print(f"{'run':<10} {'seconds':>8} {'lines/s':>9} {'peak (MB)':>10}")
+        for name, args in RUNS:
+            seconds, peak = run(args, path)
+            print(f"{name:<10} {seconds:>8.2f} {lines / seconds:>9.0f} {peak / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
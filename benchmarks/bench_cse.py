@@ -0,0 +1,73 @@
+# Effect of common subexpression elimination on evaluating chain-rule heavy derivatives
+# "tree ops" counts every operation as printed, "plan ops" counts each distinct one once,
+# which is what EvalPlan computes per point. Times are per call of the compiled function
+# without CSE (the whole tree inlined) and with it.
+#
+# Run from the repository root: python benchmarks/bench_cse.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import func, diff, EvalPlan
+
+# (expression, derivative order, evaluation point)
+CASES = [
+    ("tan(sin(x**2))", 1, 0.7),
+    ("sec(x**2 + 1)*csc(x**2 + 1)", 1, 0.7),
+    ("exp(sin(x))/(1 + exp(sin(x)))", 1, 0.7),
+    ("tan(sin(x**2))", 2, 0.7),
+    ("sec(x)/(x**2 + 1)", 2, 0.7),
+    ("exp(sin(x))/(1 + exp(sin(x)))", 3, 0.7),
+    ("sec(x**2 + 1)*csc(x**2 + 1)", 3, 0.7),
+]
+
+
+def tree_ops(node, memo=None):
+    # Operations with shared subtrees counted every time they appear
+    if memo is None:
+        memo = {}
+    if node not in memo:
+        children = node.children()
+        memo[node] = (1 if children else 0) + sum(tree_ops(c, memo) for c in children)
+    return memo[node]
+
+
+def walk(root):
+    # Every distinct node once
+    seen = {root}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        for child in node.children():
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+
+
+def per_call_ns(fn, point, number=5000):
+    best = min(timeit.repeat(lambda: fn(point), number=number, repeat=5))
+    return best / number * 1e9
+
+
+def main():
+    print(f"{'derivative':<36} {'tree ops':>8} {'plan ops':>8} {'no CSE (ns)':>12} "
+          f"{'CSE (ns)':>9} {'speedup':>8}")
+    for expr, order, point in CASES:
+        d = diff(func(expr, "x"), "x", n=order)
+        tree = d.tree()
+        inline = EvalPlan(tree, "x", cse=False).compile()
+        shared = EvalPlan(tree, "x").compile()
+        distinct = [n for n in walk(tree) if n.children()]
+        before = per_call_ns(inline, point)
+        after = per_call_ns(shared, point)
+        label = f"d{order}/dx{order} {expr}"
+        print(f"{label:<36} {tree_ops(tree):>8} {len(distinct):>8} {before:>12.0f} "
+              f"{after:>9.0f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
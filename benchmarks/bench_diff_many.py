@@ -0,0 +1,80 @@
+# Throughput of diff_many against calling symbolic_diff_expr in a loop, for a batch of
+# generated formulas in which about half the lines repeat an earlier one (like a nightly
+# batch with hot formulas). Times are for the whole batch; speedup is against the loop. Worker
+# counts above the number of CPUs can't be faster than one worker, os.cpu_count() is
+# printed with the results.
+#
+# Run from the repository root: python benchmarks/bench_diff_many.py [count]
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import diff_many, symbolic_diff_expr, clear_diff_caches
+
+COUNT = 20000
+WORKERS = [1, 2, 4, 8]
+
+FUNCS = ["sin", "cos", "tan", "exp", "ln"]
+
+
+def formula(rng, depth=3):
+    # Random expression in x with a few coefficients
+    if depth == 0 or rng.random() < 0.2:
+        return rng.choice(["x", "x", str(rng.randint(1, 9))])
+    kind = rng.random()
+    if kind < 0.3:
+        return f"{rng.choice(FUNCS)}({formula(rng, depth - 1)})"
+    if kind < 0.45:
+        return f"({formula(rng, depth - 1)})**{rng.randint(2, 5)}"
+    op = rng.choice([" + ", " - ", "*", "/"])
+    return f"{formula(rng, depth - 1)}{op}{formula(rng, depth - 1)}"
+
+
+def batch(count):
+    rng = random.Random(0)
+    exprs = []
+    for _ in range(count):
+        if exprs and rng.random() < 0.5:
+            exprs.append(rng.choice(exprs))
+        else:
+            exprs.append(formula(rng))
+    return exprs
+
+
+def loop(exprs):
+    results = []
+    for expr in exprs:
+        try:
+            results.append(symbolic_diff_expr(expr, "x"))
+        except (ValueError, NotImplementedError) as e:
+            results.append(e)
+    return results
+
+
+def timed(run, exprs):
+    clear_diff_caches()
+    start = time.perf_counter()
+    results = run(exprs)
+    return results, time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    exprs = batch(count)
+    print(f"{count} formulas, {len(set(exprs))} distinct, {os.cpu_count()} CPUs")
+    expected, base = timed(loop, exprs)
+    print(f"{'run':<12} {'seconds':>8} {'formulas/s':>11} {'speedup':>8}")
+    print(f"{'loop':<12} {base:>8.2f} {count / base:>11.0f} {1:>7.2f}x")
+    for workers in WORKERS:
+        results, seconds = timed(lambda e: list(diff_many(e, "x", workers=workers)), exprs)
+        assert [str(r) for r in results] == [str(r) for r in expected]
+        print(f"{f'{workers} workers':<12} {seconds:>8.2f} {count / seconds:>11.0f} "
+              f"{base / seconds:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
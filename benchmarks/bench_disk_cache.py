@@ -0,0 +1,65 @@
+# Cold start of a worker process that differentiates a hot set of formulas (from
+# bench_diff_many), with and without a persistent DiskCache. Each run is a fresh process
+# timing import of derivative plus differentiating every formula once: "no cache" derives
+# everything, "disk" finds everything in a cache file filled beforehand, "disk + preload"
+# first copies the cache into memory with DiskCache.preload. Times are ms.
+#
+# Run from the repository root: python benchmarks/bench_disk_cache.py [formulas]
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_diff_many import batch
+
+FORMULAS = 2000
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Run in the fresh process: argv is the formulas file, the cache path ('' for none) and
+# whether to preload. Prints the milliseconds taken
+WORKER = """
+import json, sys, time
+start = time.perf_counter()
+import derivative
+exprs = json.load(open(sys.argv[1]))
+if sys.argv[2]:
+    derivative.disk_diff_cache = derivative.DiskCache(sys.argv[2])
+    if sys.argv[3] == '1':
+        derivative.disk_diff_cache.preload()
+for expr in exprs:
+    derivative.symbolic_diff_expr(expr, 'x')
+print((time.perf_counter() - start) * 1e3)
+"""
+
+
+def cold_start_ms(path, cache='', preload=False):
+    out = subprocess.run([sys.executable, '-c', WORKER, path, cache, '1' if preload else '0'],
+                         cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return float(out)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else FORMULAS
+    exprs = list(dict.fromkeys(batch(count * 4)))[:count]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'formulas.json')
+        cache = os.path.join(tmp, 'derivatives.db')
+        with open(path, 'w') as f:
+            json.dump(exprs, f)
+        none = min(cold_start_ms(path) for _ in range(3))
+        cold_start_ms(path, cache)  # fills the cache
+        disk = min(cold_start_ms(path, cache) for _ in range(3))
+        preload = min(cold_start_ms(path, cache, True) for _ in range(3))
+        size = os.path.getsize(cache)
+    print(f"{len(exprs)} formulas, cache file {size / 1024:.0f} KB")
+    print(f"{'run':<16} {'ms':>9} {'speedup':>8}")
+    for name, ms in (("no cache", none), ("disk", disk), ("disk + preload", preload)):
+        print(f"{name:<16} {ms:>9.1f} {none / ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Per-call evaluation latency of MathFunc, before and after compiling expressions
+# Compares the old approach (build an environment dict and eval the string on every call)
+# against the compiled function MathFunc now uses, for the expressions in examples.py
+#
+# Run from the repository root: python benchmarks/bench_eval.py
+
+import math
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import func, diff
+
+# (expression, evaluation point) pairs used by examples.py
+EXAMPLES = [
+    ("5", 3),
+    ("3*x**2", 2),
+    ("x**5", 2),
+    ("x**3 + 2*x**2 - 5*x + 1", 2),
+    ("x**2 * sin(x)", 1),
+    ("x**2 / (x + 1)", 2),
+    ("sin(x**2)", 1),
+    ("sin(x)", 1),
+    ("cos(x)", 1),
+    ("tan(x)", 1),
+    ("sec(x)", 1),
+    ("cot(x)", 1),
+    ("csc(x)", 1),
+    ("exp(x)", 1),
+    ("exp(x**2)", 1),
+    ("2**x", 2),
+    ("3**(x**2)", 1),
+    ("ln(x)", 2),
+    ("ln(x**2 + 1)", 2),
+    ("x**2 * exp(x) + sin(x) * cos(x)", 1),
+    ("ln(x) / x**2", 2),
+    ("sin(x**2 + 1) * exp(x)", 1),
+]
+
+
+def legacy_call(expr, var, value):
+    # MathFunc.__call__ as it was before compilation was added
+    env = {
+        var: value,
+        'sin': math.sin,
+        'cos': math.cos,
+        'tan': math.tan,
+        'sec': lambda x: 1 / math.cos(x),
+        'cot': lambda x: 1 / math.tan(x),
+        'csc': lambda x: 1 / math.sin(x),
+        'exp': math.exp,
+        'ln': math.log,
+        'log': math.log,
+        'e': math.e,
+        'pi': math.pi
+    }
+    return eval(expr, {"__builtins__": {}}, env)
+
+
+def per_call_ns(fn, number):
+    # Best of a few runs, in nanoseconds per call
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return best / number * 1e9
+
+
+def main(number=2000):
+    print(f"{'expression':<34} {'eval (ns)':>10} {'compiled (ns)':>14} {'speedup':>8}")
+    total_old = total_new = 0.0
+    for expr, point in EXAMPLES:
+        f = func(expr, "x")
+        for g in (f, diff(f, "x")):
+            g(point)  # compile outside the timed region
+            old = per_call_ns(lambda: legacy_call(g.expr, "x", point), number)
+            new = per_call_ns(lambda: g(point), number)
+            total_old += old
+            total_new += new
+            label = g.expr if len(g.expr) <= 34 else g.expr[:31] + "..."
+            print(f"{label:<34} {old:>10.0f} {new:>14.0f} {old / new:>7.1f}x")
+    print(f"{'total':<34} {total_old:>10.0f} {total_new:>14.0f} {total_old / total_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Gradient of a least-squares style model with k parameters, computed with gradient() versus
+# one derivative per parameter. "separate" differentiates the expression string once per
+# parameter (a parse and a derivative tree each, like calling symbolic_diff_expr k times)
+# and compiles every partial to its own function of all parameters. "gradient" parses once
+# and compiles all partials into one function, with their shared subexpressions computed once.
+# Times: setup is building everything from the string, per point is computing all k partials
+# at one point, and batch is per point for 10000 points as a NumPy array (if installed).
+#
+# Run from the repository root: python benchmarks/bench_gradient.py
+
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import Parser, EvalPlan, gradient, symbolic_diff_expr, clear_diff_caches
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PARAMETERS = [4, 16, 64]
+BATCH = 10000
+
+
+def model(k):
+    # Squared residual of a sum of k/2 decaying exponentials at t = 1.5, y = 2
+    terms = [f"a{i}*exp(-b{i}*1.5)" for i in range(k // 2)]
+    names = [f"a{i}" for i in range(k // 2)] + [f"b{i}" for i in range(k // 2)]
+    return f"({' + '.join(terms)} - 2)**2", names
+
+
+def separate(expr, names):
+    fns = []
+    for name in names:
+        tree = Parser(symbolic_diff_expr(expr, name)).parse()
+        fns.append(EvalPlan(tree, names).compile())
+    return fns
+
+
+def per_call_us(fn, number=2000):
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return best / number * 1e6
+
+
+def main():
+    print(f"{'k':>4} {'setup sep (ms)':>15} {'setup grad (ms)':>16} {'point sep (us)':>15} "
+          f"{'point grad (us)':>16} {'batch (us)':>11}")
+    for k in PARAMETERS:
+        expr, names = model(k)
+        point = [0.5 + 0.01 * i for i in range(k)]
+
+        clear_diff_caches()
+        start = time.perf_counter()
+        fns = separate(expr, names)
+        setup_sep = time.perf_counter() - start
+
+        clear_diff_caches()
+        start = time.perf_counter()
+        g = gradient(expr, names)
+        g(*point)
+        setup_grad = time.perf_counter() - start
+
+        expected = [fn(*point) for fn in fns]
+        assert all(abs(a - b) <= 1e-9 * (1 + abs(a)) for a, b in zip(expected, g(*point)))
+
+        point_sep = per_call_us(lambda: [fn(*point) for fn in fns])
+        point_grad = per_call_us(lambda: g(*point))
+        batch = "-"
+        if np is not None:
+            points = np.tile(point, (BATCH, 1))
+            seconds = min(timeit.repeat(lambda: g.evaluate_many(points), number=5, repeat=3))
+            batch = f"{seconds / 5 / BATCH * 1e6:.3f}"
+
+        print(f"{k:>4} {setup_sep * 1e3:>15.1f} {setup_grad * 1e3:>16.1f} {point_sep:>15.2f} "
+              f"{point_grad:>16.2f} {batch:>11}")
+
+
+if __name__ == "__main__":
+    main()
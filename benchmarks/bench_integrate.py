@@ -0,0 +1,99 @@
+# Function evaluations needed for definite integrals by integrate (adaptive Gauss-Kronrod)
+# against fixed-step composite rules (midpoint and Simpson), for integrals with known values.
+# The fixed-step rules double their number of steps until the error is below TARGET, their
+# evaluations are those of the last run. "-" is a rule that can't be used (Simpson's rule
+# evaluates the ends, where ln(x) is singular) or doesn't get within TARGET in MAX_STEPS.
+# Times are for one integral, including evaluating the integrand, which with NumPy is
+# batched for every rule.
+#
+# Run from the repository root: python benchmarks/bench_integrate.py
+
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import MathFunc, integrate
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TARGET = 1e-8
+MAX_STEPS = 1 << 22
+
+INTEGRALS = [
+    ("x**5 - 3*x**2 + 1", 0, 2, 14 / 3),
+    ("sin(x)**2", 0, 10, 5 - math.sin(20) / 4),
+    ("exp(-x**2)", -5, 5, math.sqrt(math.pi) * math.erf(5)),
+    ("1/(1 + 100*x**2)", -1, 1, math.atan(10) / 5),
+    ("x**0.5", 0, 1, 2 / 3),
+    ("ln(x)", 0, 1, -1.0),
+]
+
+
+def evaluate(f, points):
+    if np is not None:
+        with np.errstate(all='ignore'):
+            values = f.evaluate_many(np.array(points))
+        if not np.isfinite(values).all():
+            raise ValueError("not finite")
+        return values
+    return f.evaluate_many(points)
+
+
+def midpoint(f, a, b, n):
+    h = (b - a) / n
+    return h * math.fsum(evaluate(f, [a + (i + 0.5) * h for i in range(n)])), n
+
+
+def simpson(f, a, b, n):
+    h = (b - a) / n
+    values = evaluate(f, [a + i * h for i in range(n + 1)])
+    total = values[0] + values[n] + 4 * math.fsum(values[1:n:2]) + 2 * math.fsum(values[2:n:2])
+    return h / 3 * total, n + 1
+
+
+def fixed_step(rule, f, a, b, exact):
+    # (evaluations, seconds) of the coarsest run within TARGET, None if there is none
+    n = 2
+    while n <= MAX_STEPS:
+        start = time.perf_counter()
+        try:
+            value, evaluations = rule(f, a, b, n)
+        except (ValueError, ZeroDivisionError):
+            return None
+        seconds = time.perf_counter() - start
+        if abs(value - exact) <= TARGET:
+            return evaluations, seconds
+        n *= 2
+    return None
+
+
+def cell(result):
+    if result is None:
+        return f"{'-':>10} {'-':>9}"
+    evaluations, seconds = result
+    return f"{evaluations:>10} {seconds * 1e3:>9.2f}"
+
+
+def main():
+    print(f"target error {TARGET}, NumPy {'on' if np is not None else 'off'}")
+    print(f"{'integrand':<20} {'adaptive':>10} {'ms':>9} {'error':>8} {'midpoint':>10} "
+          f"{'ms':>9} {'simpson':>10} {'ms':>9}")
+    for expr, a, b, exact in INTEGRALS:
+        f = MathFunc(expr, "x")
+        start = time.perf_counter()
+        result = integrate(f, "x", a, b, abs_tol=TARGET / 10, rel_tol=0)
+        seconds = time.perf_counter() - start
+        error = abs(result.value - exact)
+        print(f"{expr:<20} {result.evaluations:>10} {seconds * 1e3:>9.2f} {error:>8.1e} "
+              f"{cell(fixed_step(midpoint, f, a, b, exact))} "
+              f"{cell(fixed_step(simpson, f, a, b, exact))}")
+
+
+if __name__ == "__main__":
+    main()
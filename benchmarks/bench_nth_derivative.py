@@ -0,0 +1,76 @@
+# Size and time of higher-order derivatives, orders 1 to 15
+# "nested" is diff(diff(...)) round-tripping through strings at every order, "n=" is
+# diff(f, var, n=k) which stays in the tree and collects like terms between orders.
+# Sizes are tree node counts (every occurrence counted) and, for n=, the number of
+# distinct nodes once equal subtrees are shared.
+#
+# Run from the repository root: python benchmarks/bench_nth_derivative.py
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import func, diff, clear_diff_caches
+
+EXPRESSIONS = ["x**2 * sin(x)", "exp(x)/x", "sin(x**2)"]
+MAX_ORDER = 15
+# Give up on the nested version once a single order takes longer than this (seconds)
+NESTED_TIME_LIMIT = 2.0
+
+
+def tree_size(node, memo=None):
+    # Number of nodes with shared subtrees counted every time they appear
+    if memo is None:
+        memo = {}
+    if node not in memo:
+        memo[node] = 1 + sum(tree_size(c, memo) for c in node.children())
+    return memo[node]
+
+
+def dag_size(node):
+    # Number of distinct nodes
+    seen = set()
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if n not in seen:
+            seen.add(n)
+            stack.extend(n.children())
+    return len(seen)
+
+
+def main():
+    for expr in EXPRESSIONS:
+        print(f"\nf(x) = {expr}")
+        print(f"{'order':>5} {'nested size':>12} {'nested (ms)':>12} "
+              f"{'n= size':>8} {'n= shared':>10} {'n= (ms)':>9}")
+        f = func(expr, "x")
+        nested = f
+        nested_ok = True
+        for order in range(1, MAX_ORDER + 1):
+            nested_size = nested_ms = "-"
+            if nested_ok:
+                clear_diff_caches()
+                start = time.perf_counter()
+                try:
+                    nested = diff(nested, "x")
+                    elapsed = time.perf_counter() - start
+                    nested_ms = f"{elapsed * 1000:.2f}"
+                    nested_size = tree_size(nested.tree())
+                    nested_ok = elapsed < NESTED_TIME_LIMIT
+                except (RecursionError, NotImplementedError):
+                    nested_ms = "failed"
+                    nested_ok = False
+
+            clear_diff_caches()
+            start = time.perf_counter()
+            d = diff(f, "x", n=order)
+            elapsed = time.perf_counter() - start
+            print(f"{order:>5} {nested_size:>12} {nested_ms:>12} "
+                  f"{tree_size(d.tree()):>8} {dag_size(d.tree()):>10} {elapsed * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Parse and differentiation throughput on large generated expressions
+# Reports characters per second for Parser.parse alone and for a full symbolic
+# differentiation (parse, diff, simplify, to_str) at input sizes up to about 1 MB.
+# Times should grow linearly with the input size, and none of the inputs may hit the
+# recursion limit even though the nested ones are tens of thousands of levels deep.
+#
+# Run from the repository root: python benchmarks/bench_parse.py
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import Parser, clear_diff_caches
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+
+def polynomial(size):
+    # Long flat sum: 0*x**0 + 1*x**1 + 2*x**2 + ...
+    terms = []
+    length = 0
+    i = 0
+    while length < size:
+        term = f"{i}*x**{i % 7}"
+        terms.append(term)
+        length += len(term) + 3
+        i += 1
+    return " + ".join(terms)
+
+
+def nested(size):
+    # Deeply nested sums and products: ((((x + x)*2 + x)*3 + x)*4 ...
+    prefix = []
+    suffix = []
+    length = 1
+    i = 0
+    while length < size:
+        prefix.append("(")
+        piece = f" + x)*{i % 9 + 1}"
+        suffix.append(piece)
+        length += len(piece) + 1
+        i += 1
+    return "".join(prefix) + "x" + "".join(suffix)
+
+
+def chain(size):
+    # Deep chain rule nest: sin(cos(exp(sin(... x ...)))), only parsed and differentiated,
+    # printing its derivative is quadratic in the depth since every factor repeats its argument
+    names = ["sin(", "cos(", "exp("]
+    depth = size // 5
+    return "".join(names[i % 3] for i in range(depth)) + "x" + ")" * depth
+
+
+def rate(chars, seconds):
+    return f"{chars / seconds / 1e6:8.2f} MB/s"
+
+
+def main():
+    print(f"{'input':<12} {'size':>10} {'parse':>14} {'parse+diff':>14} {'full pipeline':>14}")
+    for name, generate in (("polynomial", polynomial), ("nested", nested), ("chain", chain)):
+        for size in SIZES:
+            text = generate(size)
+            clear_diff_caches()
+
+            start = time.perf_counter()
+            tree = Parser(text).parse()
+            parsed = time.perf_counter()
+            d = tree.diff("x")
+            diffed = time.perf_counter()
+            full = "-"
+            if generate is not chain:
+                d.simplify().to_str()
+                full = rate(len(text), time.perf_counter() - start)
+
+            print(f"{name:<12} {len(text):>10} {rate(len(text), parsed - start):>14} "
+                  f"{rate(len(text), diffed - start):>14} {full:>14}")
+            del tree, d
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Partial derivatives of expressions where most of the terms don't depend on the variable:
+# a sum of n terms in other variables plus one term in x, differentiated with respect to x.
+# Reports the nodes diff applied a derivative rule to and the nodes those rules created
+# (counted with Instrumentation), the time of diff with the derivative caches cleared and of
+# simplifying the result. Subtrees without x are skipped (see Node._vars) and no derivative
+# nodes are built for them, so none of the columns should grow with n.
+#
+# Run from the repository root: python benchmarks/bench_partial.py
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import derivative
+from derivative import Parser, Instrumentation, clear_diff_caches
+
+SIZES = [10, 100, 1000]
+
+
+def expression(n):
+    terms = [f"sin(y{i})*exp(y{i}*z) / (z**2 + {i})" for i in range(n)]
+    # The x term differs per n, so its derivative nodes are new in every run
+    return " + ".join(terms) + f" + x**2*sin({n}*x)"
+
+
+def best_ms(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        clear_diff_caches()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e3
+
+
+def main():
+    print(f"{'terms':>6} {'visited':>7} {'created':>8} {'diff (ms)':>10} {'simplify (ms)':>14}")
+    for n in SIZES:
+        tree = Parser(expression(n)).parse()
+        clear_diff_caches()
+        stats = derivative.instrumentation = Instrumentation()
+        try:
+            raw = tree.diff("x")
+        finally:
+            derivative.instrumentation = None
+        nodes = sum(stats.rules.values())
+        created = sum(stats.created.values())
+        diff_ms = best_ms(lambda: tree.diff("x"))
+        simplify_ms = best_ms(raw.simplify)
+        print(f"{n:>6} {nodes:>7} {created:>8} {diff_ms:>10.2f} {simplify_ms:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
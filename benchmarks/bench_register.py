@@ -0,0 +1,56 @@
+# Evaluation without eval: RegisterPlan against the compiled Python function (EvalPlan)
+# that MathFunc uses, for the expressions in examples.py and their derivatives. "call" is
+# ns per call at x = 1.3, "batch" is ns per point of evaluate_many on a list of 10000 points
+# (RegisterPlan runs each instruction over the whole batch; the compiled function is mapped
+# over the points into an array.array).
+#
+# Run from the repository root: python benchmarks/bench_register.py
+
+import os
+import sys
+import timeit
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import Parser, EvalPlan, RegisterPlan
+
+EXPRESSIONS = [
+    "x**3 + 2*x**2 - 5*x + 1",
+    "x**2 * sin(x)",
+    "x**2 / (x + 1)",
+    "sec(x)",
+    "exp(x**2)",
+    "ln(x**2 + 1)",
+    "x**2 * exp(x) + sin(x) * cos(x)",
+    "sin(x**2 + 1) * exp(x)",
+]
+
+POINT = 1.3
+BATCH = 10000
+
+
+def best_ns(fn, number, per=1):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number / per * 1e9
+
+
+def main():
+    points = [0.5 + i / BATCH for i in range(BATCH)]
+    print(f"{'expression':<36} {'instrs':>6} {'call eval':>10} {'call reg':>9} "
+          f"{'batch eval':>11} {'batch reg':>10}")
+    for expr in EXPRESSIONS:
+        tree = Parser(expr).parse()
+        for label, t in ((expr, tree), ("  d/dx", tree.diff("x").simplify())):
+            compiled = EvalPlan(t, "x").compile()
+            plan = RegisterPlan(t, "x")
+            assert plan(POINT) == compiled(POINT)
+            call_eval = best_ns(lambda: compiled(POINT), 20000)
+            call_reg = best_ns(lambda: plan(POINT), 20000)
+            batch_eval = best_ns(lambda: array('d', map(compiled, points)), 10, BATCH)
+            batch_reg = best_ns(lambda: plan.evaluate_many(points), 10, BATCH)
+            print(f"{label:<36} {len(plan.ops):>6} {call_eval:>10.0f} {call_reg:>9.0f} "
+                  f"{batch_eval:>11.0f} {batch_reg:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Size and speed of the binary form (dumps/loads) against the string form (to_str/Parser)
+# for large derivatives. "raw" derivatives are unsimplified, as Node.diff builds them, and
+# share many subtrees; the simplified ones share few. Sizes are bytes (for the string, its
+# length), times are ms for writing and for reading back (Parser(s).parse() or loads) and
+# the read speedup. "mmap" is loads reading straight from a memory-mapped file.
+#
+# Run from the repository root: python benchmarks/bench_serialize.py
+
+import mmap
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import Parser, dumps, loads, nth_derivative, gradient
+
+
+def raw_derivative(expr, n):
+    tree = Parser(expr).parse()
+    for _ in range(n):
+        tree = tree.diff("x")
+    return tree
+
+
+def cases():
+    rosenbrock = " + ".join(f"100*(x{i + 1} - x{i}**2)**2 + (1 - x{i})**2" for i in range(199))
+    polynomial = " + ".join(f"{i}*x**{i % 17}*sin({i % 5}*x)" for i in range(1, 20000))
+    return [
+        ("raw d4 of sin(x**2+1)*exp(x)", raw_derivative("sin(x**2 + 1) * exp(x)", 4)),
+        ("raw d5 of x**2/(x+1)", raw_derivative("x**2 / (x + 1)", 5)),
+        ("d12 of sin(x**2+1)*exp(x)",
+         nth_derivative(Parser("sin(x**2 + 1) * exp(x)").parse(), "x", 12)),
+        ("gradient of rosenbrock(200)",
+         gradient(rosenbrock, [f"x{i}" for i in range(200)]).trees),
+        ("parsed 20000 term sum", Parser(polynomial).parse()),
+    ]
+
+
+def best_ms(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e3
+
+
+def main():
+    print(f"{'expression':<34} {'str bytes':>10} {'bin bytes':>10} {'to_str':>8} "
+          f"{'dumps':>8} {'parse':>8} {'loads':>8} {'mmap':>8} {'speedup':>8}")
+    for name, tree in cases():
+        trees = tree if isinstance(tree, list) else [tree]
+        text = "\n".join(t.to_str() for t in trees)
+        data = dumps(tree)
+        assert loads(data) == tree
+        number = max(1, int(2e5 // len(text)))
+        to_str = best_ms(lambda: [t.to_str() for t in trees], number)
+        write = best_ms(lambda: dumps(tree), number)
+        parse = best_ms(lambda: [Parser(line).parse() for line in text.split("\n")], number)
+        read = best_ms(lambda: loads(data), number)
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                mapped = best_ms(lambda: loads(m), number)
+        print(f"{name:<34} {len(text):>10} {len(data):>10} {to_str:>8.2f} {write:>8.2f} "
+              f"{parse:>8.2f} {read:>8.2f} {mapped:>8.2f} {parse / read:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
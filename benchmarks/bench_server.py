@@ -0,0 +1,176 @@
+# Load generator for the differentiation server (python -m derivative --serve). Opens
+# --connections client connections that each keep up to --window requests in flight and
+# sends --requests requests in total, drawn from --distinct generated formulas (see
+# bench_diff_many) with a skew towards a few hot ones, so some arrive while the same
+# derivative is being computed and get coalesced. A --eval share of the requests also ask
+# for values at a few points. Another connection asks for stats every 50 ms while the load
+# runs, its latency shows whether the event loop stays responsive.
+# Reports requests per second, client side latency percentiles (from sending a request to
+# reading its response), the largest queue depth seen and the server's own counters.
+#
+# Without --address a server is started for the run on a Unix socket, with --workers
+# worker processes. With --address the load goes to a server already running there.
+#
+# Run from the repository root: python benchmarks/bench_server.py [--requests 20000]
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_diff_many import formula
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[max(int(q / 100 * len(values) + 0.5) - 1, 0)]
+
+
+def workload(args):
+    rng = random.Random(0)
+    exprs = [formula(rng) for _ in range(args.distinct)]
+    requests = []
+    for i in range(args.requests):
+        # Zipf-like: expression k is picked about 1/(k+1) as often as the first
+        expr = exprs[min(int(rng.paretovariate(1.0)) - 1, len(exprs) - 1)
+                     if rng.random() < 0.5 else rng.randrange(len(exprs))]
+        request = {'id': i, 'op': 'diff', 'expr': expr, 'var': 'x'}
+        if rng.random() < args.eval:
+            request['at'] = [0.5, 1.5, 2.5]
+        requests.append(request)
+    return requests
+
+
+async def open_connection(address):
+    if address.startswith('unix:'):
+        return await asyncio.open_unix_connection(address[5:], limit=1 << 24)
+    host, _, port = address.rpartition(':')
+    return await asyncio.open_connection(host, int(port), limit=1 << 24)
+
+
+async def client(address, requests, window, latencies, errors):
+    reader, writer = await open_connection(address)
+    sent = {}
+    slots = asyncio.Semaphore(window)
+
+    async def receive():
+        for _ in range(len(requests)):
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent.pop(response['id']))
+            if 'error' in response:
+                errors.append(response['error'])
+            slots.release()
+
+    receiver = asyncio.create_task(receive())
+    for request in requests:
+        await slots.acquire()
+        sent[request['id']] = time.perf_counter()
+        writer.write((json.dumps(request) + '\n').encode())
+        await writer.drain()
+    await receiver
+    writer.close()
+
+
+async def request(reader, writer, message):
+    writer.write((json.dumps(message) + '\n').encode())
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def monitor(address, depths, stats_latencies, stop):
+    reader, writer = await open_connection(address)
+    while not stop.is_set():
+        start = time.perf_counter()
+        stats = await request(reader, writer, {'id': 'stats', 'op': 'stats'})
+        stats_latencies.append(time.perf_counter() - start)
+        depths.append(stats['queue_depth'])
+        await asyncio.sleep(0.05)
+    writer.close()
+
+
+async def run(address, args):
+    requests = workload(args)
+    latencies, errors, depths, stats_latencies = [], [], [], []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(monitor(address, depths, stats_latencies, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(client(address, requests[i::args.connections], args.window,
+                                  latencies, errors)
+                           for i in range(args.connections)))
+    seconds = time.perf_counter() - start
+    stop.set()
+    await watcher
+    reader, writer = await open_connection(address)
+    stats = await request(reader, writer, {'id': 'stats', 'op': 'stats'})
+    writer.close()
+
+    ms = [latency * 1e3 for latency in latencies]
+    print(f"requests        {len(latencies)} in {seconds:.2f} s, "
+          f"{len(latencies) / seconds:.0f} requests/s, {len(errors)} errors")
+    print(f"latency (ms)    p50 {percentile(ms, 50):.2f}  p90 {percentile(ms, 90):.2f}  "
+          f"p99 {percentile(ms, 99):.2f}  max {max(ms):.2f}")
+    if stats_latencies:
+        ms = [latency * 1e3 for latency in stats_latencies]
+        print(f"stats (ms)      p50 {percentile(ms, 50):.2f}  max {max(ms):.2f} "
+              f"(event loop responsiveness under load)")
+    print(f"queue depth     max {max(depths, default=0)}")
+    print(f"server          computed {stats['computed']}, coalesced {stats['coalesced']}, "
+          f"cache hits {stats['cache_hits']}")
+    server = stats['latency_ms']
+    print(f"server latency  p50 {server['p50']:.2f}  p99 {server['p99']:.2f}  "
+          f"max {server['max']:.2f} ms")
+
+
+def start_server(address, workers):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'derivative', '--serve', address, '--workers', str(workers)],
+        cwd=ROOT, stderr=subprocess.PIPE, text=True)
+    line = process.stderr.readline()
+    if 'serving on' not in line:
+        process.kill()
+        raise RuntimeError(f"server didn't start: {line}{process.stderr.read()}")
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for derivative --serve")
+    parser.add_argument('--address', help="server to load, unix:PATH or HOST:PORT "
+                                          "(default: start one)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="worker processes of the server started for the run")
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--window', type=int, default=32,
+                        help="requests in flight per connection")
+    parser.add_argument('--distinct', type=int, default=2000,
+                        help="number of distinct formulas")
+    parser.add_argument('--eval', type=float, default=0.3,
+                        help="share of requests that also evaluate at points")
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests, {args.connections} connections x {args.window} in "
+          f"flight, {args.distinct} distinct formulas, {os.cpu_count()} CPUs")
+    if args.address is not None:
+        asyncio.run(run(args.address, args))
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        address = f"unix:{os.path.join(tmp, 'derivative.sock')}"
+        server = start_server(address, args.workers)
+        try:
+            asyncio.run(run(address, args))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# Size and evaluation speed of derivatives before and after simplification, for the
+# expressions in examples.py. "raw" is the derivative exactly as the rules build it, with
+# no simplification. Nodes are counted as printed (shared subtrees once per appearance),
+# times are per call of the compiled derivative at x = 1.3.
+#
+# Run from the repository root: python benchmarks/bench_simplify.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import Parser, MathFunc
+
+EXPRESSIONS = [
+    "3*x**2",
+    "x**5",
+    "x**3 + 2*x**2 - 5*x + 1",
+    "x**2 * sin(x)",
+    "x**2 / (x + 1)",
+    "sin(x**2)",
+    "tan(x)",
+    "sec(x)",
+    "cot(x)",
+    "csc(x)",
+    "exp(x**2)",
+    "2**x",
+    "3**(x**2)",
+    "ln(x**2 + 1)",
+    "x**2 * exp(x) + sin(x) * cos(x)",
+    "ln(x) / x**2",
+    "sin(x**2 + 1) * exp(x)",
+]
+
+POINT = 1.3
+
+
+def tree_nodes(node, memo=None):
+    if memo is None:
+        memo = {}
+    if node not in memo:
+        memo[node] = 1 + sum(tree_nodes(c, memo) for c in node.children())
+    return memo[node]
+
+
+def per_call_ns(text, number=20000):
+    fn = MathFunc(text, "x")
+    fn(POINT)
+    best = min(timeit.repeat(lambda: fn(POINT), number=number, repeat=5))
+    return best / number * 1e9
+
+
+def main():
+    print(f"{'expression':<34} {'raw nodes':>9} {'nodes':>6} {'raw (ns)':>9} {'ns':>6} "
+          f"{'speedup':>8}")
+    total_raw = total = 0
+    for expr in EXPRESSIONS:
+        raw = Parser(expr).parse().diff("x")
+        simplified = raw.simplify()
+        raw_nodes, nodes = tree_nodes(raw), tree_nodes(simplified)
+        raw_ns, ns = per_call_ns(raw.to_str()), per_call_ns(simplified.to_str())
+        total_raw += raw_nodes
+        total += nodes
+        print(f"{expr:<34} {raw_nodes:>9} {nodes:>6} {raw_ns:>9.0f} {ns:>6.0f} "
+              f"{raw_ns / ns:>7.2f}x")
+    print(f"{'total':<34} {total_raw:>9} {total:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+# Benchmark suite for the whole pipeline: times each stage of differentiating and evaluating
+# a corpus of generated expressions, so a regression in any one of them shows up on its own.
+# Stages, for every expression in the corpus:
+#   parse     Parser(text).parse()
+#   diff      tree.diff("x"), with the derivative caches cleared before every run
+#   simplify  the raw derivative's simplify()
+#   to_str    the simplified derivative's to_str()
+#   compile   building and first call of MathFunc(derivative text, "x")
+#   call      one call of the compiled derivative at x = 0.5
+# The corpus has four families (long polynomials, deep chain-rule nests, quotients of large
+# sums and sums of trig products), each at a few sizes. Every stage is timed --repeat times
+# (more for stages too fast to time in one go), keeping the best and the median time.
+# Every case also records node counts (distinct nodes of the input, the raw derivative and
+# the simplified one) and the peak memory allocated by each stage, measured with tracemalloc
+# in a separate untimed run.
+#
+# --json writes the results to a file, --baseline compares them against an earlier --json
+# file and exits with status 1 if any stage got slower (or allocates more) than --threshold
+# allows, or any derivative got bigger. Keep a baseline from the main branch, eg:
+#   python benchmarks/suite.py --json baseline.json
+#   (switch branches)
+#   python benchmarks/suite.py --baseline baseline.json
+# A stage only counts as slower if both its best and its median time are, and a case with
+# a slower stage is timed again (--confirm times, with twice the repeats) keeping the best
+# of all the runs, so a burst of load on the machine during one measurement isn't reported.
+# Compare runs from the same machine only. On a busy or shared machine timings of the same
+# code can still differ by more than the default 50%, raise --threshold there.
+#
+# Run from the repository root: python benchmarks/suite.py [--only polynomial] [--json out.json]
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import Parser, MathFunc, clear_diff_caches
+
+FORMAT_VERSION = 1
+STAGES = ('parse', 'diff', 'simplify', 'to_str', 'compile', 'call')
+SIZES = [4, 32, 128]
+POINT = 0.5
+# Stages faster than this (in seconds) are compared with a looser threshold, their timings
+# are too close to the timer's resolution and to the noise of the machine
+NOISE_FLOOR = 20e-6
+# Fast stages are called in batches taking at least this long (in seconds)
+BATCH_SECONDS = 0.02
+# Most runs of a stage timed call by call (see time_stage)
+MAX_RUNS = 1000
+
+
+def polynomial(n):
+    # 1*x**1 + 2*x**2 + ... + n*x**n
+    return " + ".join(f"{k}*x**{k}" for k in range(1, n + 1))
+
+
+def chain(n):
+    # n nested functions, every one of them a chain rule step: sin(exp(cos(sin(x)**2 + 1)))...
+    # The values stay bounded, so the derivative can be evaluated at any depth
+    text = "x"
+    for k in range(n):
+        text = ("sin({})", "exp({})", "cos({})", "({})**2 + 1")[k % 4].format(text)
+    return text
+
+
+def quotient(n):
+    # Ratio of two sums of n terms, the derivative multiplies them together
+    top = " + ".join(f"{k + 1}*x**{k}" for k in range(n))
+    bottom = " + ".join(f"x**{k}/{k + 1}" for k in range(n))
+    return f"({top}) / ({bottom} + 1)"
+
+
+def trig(n):
+    # Sum of n products of trig functions of different arguments
+    funcs = ("sin", "cos", "tan", "sec")
+    return " + ".join(f"{funcs[k % 4]}({k + 1}*x)*cos(x**{k % 3 + 1})" for k in range(n))
+
+
+FAMILIES = [("polynomial", polynomial), ("chain", chain), ("quotient", quotient),
+            ("trig", trig)]
+
+
+def corpus(only=None):
+    # (name, expression) for every case, optionally only those whose name contains 'only'
+    cases = []
+    for family, generate in FAMILIES:
+        for n in SIZES:
+            name = f"{family}-{n}"
+            if only is None or only in name:
+                cases.append((name, generate(n)))
+    return cases
+
+
+def count_nodes(root):
+    # Number of distinct nodes (shared subtrees counted once)
+    seen = {root}
+    stack = [root]
+    while stack:
+        for child in stack.pop().children():
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+    return len(seen)
+
+
+def time_stage(fn, setup, repeat):
+    # (best, median) time of one call of fn over at least 'repeat' runs. Without a setup the
+    # calls are batched like timeit does, so fast stages aren't dominated by the timer. With
+    # one, every call is timed on its own after calling setup, and calls are repeated until
+    # they add up to 'repeat' batches' worth of time (up to MAX_RUNS), so a fast stage gets
+    # enough samples for a stable best and median
+    if setup is None:
+        timer = timeit.Timer(fn)
+        number = 1
+        while timer.timeit(number) < BATCH_SECONDS:
+            number *= 4
+        times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    else:
+        times = []
+        while len(times) < repeat or (sum(times) < repeat * BATCH_SECONDS and
+                                      len(times) < MAX_RUNS):
+            setup()
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def peak_memory(fn, setup):
+    # Peak bytes allocated during one call of fn
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(text, repeat):
+    tree = Parser(text).parse()
+    raw = tree.diff("x")
+    simplified = raw.simplify()
+    deriv = simplified.to_str()
+    f = MathFunc(deriv, "x")
+    f(POINT)
+
+    def compile_and_call():
+        MathFunc(deriv, "x")(POINT)
+
+    stages = {
+        'parse': (lambda: Parser(text).parse(), None),
+        'diff': (lambda: tree.diff("x"), clear_diff_caches),
+        'simplify': (raw.simplify, None),
+        'to_str': (simplified.to_str, None),
+        'compile': (compile_and_call, None),
+        'call': (lambda: f(POINT), None),
+    }
+    results = {}
+    for stage in STAGES:
+        fn, setup = stages[stage]
+        best, median = time_stage(fn, setup, repeat)
+        results[stage] = {
+            'seconds': best,
+            'median_seconds': median,
+            'peak_bytes': peak_memory(fn, setup),
+        }
+    return {
+        'chars': len(text),
+        'derivative_chars': len(deriv),
+        'nodes': {
+            'input': count_nodes(tree),
+            'derivative': count_nodes(raw),
+            'simplified': count_nodes(simplified),
+        },
+        'stages': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    # (case name, line describing it) for every regression of results against baseline,
+    # empty if there are none. A stage is slower if its best time and its median time (where
+    # the baseline has one) both are
+    problems = []
+    for name, case in results['cases'].items():
+        old = baseline['cases'].get(name)
+        if old is None:
+            continue
+        for stage, new_stage in case['stages'].items():
+            old_stage = old['stages'].get(stage)
+            if old_stage is None:
+                continue
+            limit = threshold if old_stage['seconds'] >= NOISE_FLOOR else 2 * threshold
+            ratio = new_stage['seconds'] / old_stage['seconds']
+            median_ratio = ratio
+            if 'median_seconds' in old_stage:
+                median_ratio = new_stage['median_seconds'] / old_stage['median_seconds']
+            if ratio > 1 + limit and median_ratio > 1 + limit:
+                problems.append((name, f"{name} {stage}: {old_stage['seconds'] * 1e3:.3f} ms -> "
+                                       f"{new_stage['seconds'] * 1e3:.3f} ms ({ratio:.2f}x, "
+                                       f"median {median_ratio:.2f}x)"))
+            ratio = new_stage['peak_bytes'] / max(old_stage['peak_bytes'], 1)
+            if ratio > 1 + threshold:
+                problems.append((name, f"{name} {stage}: peak {old_stage['peak_bytes']} B -> "
+                                       f"{new_stage['peak_bytes']} B ({ratio:.2f}x)"))
+        old_nodes, new_nodes = old['nodes']['simplified'], case['nodes']['simplified']
+        if new_nodes > old_nodes:
+            problems.append((name, f"{name}: simplified derivative grew from {old_nodes} to "
+                                   f"{new_nodes} nodes"))
+    return problems
+
+
+def merge_runs(case, again):
+    # Keeps the best and the lowest median time of two runs of the same case in case
+    for stage, timing in again['stages'].items():
+        old = case['stages'][stage]
+        old['seconds'] = min(old['seconds'], timing['seconds'])
+        old['median_seconds'] = min(old['median_seconds'], timing['median_seconds'])
+
+
+def print_table(results):
+    print(f"{'case':<16} {'nodes':>6} {'d nodes':>8} "
+          + " ".join(f"{stage + ' (ms)':>13}" for stage in STAGES) + f" {'peak (KB)':>10}")
+    for name, case in results['cases'].items():
+        stages = case['stages']
+        peak = max(stage['peak_bytes'] for stage in stages.values())
+        print(f"{name:<16} {case['nodes']['input']:>6} {case['nodes']['simplified']:>8} "
+              + " ".join(f"{stages[stage]['seconds'] * 1e3:>13.4f}" for stage in STAGES)
+              + f" {peak / 1024:>10.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage benchmarks of derivative.py")
+    parser.add_argument('--only', help="only run cases whose name contains this")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per stage (default 5)")
+    parser.add_argument('--json', metavar='PATH', help="write the results to PATH")
+    parser.add_argument('--baseline', metavar='PATH',
+                        help="compare against results written earlier with --json")
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help="allowed slowdown before a stage counts as a regression, as a "
+                             "fraction (default 0.5)")
+    parser.add_argument('--confirm', type=int, default=2,
+                        help="times a case with a regression is measured again before it is "
+                             "reported (default 2)")
+    args = parser.parse_args(argv)
+
+    results = {
+        'version': FORMAT_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'cases': {},
+    }
+    texts = dict(corpus(args.only))
+    for name, text in texts.items():
+        results['cases'][name] = run_case(text, args.repeat)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('version') != FORMAT_VERSION:
+            print(f"{args.baseline}: unsupported format version", file=sys.stderr)
+            return 2
+        for _ in range(args.confirm):
+            slow = {name for name, line in compare(results, baseline, args.threshold)}
+            if not slow:
+                break
+            for name in sorted(slow):
+                merge_runs(results['cases'][name], run_case(texts[name], 2 * args.repeat))
+    print_table(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    if baseline is not None:
+        problems = compare(results, baseline, args.threshold)
+        for name, line in problems:
+            print("regression:", line)
+        if problems:
+            return 1
+        print(f"no regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,7 @@
 # Symbolic Differentiation Calculator
 # This project implements a symbolic differentiation system that can compute derivatives
 # of mathematical expressions including polynomials, trigonometric functions, exponentials,
-# and logarithms. It uses a recursive descent parser to parse expressions and builds an
+# and logarithms. It uses an operator precedence parser to parse expressions and builds an
 # abstract syntax tree (AST) to represent them. The system supports all standard derivative
 # rules: constant, power, sum/difference, product, quotient, chain rule, and derivatives
 # of trigonometric, exponential, and logarithmic functions.
@@ -13,89 +13,797 @@
 # I was planning to also include more topics from calculus such as definite and indefinite integrals,
 # But im too burn out on this project to go any further. mabey in the future this will change.
 
+import csv
+import io
+import json
+import keyword
+import math
+import operator
+import os
+import re
+import struct
+import sys
+import time
+import weakref
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import Future
+from contextlib import ExitStack
+from fractions import Fraction
+from itertools import islice, repeat, tee
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, batch evaluation falls back to the array module
+    np = None
+
+try:
+    import sqlite3
+except ImportError:  # Python builds without sqlite can't use DiskCache
+    sqlite3 = None
+
+
+# Every node ever built, keyed on its type and fields (see Node.__new__)
+# Values are held weakly so nodes nothing else refers to are freed
+_interned = weakref.WeakValueDictionary()
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class LRUCache:
+    # Size-bounded mapping that evicts the least recently used entry once it holds maxsize
+    # entries (a maxsize of 0 disables caching). Counts hits and misses, see info()
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        # Returns the cached value, or None if key isn't cached
+        try:
+            value = self._data[key]
+            self._data.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def resize(self, maxsize):
+        # Change the size bound, evicting the oldest entries if it shrank
+        self.maxsize = maxsize
+        while len(self._data) > max(maxsize, 0):
+            self._data.popitem(last=False)
+
+    def clear(self):
+        # Drop every entry and reset the hit/miss counters
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Derivatives of whole expression strings, keyed on (expr, var), used by symbolic_diff_expr
+expr_diff_cache = LRUCache(4096)
+# Derivatives of subtrees, keyed on (node, var), used by Node.diff. Interning makes equal
+# subtrees the same object, so a subtree shared between expressions is differentiated once
+node_diff_cache = LRUCache(65536)
+
+
+def clear_diff_caches():
+    expr_diff_cache.clear()
+    node_diff_cache.clear()
+
+
+# Default number of entries a DiskCache keeps, and how stale (in seconds) an entry's last
+# use time may get before a hit records the new one
+DISK_CACHE_SIZE = 1000000
+DISK_CACHE_TOUCH = 60
+
+
+class DiskCache:
+    # Persistent cache of derivatives in an sqlite file, shared by every process that opens
+    # the same path, with the same get/put interface as LRUCache. Keys are (expr, var)
+    # tuples of strings, values are strings. Once it holds more than maxsize entries the
+    # least recently used are evicted (checked every few hundred puts, so it can briefly go
+    # over). The file is in WAL mode, so readers don't block the writer and each other, and
+    # writers wait for each other (up to a 30 second timeout). A cache that can't be read or
+    # written just misses, it never fails the differentiation.
+    # Connections aren't shared across fork(), a forked process opens its own on first use.
+
+    def __init__(self, path, maxsize=DISK_CACHE_SIZE):
+        if sqlite3 is None:
+            raise NotImplementedError("DiskCache needs Python's sqlite3 module")
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._conn = None
+        self._pid = None
+        self._connect()
+
+    def _connect(self):
+        if self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS derivatives "
+                         "(expr TEXT, var TEXT, result TEXT, used REAL, PRIMARY KEY (expr, var))")
+            conn.execute("CREATE INDEX IF NOT EXISTS derivatives_used ON derivatives (used)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key):
+        # Returns the cached value, or None if key isn't cached
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT result, used FROM derivatives WHERE expr = ? AND var = ?",
+                               key).fetchone()
+            if row is not None and row[1] < time.time() - DISK_CACHE_TOUCH:
+                conn.execute("UPDATE derivatives SET used = ? WHERE expr = ? AND var = ?",
+                             (time.time(),) + tuple(key))
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        try:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO derivatives VALUES (?, ?, ?, ?)",
+                         tuple(key) + (value, time.time()))
+            self._puts += 1
+            if self._puts % 256 == 0:
+                self._evict()
+        except sqlite3.Error:
+            pass
+
+    def _evict(self):
+        # Drop the least recently used entries over maxsize, plus a tenth of maxsize more so
+        # this isn't needed again right away
+        conn = self._connect()
+        (count,) = conn.execute("SELECT count(*) FROM derivatives").fetchone()
+        if count > self.maxsize:
+            conn.execute("DELETE FROM derivatives WHERE rowid IN (SELECT rowid FROM "
+                         "derivatives ORDER BY used LIMIT ?)",
+                         (count - self.maxsize + self.maxsize // 10,))
+
+    def resize(self, maxsize):
+        # Change the size bound, evicting the oldest entries if it shrank
+        self.maxsize = maxsize
+        if maxsize <= 0:
+            self.clear()
+        else:
+            self._evict()
+
+    def clear(self):
+        # Drop every entry (for every process using the file) and reset the counters
+        self._connect().execute("DELETE FROM derivatives")
+        self.hits = 0
+        self.misses = 0
+
+    def preload(self, cache=None, limit=None):
+        # Copies the most recently used entries (up to limit, by default as many as fit)
+        # into an in-memory LRUCache, expr_diff_cache by default, so a freshly started
+        # process answers its hot set without touching the disk. Returns how many it copied
+        if cache is None:
+            cache = expr_diff_cache
+        if limit is None:
+            limit = cache.maxsize
+        rows = self._connect().execute(
+            "SELECT expr, var, result FROM derivatives ORDER BY used DESC LIMIT ?",
+            (limit,)).fetchall()
+        # Least recent first, so the most recent end up most recently used in the LRU
+        for expr, var, result in reversed(rows):
+            cache.put((expr, var), result)
+        return len(rows)
+
+    def info(self):
+        (count,) = self._connect().execute("SELECT count(*) FROM derivatives").fetchone()
+        return CacheInfo(self.hits, self.misses, self.maxsize, count)
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = self._pid = None
+
+    def __len__(self):
+        return self.info().currsize
+
+
+# Optional DiskCache consulted by symbolic_diff_expr on a miss in expr_diff_cache, off (None)
+# unless set, eg: derivative.disk_diff_cache = DiskCache("derivatives.db")
+disk_diff_cache = None
+
+
+class Instrumentation:
+    # Opt-in timers and counters for the differentiation pipeline, set one as
+    # derivative.instrumentation to turn it on. While it is set, every Parser.parse,
+    # Node.diff, simplification (Node.simplify and the Simplifier behind gradient/jacobian),
+    # Node.to_str and call of a MathFunc compiled while it is set is timed, and counted in:
+    #  - calls and seconds: number of times each stage ran and the total time it took
+    #  - rules: how many nodes each derivative rule was applied to (see _diff_rule), and
+    #    created: how many new nodes each rule built (nodes it returned that already
+    #    existed, such as a shared subtree, aren't counted)
+    #  - rewrites: how often each simplifier rewrite fired (see Simplifier.rewrites)
+    # Hooks added with add_hook are called as hook(stage, seconds, info) after every stage,
+    # info is a dict with what that run did, eg: {'chars': 120} for parse and to_str. That's
+    # the place to forward them to a metrics system.
+    # Only this process is instrumented, diff_many workers and the nodes they build aren't.
+    # Switched off (None) nothing is timed and none of this costs anything but a check of
+    # the global in each stage. Times of diff include counting the rules.
+
+    def __init__(self):
+        self.calls = Counter()
+        self.seconds = Counter()
+        self.rules = Counter()
+        self.created = Counter()
+        self.rewrites = Counter()
+        self.hooks = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def record(self, stage, seconds, info):
+        self.calls[stage] += 1
+        self.seconds[stage] += seconds
+        for hook in self.hooks:
+            hook(stage, seconds, info)
+
+    def reset(self):
+        # Zero every counter (hooks stay)
+        for counter in (self.calls, self.seconds, self.rules, self.created, self.rewrites):
+            counter.clear()
+
+    def report(self):
+        # Everything counted so far as plain dicts, eg: for json.dumps
+        return {
+            'stages': {stage: {'calls': n, 'seconds': self.seconds[stage]}
+                       for stage, n in self.calls.items()},
+            'rules': dict(self.rules),
+            'created': dict(self.created),
+            'rewrites': dict(self.rewrites),
+        }
+
+    def parse(self, parser):
+        start = time.perf_counter()
+        result = parser._parse()
+        self.record('parse', time.perf_counter() - start, {'chars': len(parser.text)})
+        return result
+
+    def diff(self, root, var):
+        # Node.diff, also counting the rule used at every node
+        rules = Counter()
+        created = Counter()
+
+        def visit(node, results):
+            before = len(_interned)
+            d = node._diff(var, results)
+            rule = _diff_rule(node)
+            rules[rule] += 1
+            created[rule] += len(_interned) - before
+            node_diff_cache.put((node, var), d)
+            return d
+
+        start = time.perf_counter()
+        result = _fold(root, visit, _diff_lookup(var))
+        seconds = time.perf_counter() - start
+        self.rules.update(rules)
+        self.created.update(created)
+        self.record('diff', seconds, {'rules': dict(rules), 'created': dict(created)})
+        return result
+
+    def simplify(self, simplifier, nodes):
+        start = time.perf_counter()
+        results = simplifier._run_all(nodes)
+        seconds = time.perf_counter() - start
+        self.rewrites.update(simplifier.rewrites)
+        self.record('simplify', seconds, {
+            'nodes': sum(1 for _ in _nodes(*nodes)),
+            'simplified': sum(1 for _ in _nodes(*results)),
+            'work': simplifier.work,
+            'rewrites': dict(simplifier.rewrites),
+        })
+        return results
+
+    def to_str(self, node):
+        start = time.perf_counter()
+        result = node._to_str()
+        self.record('to_str', time.perf_counter() - start, {'chars': len(result)})
+        return result
+
+    def timed_call(self, fn):
+        # fn wrapped so every call is recorded as the stage 'call'
+        record = self.record
+        perf_counter = time.perf_counter
+
+        def call(value):
+            start = perf_counter()
+            result = fn(value)
+            record('call', perf_counter() - start, {})
+            return result
+        return call
+
+
+# Optional Instrumentation of the pipeline, off (None) unless set, eg:
+# derivative.instrumentation = Instrumentation()
+instrumentation = None
+
+
+def _fold(root, visit, lookup=None, results=None):
+    # Walks the expression below root bottom-up with an explicit stack instead of recursion,
+    # so deeply nested expressions don't run into the recursion limit
+    # visit(node, results) is called once for every distinct node after all of its children,
+    # where results maps each already visited node to what visit returned for it. If lookup
+    # is given and lookup(node) returns something other than None, that is used as the
+    # node's result and its children aren't visited. Returns the result for root.
+    # Passing the same results dict to several calls shares the work between them, nodes
+    # already in it aren't visited again
+    if results is None:
+        results = {}
+    stack = [root]
+    while stack:
+        node = stack[-1]
+        if node in results:
+            stack.pop()
+            continue
+        if lookup is not None:
+            found = lookup(node)
+            if found is not None:
+                results[node] = found
+                stack.pop()
+                continue
+        pending = False
+        for child in node.children():
+            if child not in results:
+                stack.append(child)
+                pending = True
+        if not pending:
+            stack.pop()
+            results[node] = visit(node, results)
+    return results[root]
+
+
+# Bit of each variable name in Node._vars, in order of first use. Only the first
+# MAX_VAR_BITS names get a bit of their own, so a long running process that keeps seeing
+# new names (eg: the server) keeps the registry and every node's bitset bounded. Names after
+# those all share _SHARED_VAR_BIT, which only tells that one of them is somewhere below
+MAX_VAR_BITS = 1024
+_SHARED_VAR_BIT = 1 << MAX_VAR_BITS
+_var_bits = {}
+_var_names = []  # name of each bit, by bit position
+
+
+def _var_bit(name):
+    bit = _var_bits.get(name)
+    if bit is None:
+        if len(_var_names) >= MAX_VAR_BITS:
+            return _SHARED_VAR_BIT
+        bit = _var_bits[name] = 1 << len(_var_names)
+        _var_names.append(name)
+    return bit
+
+
+def _var_mask(name):
+    # The bit of _vars set in every node containing name. For a name without a bit of its
+    # own that is the shared bit once the registry is full, before that no node has it (it
+    # would have been given a bit) and the mask is 0
+    bit = _var_bits.get(name)
+    if bit is not None:
+        return bit
+    return _SHARED_VAR_BIT if len(_var_names) >= MAX_VAR_BITS else 0
+
+
+def _diff_lookup(var):
+    # The lookup for the _fold in Node.diff: _ZERO for subtrees without var, else the
+    # derivative in node_diff_cache if there is one
+    bit = _var_mask(var)
+    cache_get = node_diff_cache.get
+
+    def lookup(node):
+        if not node._vars & bit:
+            return _ZERO
+        return cache_get((node, var))
+    return lookup
+
+
+def _nodes(*roots):
+    # Yields every distinct node below the roots (roots included) once, without recursion
+    seen = set(roots)
+    stack = list(seen)
+    while stack:
+        node = stack.pop()
+        yield node
+        for child in node.children():
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+
+
 class Node:
+    # Nodes are immutable and hash-consed: building a node that is structurally identical to
+    # an existing one returns the existing object. Equal subtrees are therefore shared (the
+    # expression is a DAG rather than a tree), and equality and hashing are plain identity
+    # checks, which are O(1) regardless of the size of the subtree.
+    # Subclasses list their fields in __slots__ in constructor argument order.
+    #
+    # Operations on whole expressions (diff, simplify, to_str, ...) are driven by _fold or an
+    # explicit stack rather than recursion. Each subclass only implements the local rule for
+    # one node (_diff, _simplify, ...) given the results already computed for its children.
+    #
+    # Every node also records the variables it depends on in _vars, a bitset of the bits
+    # _var_bit gives their names, computed from its children's when the node is built (so
+    # once per distinct node). diff uses it to skip the subtrees without the variable.
+    __slots__ = ('__weakref__', '_vars')
+
+    def __new__(cls, *fields):
+        key = (cls,) + fields
+        node = _interned.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            for name, value in zip(cls.__slots__, fields):
+                object.__setattr__(node, name, value)
+            object.__setattr__(node, '_vars', node._free_vars())
+            _interned[key] = node
+        return node
+
+    def _free_vars(self):
+        # Bitset of the variables in this node, see _vars
+        raise NotImplementedError
+
+    def variables(self):
+        # Names of the variables the expression depends on
+        bits = self._vars
+        if bits & _SHARED_VAR_BIT:
+            # Some names have no bit of their own, find them in the tree
+            return {node.name for node in _nodes(self) if isinstance(node, VarNode)}
+        names = set()
+        while bits:
+            low = bits & -bits
+            names.add(_var_names[low.bit_length() - 1])
+            bits ^= low
+        return names
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        # Rebuild through the constructor so unpickled nodes are interned too
+        return (type(self), tuple(getattr(self, name) for name in self.__slots__))
+
+    def children(self):
+        # The node's operands, in order
+        return ()
+
     def diff(self, var):
+        # Derivative with respect to 'var', memoized in node_diff_cache. Subtrees that don't
+        # depend on var aren't walked, their derivative is _ZERO
+        if instrumentation is not None:
+            return instrumentation.diff(self, var)
+
+        def visit(node, results):
+            d = node._diff(var, results)
+            node_diff_cache.put((node, var), d)
+            return d
+        return _fold(self, visit, _diff_lookup(var))
+
+    def _diff(self, var, d):
+        # Derivative of this node, d maps each child to its derivative
         raise NotImplementedError
 
     def to_str(self):
+        if instrumentation is not None:
+            return instrumentation.to_str(self)
+        return self._to_str()
+
+    def _to_str(self):
+        # Each node lists its output as strings and child nodes (_str_parts), which are
+        # expanded with a stack so the string is built in one pass
+        out = []
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                out.append(item)
+            else:
+                stack.extend(reversed(item._str_parts()))
+        return ''.join(out)
+
+    def _str_parts(self):
         raise NotImplementedError
     
-    def simplify(self):
+    def simplify(self, budget=None):
+        # Canonical simplified form of the expression, see Simplifier
+        return Simplifier(budget).run(self)
+
+    def _simplify(self, s, ctx):
+        # This node as a poly (see Simplifier), s maps each child to its poly and ctx is the
+        # Simplifier doing the work
+        raise NotImplementedError
+
+    def _py(self, src):
+        # Python source for this node, fully parenthesized so it evaluates exactly as the tree
+        # is structured (used by compile_expr), src maps each child to its source
+        raise NotImplementedError
+
+    def _adjoint(self, src, adj):
+        # Reverse mode rule (see AdjointPlan): given the source of the adjoint of this node,
+        # adj, and src mapping this node and its children to the source of their values,
+        # returns (child, source) pairs with what each child's adjoint gets from this node
+        raise NotImplementedError
+
+    def taylor(self, var, x, order=1):
+        # Taylor coefficients [f(x), f'(x), f''(x)/2!, ...] up to 'order' of the expression
+        # as a function of 'var' around the point x, by forward mode automatic
+        # differentiation: one walk of the tree carrying a truncated series through every
+        # node (see _taylor), no derivative expression is built. order=1 is dual numbers.
+        m = order + 1
+        return _fold(self, lambda node, t: node._taylor(var, x, t, m))
+
+    def _taylor(self, var, x, t, m):
+        # This node's first m Taylor coefficients, t maps each child to its coefficients
+        raise NotImplementedError
+
+    def eval_many(self, var, xs, results=None):
+        # Evaluates the expression for a NumPy array of values of 'var' at once
+        # Returns a scalar for parts that don't depend on 'var', otherwise an array of results
+        # var and xs can also be a sequence of names and a matching sequence of arrays. Pass
+        # the same results dict when evaluating several expressions on the same values to
+        # compute their common subexpressions once
+        env = {var: xs} if isinstance(var, str) else dict(zip(var, xs))
+        return _fold(self, lambda node, values: node._eval_many(env, values), results=results)
+
+    def _eval_many(self, env, values):
+        # This node's value, env maps variable names to their arrays and values maps each
+        # child to its value
+        raise NotImplementedError
+
+    def interval(self, var, bounds):
+        # Interval(lo, hi) holding every value of the expression for 'var' anywhere in
+        # bounds, a (lo, hi) pair, by interval arithmetic (see Interval). var and bounds can
+        # also be a sequence of names and a matching sequence of pairs, a number stands for
+        # a single point. The bounds are guaranteed but not tight, they widen with every
+        # repeated variable (x - x over [0, 1] gives [-1, 1]), see bounds for tight ones
+        # ex: Parser("x**2 - x").parse().interval("x", (0, 2))
+        # -> Interval(lo=-2.0000000000000004, hi=4.000000000000002)
+        pairs = {var: bounds} if isinstance(var, str) else dict(zip(var, bounds))
+        env = {}
+        for name, pair in pairs.items():
+            if isinstance(pair, (int, float)):
+                env[name] = _iv_point(pair)
+                continue
+            lo, hi = _iv_point(pair[0]).lo, _iv_point(pair[1]).hi
+            if not lo <= hi:
+                raise ValueError(f"Bounds of {name} must have lo <= hi")
+            env[name] = Interval(lo, hi)
+        return _fold(self, lambda node, values: node._interval(env, values))
+
+    def _interval(self, env, values):
+        # This node's Interval, env maps variable names to their intervals and values maps
+        # each child to its interval
         raise NotImplementedError
 
 
 class NumberNode(Node):
-    def __init__(self, value):
-        self.value = value
+    __slots__ = ('value',)
+
+    def __new__(cls, value):
+        # Interned by type as well as value: 2 and 2.0 are different nodes, since compiled
+        # code keeps integer literals exact and float literals floats (see _py)
+        key = (cls, type(value), value)
+        node = _interned.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            object.__setattr__(node, 'value', value)
+            object.__setattr__(node, '_vars', 0)
+            _interned[key] = node
+        return node
+
+    def _free_vars(self):
+        return 0
 
     def diff(self, var):
         # d/dx(c) = 0
         return NumberNode(0)
 
+    def _diff(self, var, d):
+        return _ZERO
+
     def to_str(self):
         # print integers nicely
         if isinstance(self.value, float) and self.value.is_integer():
             return str(int(self.value))
         return str(self.value)
+
+    def _str_parts(self):
+        return (self.to_str(),)
     
-    def simplify(self):
+    def simplify(self, budget=None):
         return self
 
+    def _simplify(self, s, ctx):
+        return ctx.constant(self.value)
+
+    def _py(self, src):
+        # Floats as floats (2.0, not 2 like to_str) so compiled code does float arithmetic
+        # where the expression has float literals like eval of its text did, eg: 2.0**x
+        # overflows instead of making a huge integer
+        s = repr(self.value) if isinstance(self.value, float) else self.to_str()
+        return f"({s})" if self.value < 0 else s
+
+    def _adjoint(self, src, adj):
+        return ()
+
+    def _taylor(self, var, x, t, m):
+        return [self.value] + [0.0] * (m - 1)
+
+    def _eval_many(self, env, values):
+        return self.value
+
+    def _interval(self, env, values):
+        return _iv_point(self.value)
+
+
+# The derivative of everything that doesn't depend on the variable. The rules return this
+# node for those subtrees and check for it by identity, leaving out the terms it would zero
+# (eg: u'v for a constant u), so constant parts of an expression build no derivative nodes
+_ZERO = NumberNode(0)
+
 
 class VarNode(Node):
-    def __init__(self, name):
-        self.name = name
+    __slots__ = ('name',)
+
+    def _free_vars(self):
+        return _var_bit(self.name)
 
     def diff(self, var):
         # d/dx(x) = 1, d/dx(y) = 0 if y != x
         return NumberNode(1 if self.name == var else 0)
 
+    def _diff(self, var, d):
+        return self.diff(var)
+
     def to_str(self):
         return self.name
+
+    def _str_parts(self):
+        return (self.name,)
     
-    def simplify(self):
+    def simplify(self, budget=None):
         return self
 
+    def _simplify(self, s, ctx):
+        return ctx.atom(self)
+
+    def _py(self, src):
+        return self.name
+
+    def _adjoint(self, src, adj):
+        return ()
+
+    def _taylor(self, var, x, t, m):
+        if self.name == var:
+            return [x, 1.0][:m] + [0.0] * (m - 2)
+        return [_lookup(self.name)] + [0.0] * (m - 1)
+
+    def _eval_many(self, env, values):
+        if self.name in env:
+            return env[self.name]
+        return _lookup(self.name)
+
+    def _interval(self, env, values):
+        if self.name in env:
+            return env[self.name]
+        return _iv_point(_lookup(self.name))
+
 
 class UnaryOpNode(Node):
-    def __init__(self, op, operand):
-        self.op = op      # currently only '-'
-        self.operand = operand
+    __slots__ = (
+        'op',       # currently only '-'
+        'operand',
+    )
 
-    def diff(self, var):
+    def children(self):
+        return (self.operand,)
+
+    def _free_vars(self):
+        return self.operand._vars
+
+    def _diff(self, var, d):
+        du = d[self.operand]
+        if du is _ZERO:
+            return du
         if self.op == '-':
             # d/dx(-u) = -u'
-            return UnaryOpNode('-', self.operand.diff(var))
+            return UnaryOpNode('-', du)
         raise NotImplementedError
 
-    def to_str(self):
+    def _str_parts(self):
         if self.op == '-':
-            operand_str = self.operand.to_str()
             # Remove unnecessary parentheses for simple operands
             if isinstance(self.operand, (NumberNode, VarNode)):
-                return f"-{operand_str}"
-            return f"-({operand_str})"
+                return ('-', self.operand)
+            return ('-(', self.operand, ')')
     
-    def simplify(self):
-        simplified = UnaryOpNode(self.op, self.operand.simplify())
-        # -(-x) = x
-        if self.op == '-' and isinstance(simplified.operand, UnaryOpNode) and simplified.operand.op == '-':
-            return simplified.operand.operand.simplify()
-        # -0 = 0
-        if self.op == '-' and isinstance(simplified.operand, NumberNode) and simplified.operand.value == 0:
-            return NumberNode(0)
-        return simplified
+    def _simplify(self, s, ctx):
+        if self.op == '-':
+            # -u flips the sign of every term of u, so -(-x) = x and -(3) = -3
+            return ctx.negate(ctx.take(self.operand, s))
+        raise NotImplementedError
+
+    def _py(self, src):
+        return f"({self.op}{src[self.operand]})"
+
+    def _adjoint(self, src, adj):
+        if self.op == '-':
+            return ((self.operand, f"(-{adj})"),)
+        raise NotImplementedError
+
+    def _taylor(self, var, x, t, m):
+        if self.op == '-':
+            return [-c for c in t[self.operand]]
+        raise NotImplementedError
+
+    def _eval_many(self, env, values):
+        return np.negative(values[self.operand])
+
+    def _interval(self, env, values):
+        if self.op == '-':
+            lo, hi = values[self.operand]
+            return Interval(-hi, -lo)
+        raise NotImplementedError
 
 
 class FuncNode(Node):
     # Represents function calls: sin(x), cos(x), exp(x), ln(x), etc.
-    def __init__(self, func_name, arg):
-        self.func_name = func_name  # 'sin', 'cos', 'tan', 'sec', 'cot', 'csc', 'exp', 'ln', 'log'
-        self.arg = arg  # Node representing the argument
+    __slots__ = (
+        'func_name',  # 'sin', 'cos', 'tan', 'sec', 'cot', 'csc', 'exp', 'ln', 'log'
+        'arg',        # Node representing the argument
+    )
+
+    def children(self):
+        return (self.arg,)
+
+    def _free_vars(self):
+        return self.arg._vars
     
-    def diff(self, var):
+    def _diff(self, var, d):
         # Chain rule: d/dx(f(g(x))) = f'(g(x)) * g'(x)
-        arg_diff = self.arg.diff(var)
+        arg_diff = d[self.arg]
+        if arg_diff is _ZERO:
+            # f of a constant is constant
+            return arg_diff
         
         # Trigonometric derivatives
         if self.func_name == 'sin':
@@ -144,76 +852,177 @@ class FuncNode(Node):
         
         raise NotImplementedError(f"Derivative not implemented for function: {self.func_name}")
     
-    def to_str(self):
-        arg_str = self.arg.to_str()
-        # Add parentheses around argument if it's a compound expression
-        if isinstance(self.arg, (NumberNode, VarNode)):
-            return f"{self.func_name}({arg_str})"
-        else:
-            return f"{self.func_name}({arg_str})"
+    def _str_parts(self):
+        return (f"{self.func_name}(", self.arg, ')')
     
-    def simplify(self):
-        simplified_arg = self.arg.simplify()
-        return FuncNode(self.func_name, simplified_arg)
+    def _simplify(self, s, ctx):
+        # f(c) is folded to a number when c is a constant, eg: ln(2) -> 0.6931471805599453
+        arg = s[self.arg]
+        value = ctx.value(arg)
+        if value is not None:
+            folded = _fold_call(self.func_name, value)
+            if folded is not None:
+                ctx.rewrites['fold'] += 1
+                return ctx.constant(folded)
+        return ctx.atom(FuncNode(self.func_name, ctx.to_node(arg)))
+
+    def _py(self, src):
+        return f"{self.func_name}({src[self.arg]})"
+
+    def _adjoint(self, src, adj):
+        # adj * f'(u), written in terms of f(u) (v) where that saves a function call
+        u, v = src[self.arg], src[self]
+        name = self.func_name
+        if name == 'sin':
+            return ((self.arg, _times(adj, f"cos({u})")),)
+        if name == 'cos':
+            return ((self.arg, f"(-{_times(adj, f'sin({u})')})"),)
+        if name == 'tan':
+            # sec(u)**2 = 1 + tan(u)**2
+            return ((self.arg, _times(adj, f"(1+{v}*{v})")),)
+        if name == 'sec':
+            return ((self.arg, _times(adj, f"{v}*tan({u})")),)
+        if name == 'cot':
+            # -csc(u)**2 = -(1 + cot(u)**2)
+            return ((self.arg, f"(-{_times(adj, f'(1+{v}*{v})')})"),)
+        if name == 'csc':
+            return ((self.arg, f"(-{_times(adj, f'{v}*cot({u})')})"),)
+        if name == 'exp':
+            return ((self.arg, _times(adj, v)),)
+        if name in ('ln', 'log'):
+            return ((self.arg, f"({adj}/{u})"),)
+        raise NotImplementedError(f"Derivative not implemented for function: {name}")
+
+    def _taylor(self, var, x, t, m):
+        u = t[self.arg]
+        name = self.func_name
+        if name == 'exp':
+            return _series_exp(u)
+        if name in ('ln', 'log'):
+            return _series_ln(u)
+        sin, cos = _series_sin_cos(u)
+        if name == 'sin':
+            return sin
+        if name == 'cos':
+            return cos
+        if name == 'tan':
+            return _series_div(sin, cos)
+        if name == 'sec':
+            return _series_div(_series_one(m), cos)
+        if name == 'cot':
+            return _series_div(cos, sin)
+        if name == 'csc':
+            return _series_div(_series_one(m), sin)
+        raise NotImplementedError(f"Derivative not implemented for function: {name}")
+
+    def _eval_many(self, env, values):
+        f = _NP_FUNCS.get(self.func_name) or _lookup(self.func_name)
+        return f(values[self.arg])
+
+    def _interval(self, env, values):
+        f = _IV_FUNCS.get(self.func_name)
+        if f is None:
+            raise NotImplementedError(f"No interval rule for function: {self.func_name}")
+        return f(values[self.arg])
 
 
 class BinOpNode(Node):
-    def __init__(self, left, op, right):
-        self.left = left   # Node
-        self.op = op       # '+', '-', '*', '/', '^'
-        self.right = right # Node
+    __slots__ = (
+        'left',   # Node
+        'op',     # '+', '-', '*', '/', '^'
+        'right',  # Node
+    )
+
+    def children(self):
+        return (self.left, self.right)
+
+    def _free_vars(self):
+        return self.left._vars | self.right._vars
+
+    def _diff(self, var, d):
+        # Terms with a zero derivative (_ZERO) in them are left out rather than built
+        u, v = self.left, self.right
+        du, dv = d[u], d[v]
+        if du is _ZERO and dv is _ZERO:
+            return du
 
-    def diff(self, var):
         # (u + v)' = u' + v'
         if self.op == '+':
-            return BinOpNode(self.left.diff(var), '+', self.right.diff(var))
+            if du is _ZERO:
+                return dv
+            if dv is _ZERO:
+                return du
+            return BinOpNode(du, '+', dv)
 
         # (u - v)' = u' - v'
         if self.op == '-':
-            return BinOpNode(self.left.diff(var), '-', self.right.diff(var))
+            if du is _ZERO:
+                return UnaryOpNode('-', dv)
+            if dv is _ZERO:
+                return du
+            return BinOpNode(du, '-', dv)
 
         # (u * v)' = u'v + uv'
         if self.op == '*':
+            if du is _ZERO:
+                return BinOpNode(u, '*', dv)
+            if dv is _ZERO:
+                return BinOpNode(du, '*', v)
             return BinOpNode(
-                BinOpNode(self.left.diff(var), '*', self.right),
+                BinOpNode(du, '*', v),
                 '+',
-                BinOpNode(self.left, '*', self.right.diff(var))
+                BinOpNode(u, '*', dv)
             )
 
         # (u / v)' = (u'v - uv') / v^2
         if self.op == '/':
-            u, v = self.left, self.right
-            du, dv = u.diff(var), v.diff(var)
-            numerator = BinOpNode(
-                BinOpNode(du, '*', v),
-                '-',
-                BinOpNode(u, '*', dv)
-            )
+            if dv is _ZERO:
+                # u'/v
+                return BinOpNode(du, '/', v)
+            if du is _ZERO:
+                # -uv' / v^2
+                numerator = UnaryOpNode('-', BinOpNode(u, '*', dv))
+            else:
+                numerator = BinOpNode(
+                    BinOpNode(du, '*', v),
+                    '-',
+                    BinOpNode(u, '*', dv)
+                )
             denom = BinOpNode(v, '^', NumberNode(2))
             return BinOpNode(numerator, '/', denom)
 
         # Power rule and exponential derivatives
         if self.op == '^':
-            # Case 1: (x^n)' = n * x^(n-1), n constant (power rule)
-            if isinstance(self.left, VarNode) and isinstance(self.right, NumberNode):
-                n = self.right.value
+            # Case 1: (u^n)' = n * u^(n-1) * u', n constant (power rule with chain rule)
+            n = _const_value(self.right)
+            if n is not None:
+                return BinOpNode(
+                    BinOpNode(
+                        NumberNode(n),
+                        '*',
+                        BinOpNode(self.left, '^', NumberNode(n - 1))
+                    ),
+                    '*',
+                    du
+                )
+            if dv is _ZERO:
+                # Same for an exponent that only depends on other variables, (u^y)' wrt x
                 return BinOpNode(
-                    NumberNode(n),
+                    BinOpNode(v, '*', BinOpNode(u, '^', BinOpNode(v, '-', NumberNode(1)))),
                     '*',
-                    BinOpNode(self.left, '^', NumberNode(n - 1))
+                    du
                 )
             
             # Case 2: (e^u)' = e^u * u' (exponential with base e)
             # Note: e^x should typically use exp(x), but we support e**x syntax
             # Check if base is approximately e (Euler's number)
             if isinstance(self.left, NumberNode):
-                import math
                 if abs(self.left.value - math.e) < 1e-10:
                     # d/dx(e^u) = e^u * u'
                     return BinOpNode(
                         BinOpNode(self.left, '^', self.right),
                         '*',
-                        self.right.diff(var)
+                        dv
                     )
             
             # Case 3: (a^u)' = ln(a) * a^u * u', a constant (general exponential)
@@ -226,7 +1035,7 @@ class BinOpNode(Node):
                     return BinOpNode(
                         BinOpNode(ln_a, '*', a_power_u),
                         '*',
-                        self.right.diff(var)
+                        dv
                     )
             
             # Case 4: (u^v)' - general case using logarithmic differentiation
@@ -238,14 +1047,15 @@ class BinOpNode(Node):
 
         raise NotImplementedError(f"Unknown op {self.op}")
 
-    def to_str(self):
+    def _str_parts(self):
         # convert '^' to Python '**'
         op = '**' if self.op == '^' else self.op
-        left_str = self.left.to_str()
-        right_str = self.right.to_str()
         
         # Remove unnecessary parentheses for simple operands
-        if isinstance(self.left, (NumberNode, VarNode, FuncNode)):
+        if self.op == '^' and self._is_negative(self.left):
+            # A negated base needs parentheses, -x**2 would read as -(x**2)
+            left_paren = True
+        elif isinstance(self.left, (NumberNode, VarNode, FuncNode)):
             left_paren = False
         elif isinstance(self.left, BinOpNode) and self._needs_paren(self.left, self.op, True):
             left_paren = True
@@ -259,16 +1069,22 @@ class BinOpNode(Node):
         else:
             right_paren = False
         
-        left_fmt = f"({left_str})" if left_paren else left_str
-        right_fmt = f"({right_str})" if right_paren else right_str
+        left_fmt = ('(', self.left, ')') if left_paren else (self.left,)
+        right_fmt = ('(', self.right, ')') if right_paren else (self.right,)
         
         # Add spaces only for addition and subtraction
         if self.op in ('+', '-'):
-            return f"{left_fmt} {op} {right_fmt}"
+            return left_fmt + (f" {op} ",) + right_fmt
         else:
             # No spaces for multiplication, division, and exponentiation
-            return f"{left_fmt}{op}{right_fmt}"
-    
+            return left_fmt + (op,) + right_fmt
+
+    def _is_negative(self, child):
+        # True for nodes that print with a leading minus sign
+        if isinstance(child, UnaryOpNode):
+            return True
+        return isinstance(child, NumberNode) and child.value < 0
+
     def _needs_paren(self, child, parent_op, is_left):
         # Determine if child needs parentheses based on operator precedence
         if not isinstance(child, BinOpNode):
@@ -292,318 +1108,3020 @@ class BinOpNode(Node):
                 return not is_left
         return False
     
-    def simplify(self):
-        left = self.left.simplify()
-        right = self.right.simplify()
-        
-        # Handle zeros
+    def _simplify(self, s, ctx):
+        if self.op in ('+', '-'):
+            # Terms are added into the left operand's poly when nothing else uses it, so a
+            # long chain of additions is collected in linear time
+            sign = 1 if self.op == '+' else -1
+            return ctx.add(ctx.take(self.left, s), s[self.right], sign)
         if self.op == '*':
-            # 0 * anything = 0, anything * 0 = 0
-            if isinstance(left, NumberNode) and left.value == 0:
-                return NumberNode(0)
-            if isinstance(right, NumberNode) and right.value == 0:
-                return NumberNode(0)
-            # 1 * x = x, x * 1 = x
-            if isinstance(left, NumberNode) and left.value == 1:
-                return right
-            if isinstance(right, NumberNode) and right.value == 1:
-                return left
-        
+            return ctx.mul(s[self.left], s[self.right])
+        if self.op == '/':
+            # a/b = a*b**-1
+            return ctx.mul(s[self.left], ctx.pow(s[self.right], -1))
+        if self.op == '^':
+            n = ctx.value(s[self.right])
+            if n is not None:
+                return ctx.pow(s[self.left], n)
+            return ctx.atom(BinOpNode(ctx.to_node(s[self.left]), '^', ctx.to_node(s[self.right])))
+        raise NotImplementedError(f"Unknown op {self.op}")
+
+    def _py(self, src):
+        op = '**' if self.op == '^' else self.op
+        return f"({src[self.left]}{op}{src[self.right]})"
+
+    def _adjoint(self, src, adj):
+        u, w, v = src[self.left], src[self.right], src[self]
         if self.op == '+':
-            # 0 + x = x, x + 0 = x
-            if isinstance(left, NumberNode) and left.value == 0:
-                return right
-            if isinstance(right, NumberNode) and right.value == 0:
-                return left
-            # Combine constant numbers
-            if isinstance(left, NumberNode) and isinstance(right, NumberNode):
-                return NumberNode(left.value + right.value)
-            # Collect and combine constants in addition chains
-            # Only do this if left is already an addition (to avoid infinite recursion)
-            if isinstance(left, BinOpNode) and left.op == '+':
-                terms = self._collect_add_terms(left, right)
-                constants = [t for t in terms if isinstance(t, NumberNode)]
-                non_constants = [t for t in terms if not isinstance(t, NumberNode)]
-                const_sum = sum(c.value for c in constants)
-                if const_sum != 0:
-                    non_constants.append(NumberNode(const_sum))
-                if len(non_constants) == 0:
-                    return NumberNode(0)
-                if len(non_constants) == 1:
-                    return non_constants[0]
-                # Rebuild addition chain (don't simplify again to avoid recursion)
-                result = non_constants[0]
-                for term in non_constants[1:]:
-                    result = BinOpNode(result, '+', term)
-                return result
-        
+            return ((self.left, adj), (self.right, adj))
         if self.op == '-':
-            # x - 0 = x
-            if isinstance(right, NumberNode) and right.value == 0:
-                return left
-            # 0 - x = -x
-            if isinstance(left, NumberNode) and left.value == 0:
-                return UnaryOpNode('-', right).simplify()
-            # Combine constant numbers
-            if isinstance(left, NumberNode) and isinstance(right, NumberNode):
-                return NumberNode(left.value - right.value)
-        
+            return ((self.left, adj), (self.right, f"(-{adj})"))
+        if self.op == '*':
+            return ((self.left, _times(adj, w)), (self.right, _times(adj, u)))
         if self.op == '/':
-            # 0 / x = 0 (x != 0)
-            if isinstance(left, NumberNode) and left.value == 0:
-                return NumberNode(0)
-            # x / 1 = x
-            if isinstance(right, NumberNode) and right.value == 1:
-                return left
-        
+            # d(u/w)/dw = -(u/w)/w
+            return ((self.left, f"({adj}/{w})"), (self.right, f"(-{adj}*{v}/{w})"))
         if self.op == '^':
-            # x^0 = 1
-            if isinstance(right, NumberNode) and right.value == 0:
-                return NumberNode(1)
-            # x^1 = x
-            if isinstance(right, NumberNode) and right.value == 1:
-                return left
-            # 1^x = 1
-            if isinstance(left, NumberNode) and left.value == 1:
-                return NumberNode(1)
-            # 0^x = 0 (x > 0)
-            if isinstance(left, NumberNode) and left.value == 0:
-                return NumberNode(0)
-        
-        return BinOpNode(left, self.op, right)
-    
-    def _collect_add_terms(self, left, right):
-        # Collect all terms in an addition/subtraction chain
-        # Recursively extracts all operands from nested addition operations
-        terms = []
-        # Collect from left side - if it's an addition, recurse; otherwise add it
-        if isinstance(left, BinOpNode) and left.op == '+':
-            terms.extend(self._collect_add_terms(left.left, left.right))
-        else:
-            terms.append(left)
-        # Add right side term
-        terms.append(right)
-        return terms
+            n = _const_value(self.right)
+            if n is not None:
+                # n*u**(n-1)
+                power = u if n == 2 else f"{u}**{NumberNode(n - 1)._py(src)}"
+                return ((self.left, _times(adj, f"{NumberNode(n)._py(src)}*{power}")),)
+            # d(u**w)/du = w*u**(w-1), d(u**w)/dw = u**w*ln(u)
+            return ((self.left, _times(adj, f"{w}*{u}**({w}-1)")),
+                    (self.right, _times(adj, f"{v}*ln({u})")))
+        raise NotImplementedError(f"Unknown op {self.op}")
+
+    def _taylor(self, var, x, t, m):
+        u, w = t[self.left], t[self.right]
+        if self.op == '+':
+            return [a + b for a, b in zip(u, w)]
+        if self.op == '-':
+            return [a - b for a, b in zip(u, w)]
+        if self.op == '*':
+            return _series_mul(u, w)
+        if self.op == '/':
+            return _series_div(u, w)
+        if self.op == '^':
+            n = _const_value(self.right)
+            if n is not None:
+                return _series_pow(u, n)
+            return _series_exp(_series_mul(w, _series_ln(u)), u[0] ** w[0])
+        raise NotImplementedError(f"Unknown op {self.op}")
+
+    def _eval_many(self, env, values):
+        return _NP_OPS[self.op](values[self.left], values[self.right])
+
+    def _interval(self, env, values):
+        if self.op == '^':
+            return _iv_pow(values[self.left], values[self.right], _const_value(self.right))
+        return _IV_OPS[self.op](values[self.left], values[self.right])
+
+
+def _const_value(node):
+    # Numeric value of a constant made of numbers, unary minus and + - * / ^, such as 2, -2
+    # (parsed as unary minus), 1/3 (how simplify writes fractional exponents) or 2**3, else
+    # None (also for powers that aren't real or would be huge, see _const_pow)
+    if isinstance(node, NumberNode):
+        return node.value
+    if node._vars:
+        return None
+    for n in _nodes(node):
+        if not (isinstance(n, (NumberNode, UnaryOpNode)) or
+                isinstance(n, BinOpNode) and n.op in _CONST_OPS):
+            return None
+    try:
+        return _fold(node, _const_visit)
+    except (ZeroDivisionError, ValueError):
+        return None
+
+
+def _const_pow(a, b):
+    # a**b for _const_value, with the limits of _power. Raises ValueError where that gives
+    # None, a non-integer result is a float like the other operations give
+    value = _power(a, b)
+    if value is None:
+        raise ValueError(f"{a!r}**{b!r} isn't folded")
+    return float(value) if isinstance(value, Fraction) else value
+
+
+_CONST_OPS = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b,
+    '^': _const_pow
+}
+
+
+def _const_visit(node, values):
+    if isinstance(node, NumberNode):
+        return node.value
+    if isinstance(node, UnaryOpNode):
+        return -values[node.operand]
+    return _CONST_OPS[node.op](values[node.left], values[node.right])
+
+
+_DIFF_RULES = {'+': 'sum', '-': 'sum', '*': 'product', '/': 'quotient', '^': 'power'}
+
+
+def _diff_rule(node):
+    # Name of the rule node._diff applies, for Instrumentation.rules
+    if isinstance(node, BinOpNode):
+        if node.op == '^' and _const_value(node.right) is None:
+            return 'exponential'
+        return _DIFF_RULES[node.op]
+    if isinstance(node, FuncNode):
+        return 'chain'
+    if isinstance(node, UnaryOpNode):
+        return 'negation'
+    if isinstance(node, VarNode):
+        return 'variable'
+    return 'constant'
+
+
+# Splits an expression into tokens in a single pass: numbers (with an optional exponent, the
+# way str() writes small and large floats, eg: 4.1e-09), names, operators (including '**')
+# and parentheses. Whitespace is skipped and any other character is matched on its own as a
+# "bad" token so the parser can report it
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d*)(?:[eE][+-]?\d+)?)
+      | (?P<name>[^\W\d]\w*)
+      | (?P<op>\*\*|[-+*/()])
+      | (?P<bad>\S)
+    )""", re.VERBOSE)
+
+# Binding power of the operators on the parser's operator stack. 'neg' is unary minus, which
+# like in Python binds looser than ** but tighter than * and /. Open parentheses ('(' and
+# 'call(' for function calls) have the lowest binding power so nothing is reduced past them
+_PRECEDENCE = {'(': 0, 'call(': 0, '+': 1, '-': 1, '*': 2, '/': 2, 'neg': 3, '^': 4}
 
 
 class Parser:
-    # Recursive descent parser for mathematical expressions
-    # Parses expressions following operator precedence: +,- < *,/ < ^
+    # Operator precedence parser for mathematical expressions
+    # Parses expressions following operator precedence: +,- < *,/ < unary - < ^
+    # The text is tokenized in one regex pass, then a single loop over the tokens builds the
+    # tree with an operand stack and an operator stack (shunting-yard) instead of recursive
+    # calls, so the nesting depth of the input is not limited by Python's recursion limit
     
     def __init__(self, text):
-        # Initialize parser with input text and position index
+        # Initialize parser with input text
         self.text = text
-        self.i = 0  # Current position in text
-    
-    def skip_ws(self):
-        # Skip whitespace characters at current position
-        t = self.text
-        while self.i < len(t) and t[self.i].isspace():
-            self.i += 1
-
-    def peek(self):
-        # Look at next character without consuming it, skipping whitespace
-        # Returns None if at end of input
-        self.skip_ws()
-        if self.i >= len(self.text):
-            return None
-        return self.text[self.i]
-
-    def consume(self, ch=None):
-        # Consume and return next character, skipping whitespace
-        # If ch is provided, raises error if character doesn't match
-        # Returns None if at end of input
-        self.skip_ws()
-        if self.i >= len(self.text):
-            return None
-        c = self.text[self.i]
-        if ch is not None and c != ch:
-            raise ValueError(f"Expected '{ch}' but got '{c}'")
-        self.i += 1
-        return c
-    
-    def parse_number(self):
-        # Parse a numeric literal (integer or float)
-        # Handles decimal point and ensures valid number format
-        self.skip_ws()
-        t = self.text
-        start = self.i
-        dot_seen = False  # Track if we've seen a decimal point
-        # Consume digits and at most one decimal point
-        while self.i < len(t) and (t[self.i].isdigit() or (t[self.i] == '.' and not dot_seen)):
-            if t[self.i] == '.':
-                dot_seen = True
-            self.i += 1
-        if start == self.i:
-            raise ValueError("Number Expected")
-        return NumberNode(float(t[start:self.i]))
-
-    def parse_name(self):
-        # Parse a variable name (identifier)
-        # Must start with letter or underscore, followed by alphanumeric or underscore
-        self.skip_ws()
-        t = self.text
-        start = self.i
-        # First character must be letter or underscore
-        if self.i < len(t) and (t[self.i].isalpha() or t[self.i] == '_'):
-            self.i += 1
-            # Subsequent characters can be alphanumeric or underscore
-            while self.i < len(t) and (t[self.i].isalnum() or t[self.i] == '_'):
-                self.i += 1
-        else:
-            raise ValueError("Name expected")
-        return VarNode(t[start:self.i])
-
-    def parse_atom(self):
-        # Parse an atomic expression: number, variable, function call, parenthesized expression, or unary minus
-        # Atoms are the base case for recursive parsing
-        self.skip_ws()
-        c = self.peek()
-        if c is None:
-            raise ValueError("Unexpected end of input")
-
-        # Parse number if starts with digit or decimal point
-        if c.isdigit() or c == '.':
-            return self.parse_number()
-
-        # Parse variable name or function call if starts with letter or underscore
-        if c.isalpha() or c == '_':
-            # Check if it's a function call (followed by '(')
-            start_pos = self.i
-            name = self.parse_name()
-            self.skip_ws()
-            # If next character is '(', it's a function call
-            if self.i < len(self.text) and self.text[self.i] == '(':
-                # It's a function call, not just a variable
-                # Reset position and parse as function
-                self.i = start_pos
-                return self.parse_function_call()
-            # Otherwise it's just a variable
-            return name
-
-        # Parse parenthesized expression: (expr)
-        if c == '(':
-            self.consume('(')
-            node = self.parse_expr()
-            self.consume(')')
-            return node
-
-        # Parse unary minus: -atom
-        if c == '-':
-            self.consume('-')
-            node = self.parse_atom()
-            return UnaryOpNode('-', node)
-
-        raise ValueError(f"Unexpected character: {c}")
-    
-    def parse_function_call(self):
-        # Parse a function call: func_name(expr)
-        # Supported functions: sin, cos, tan, sec, cot, csc, exp, ln, log
-        func_name = self.parse_name().name
-        self.consume('(')
-        arg = self.parse_expr()
-        self.consume(')')
-        return FuncNode(func_name, arg)
-
-    def parse_power(self):
-        # Parse exponentiation operations (right-associative)
-        # Handles Python's ** operator, converts to internal ^ representation
-        node = self.parse_atom()
-        while True:
-            self.skip_ws()
-            # Look for '**' (Python exponentiation operator)
-            if self.text[self.i:self.i + 2] == '**':
-                self.i += 2
-                right = self.parse_atom()
-                node = BinOpNode(node, '^', right)
-            else:
-                break
-        return node
-
-    def parse_term(self):
-        # Parse multiplication and division operations (left-associative)
-        # Terms are built from power expressions
-        node = self.parse_power()
-        while True:
-            c = self.peek()
-            if c in ('*', '/'):
-                op = self.consume()
-                right = self.parse_power()
-                node = BinOpNode(node, op, right)
-            else:
-                break
-        return node
 
-    def parse_expr(self):
-        # Parse addition and subtraction operations (left-associative)
-        # Expressions are built from terms
-        # This is the top-level expression parser
-        node = self.parse_term()
-        while True:
-            c = self.peek()
-            if c in ('+', '-'):
-                op = self.consume()
-                right = self.parse_term()
-                node = BinOpNode(node, op, right)
-            else:
-                break
-        return node
+    def tokenize(self):
+        # Returns a list of (number, name, op, bad) tuples with exactly one field non-empty,
+        # except for a possible final all-empty tuple matching trailing whitespace
+        return _TOKEN_RE.findall(self.text)
 
     def parse(self):
         # Main entry point: parse entire expression and verify no trailing characters
-        node = self.parse_expr()
-        self.skip_ws()
-        if self.i != len(self.text):
-            raise ValueError("Unexpected trailing characters")
-        return node
+        if instrumentation is not None:
+            return instrumentation.parse(self)
+        return self._parse()
+
+    def _parse(self):
+        tokens = self.tokenize()
+        operands = []   # finished subtrees
+        operators = []  # pending operators, see _PRECEDENCE
+        calls = []      # names of the functions whose 'call(' is on the operator stack
+        precedence = _PRECEDENCE
+        expect_operand = True
+        i = 0
+        n = len(tokens)
+        while i < n:
+            number, name, op, bad = tokens[i]
+            i += 1
+            if expect_operand:
+                if number:
+                    # Integer literals stay exact, like they are in Python
+                    value = int(number) if number.isdigit() else float(number)
+                    if isinstance(value, float) and not math.isfinite(value):
+                        # 1e400 would be inf, which no expression can write back
+                        raise ValueError(f"Number out of range: {number}")
+                    operands.append(NumberNode(value))
+                    expect_operand = False
+                elif name:
+                    if i < n and tokens[i][2] == '(':
+                        # A name directly followed by '(' is a function call
+                        operators.append('call(')
+                        calls.append(name)
+                        i += 1
+                    else:
+                        operands.append(VarNode(name))
+                        expect_operand = False
+                elif op == '(':
+                    operators.append('(')
+                elif op == '-':
+                    operators.append('neg')
+                elif op or bad:
+                    raise ValueError(f"Unexpected character: {op or bad}")
+            elif op == ')':
+                while operators and precedence[operators[-1]] > 0:
+                    self._reduce(operators.pop(), operands)
+                if not operators:
+                    raise ValueError("Unexpected trailing characters")
+                if operators.pop() == 'call(':
+                    operands[-1] = FuncNode(calls.pop(), operands[-1])
+            elif op == '**':
+                # Right-associative and binds tightest, nothing on the stack gets reduced
+                operators.append('^')
+                expect_operand = True
+            elif op and op != '(':
+                # Finish the operators that bind at least as tightly before pushing this one
+                prec = precedence[op]
+                while operators and precedence[operators[-1]] >= prec:
+                    self._reduce(operators.pop(), operands)
+                operators.append(op)
+                expect_operand = True
+            elif number or name or op or bad:
+                raise ValueError("Unexpected trailing characters")
+        if expect_operand:
+            raise ValueError("Unexpected end of input")
+        while operators:
+            op = operators.pop()
+            if precedence[op] == 0:
+                raise ValueError("Expected ')' but got end of input")
+            self._reduce(op, operands)
+        return operands[0]
+
+    def _reduce(self, op, operands):
+        # Replaces the operand(s) on top of the stack with the node for op
+        if op == 'neg':
+            operands[-1] = UnaryOpNode('-', operands[-1])
+        else:
+            right = operands.pop()
+            operands[-1] = BinOpNode(operands[-1], op, right)
     
     
 
 def symbolic_diff_expr(expr: str, var: str) -> str:
     # Takes an expression string in python syntax and return a new string representing its derivatve with respect to 'var'
-    tree = Parser(expr).parse()
-    d = tree.diff(var)
-    simplified = d.simplify()
-    return simplified.to_str()
+    # Results are memoized in expr_diff_cache, and in disk_diff_cache if one is set. That
+    # is keyed on the expression as the parser reads it (printed back with to_str), so
+    # "x**2+1" and "x ** 2 + 1" share an entry. Expressions not already written that way
+    # are also stored as they were given, so looking them up again needs no parsing
+    key = (expr, var)
+    result = expr_diff_cache.get(key)
+    if result is None:
+        disk = disk_diff_cache
+        if disk is not None:
+            result = disk.get(key)
+        if result is None:
+            tree = Parser(expr).parse()
+            if disk is not None:
+                disk_key = (tree.to_str(), var)
+                if disk_key != key:
+                    result = disk.get(disk_key)
+            if result is None:
+                d = tree.diff(var)
+                simplified = d.simplify()
+                result = simplified.to_str()
+                if disk is not None:
+                    disk.put(disk_key, result)
+            if disk is not None and disk_key != key:
+                disk.put(key, result)
+        expr_diff_cache.put(key, result)
+    return result
 
 
-class MathFunc:
-    def __init__(self, expr: str, var:str):
-        self.expr = expr    # string to eval, eg: "x**3 + 2*x + 1"
-        self.var = var      # variable name, eg: "x"
-    
-    def __call__(self, value):
-        # Evaluates the expression with the variable bound to the value
-        import math
-        # Provide math functions for evaluation
-        env = {
-            self.var: value,
-            'sin': math.sin,
-            'cos': math.cos,
-            'tan': math.tan,
-            'sec': lambda x: 1 / math.cos(x),
-            'cot': lambda x: 1 / math.tan(x),
-            'csc': lambda x: 1 / math.sin(x),
-            'exp': math.exp,
-            'ln': math.log,
-            'log': math.log,
-            'e': math.e,
-            'pi': math.pi
-        }
-        return eval(self.expr, {"__builtins__": {}}, env)
+# Limits for Simplifier. Products of two sums with more cross terms than MAX_EXPAND_TERMS
+# aren't multiplied out and a product with more than MAX_TERM_FACTORS factors is split into
+# nested products, both keep the work per node bounded. SIMPLIFY_BUDGET caps the total work
+# of one simplify call (nodes visited plus terms multiplied), once it is spent sums are no
+# longer multiplied out and no further passes are made
+MAX_EXPAND_TERMS = 64
+MAX_TERM_FACTORS = 64
+SIMPLIFY_BUDGET = 1000000
+SIMPLIFY_PASSES = 4
 
-    def __str__(self):
-        return self.expr
 
+class Simplifier:
+    # Rewrites an expression into a canonical sum of products:
+    #  - sums and products are flattened, so the grouping of + and * chains doesn't matter
+    #  - like terms are combined and powers of the same base merged, eg: 2*x + x*3 -> 5*x,
+    #    x*x**2 -> x**3 and x*sin(x) - sin(x)*x -> 0
+    #  - constants are folded, including through functions and unary minus, eg:
+    #    -(2*3) -> -6 and ln(1) -> 0. Integer coefficients stay exact, 2*x/3 isn't rounded
+    #  - products of sums are multiplied out (up to MAX_EXPAND_TERMS cross terms)
+    #  - terms and factors are sorted into a canonical order, so eg: y + x and x + y
+    #    simplify to the same node
+    # When turning the result back into a node, factors shared by every term of a sum are
+    # pulled out in front of it, eg: x**2*exp(x) + 2*x*exp(x) -> x*exp(x)*(x + 2), and so
+    # is a common integer (or fraction) factor of the coefficients, 2*x + 4 -> 2*(x + 2).
+    # Sums that only differ by such factors then share one node for the sum.
+    # run() repeats this until the expression stops changing (at most SIMPLIFY_PASSES times)
+    # or the work budget is spent
+    #
+    # Expressions are simplified as "polys": dicts mapping a term key to a (coefficient,
+    # factors) pair where factors maps each base node to its exponent, eg: 3*x**2*sin(x) is
+    # {key: (3, {x: 2, sin(x): 1})}. The key is the frozenset of the factors, so like terms
+    # land on the same entry. Interning means equal bases are the same node object.
 
-def func(expr: str, var: str) -> MathFunc:
-    # creates a symbolic function of one variable
-    # ex: y = func("x + 1","x")
-    return MathFunc(expr, var)
+    def __init__(self, budget=None):
+        self.budget = SIMPLIFY_BUDGET if budget is None else budget
+        self.work = 0
+        self._uses = {}  # number of parents of each node in the expression being simplified
+        self._keys = {}  # sort key of each node, see _key
+        # How often each rewrite fired: 'pass' (passes over the expression), 'fold' (a
+        # function of a constant folded to a number), 'expand' (a product of two sums
+        # multiplied out), 'opaque' (one with too many cross terms kept as a product),
+        # 'nest' (a factor list grown past MAX_TERM_FACTORS nested), 'power' (a power of a
+        # term distributed over its factors or folded) and 'factor' (common factors or
+        # coefficients pulled out of a sum)
+        self.rewrites = Counter()
 
+    def run(self, node):
+        return self.run_all([node])[0]
 
-def diff(f: MathFunc, var: str) -> MathFunc:
-    # Differentiate f with resprect to 'var' and return another mathmatical function
-    # ex: dydx = diff(y, "x")
-    d_expr = symbolic_diff_expr(f.expr, var)
-    return MathFunc(d_expr, var)
+    def run_all(self, nodes):
+        # Simplifies several expressions together, subexpressions they share are simplified
+        # once for all of them. Returns the list of results.
+        nodes = list(nodes)
+        if instrumentation is not None:
+            return instrumentation.simplify(self, nodes)
+        return self._run_all(nodes)
+
+    def _run_all(self, nodes):
+        for _ in range(SIMPLIFY_PASSES):
+            self.rewrites['pass'] += 1
+            results = self.simplify_once(nodes)
+            if self.work >= self.budget or all(r is n for r, n in zip(results, nodes)):
+                return results
+            nodes = results
+        return nodes
+
+    def simplify_once(self, nodes):
+        # One bottom-up pass over each of nodes
+        uses = {}
+        for n in _nodes(*nodes):
+            for child in n.children():
+                uses[child] = uses.get(child, 0) + 1
+        for root in nodes:
+            uses[root] = uses.get(root, 0) + 1
+        self._uses = uses
+
+        def visit(n, polys):
+            self.work += 1
+            return n._simplify(polys, self)
+        polys = {}
+        for root in nodes:
+            _fold(root, visit, results=polys)
+        return [self.to_node(polys[root]) for root in nodes]
+
+    # Building polys
+
+    def constant(self, value):
+        value = _exact(value)
+        return {_CONST_KEY: (value, {})} if value != 0 else {}
+
+    def atom(self, node, exp=1):
+        # A poly holding the single factor node**exp
+        factors = {node: exp}
+        return {_term_key(factors): (1, factors)}
+
+    def value(self, poly):
+        # The number poly stands for, None if it isn't a constant
+        if not poly:
+            return 0
+        if len(poly) == 1 and _CONST_KEY in poly:
+            return poly[_CONST_KEY][0]
+        return None
+
+    def take(self, node, polys):
+        # node's poly, copied unless node has only one parent (which may then modify it)
+        poly = polys[node]
+        return poly if self._uses.get(node, 0) <= 1 else dict(poly)
+
+    def negate(self, poly):
+        # Negates poly in place
+        for key, (coeff, factors) in poly.items():
+            poly[key] = (-coeff, factors)
+        return poly
+
+    def add(self, p, q, sign=1):
+        # Adds sign*q into p in place
+        for key, (coeff, factors) in q.items():
+            _poly_add_term(p, sign * coeff, factors, key)
+        return p
+
+    def mul(self, p, q):
+        if len(p) > 1 and len(q) > 1:
+            if len(p) * len(q) > MAX_EXPAND_TERMS or self.work >= self.budget:
+                # Too many cross terms, multiply the sums as opaque factors instead
+                self.rewrites['opaque'] += 1
+                p = self.atom(self.to_node(p))
+                q = self.atom(self.to_node(q))
+            else:
+                self.rewrites['expand'] += 1
+        self.work += len(p) * len(q)
+        result = {}
+        for coeff_a, factors_a in p.values():
+            for coeff_b, factors_b in q.values():
+                # Copy the bigger side and merge the smaller one into it
+                big, small = factors_a, factors_b
+                if len(big) < len(small):
+                    big, small = small, big
+                factors = dict(big)
+                for base, exp in small.items():
+                    total = factors.get(base, 0) + exp
+                    if total == 0:
+                        del factors[base]
+                    else:
+                        factors[base] = total
+                if len(factors) > MAX_TERM_FACTORS:
+                    # Keep the bigger side as one nested product, so long chain rule products
+                    # don't copy an ever growing factor list at every step
+                    self.rewrites['nest'] += 1
+                    node = self._term_node(1, self._sorted(big))
+                    factors = dict(small)
+                    factors[node] = factors.get(node, 0) + 1
+                _poly_add_term(result, _exact(coeff_a * coeff_b), factors)
+        return result
+
+    def pow(self, p, n):
+        # p**n for a number n
+        if n == 0:
+            # x**0 = 1, like Python this includes 0**0
+            return self.constant(1)
+        if not p:
+            # 0**n = 0 for n > 0, a negative power of zero is left for evaluation to report
+            if n > 0:
+                return {}
+            return self.atom(NumberNode(0), n)
+        if len(p) == 1:
+            ((coeff, factors),) = p.values()
+            if _is_integer(n):
+                # (c*a**i*b**j)**n = c**n * a**(i*n) * b**(j*n), only safe for integer n
+                n = int(n)
+                coeff = _power(coeff, n)
+                if coeff is not None:
+                    self.rewrites['power'] += 1
+                    factors = {base: exp * n for base, exp in factors.items()}
+                    return {_term_key(factors): (coeff, factors)}
+            elif not factors:
+                value = _power(coeff, n)
+                if value is not None:
+                    self.rewrites['power'] += 1
+                    return self.constant(value)
+            elif coeff == 1 and len(factors) == 1 and 1 in factors.values():
+                # a**n for a single base, so it merges with other powers of a
+                (base,) = factors
+                return self.atom(base, n)
+        return self.atom(self.to_node(p), n)
+
+    # Turning polys back into nodes
+
+    def to_node(self, poly):
+        if not poly:
+            return NumberNode(0)
+        terms = [(coeff, self._sorted(factors)) for coeff, factors in poly.values()]
+        if len(terms) > 1:
+            common = self._common_factors(terms)
+            content = _content(coeff for coeff, items in terms)
+            if common or content != 1:
+                self.rewrites['factor'] += 1
+                rest = {}
+                for coeff, items in terms:
+                    factors = {base: exp - common.get(base, 0) for base, exp in items
+                               if exp != common.get(base, 0)}
+                    if content != 1:
+                        coeff = _exact(Fraction(coeff) / content)
+                    _poly_add_term(rest, coeff, factors)
+                if content != 1:
+                    lead = min(((c, self._sorted(f)) for c, f in rest.values()),
+                               key=self._term_order)
+                    if lead[0] < 0:
+                        # The sum is written with its first term positive, so that c*s and
+                        # -c*s give the same node for s
+                        content = -content
+                        self.negate(rest)
+                return self._term_node(content, self._sorted(common), self.to_node(rest))
+        terms.sort(key=self._term_order)
+        if terms[0][0] < 0 and not terms[-1][1] and terms[-1][0] > 0:
+            # A positive constant goes first rather than a negative term, 1 - x not -x + 1
+            terms.insert(0, terms.pop())
+        result = None
+        for coeff, items in terms:
+            if result is not None:
+                op = '-' if coeff < 0 else '+'
+                result = BinOpNode(result, op, self._term_node(abs(coeff), items))
+            elif coeff == -1 and items:
+                result = UnaryOpNode('-', self._term_node(1, items))
+            else:
+                result = self._term_node(coeff, items)
+        return result
+
+    def _common_factors(self, terms):
+        # Factors every term has, with the smallest power they appear with (only bases that
+        # have the same sign of exponent in every term)
+        common = dict(terms[0][1])
+        for coeff, items in terms[1:]:
+            factors = dict(items)
+            for base, exp in list(common.items()):
+                other = factors.get(base)
+                if other is None or (other > 0) != (exp > 0):
+                    del common[base]
+                elif abs(other) < abs(exp):
+                    common[base] = other
+            if not common:
+                break
+        return common
+
+    def _term_node(self, coeff, items, extra=None):
+        # coeff * (positive powers) * extra / (negative powers), items is a sorted list of
+        # (base, exp) pairs
+        if isinstance(coeff, Fraction):
+            numerator = [] if coeff.numerator == 1 else [NumberNode(coeff.numerator)]
+            denominator = [] if coeff.denominator == 1 else [NumberNode(coeff.denominator)]
+        else:
+            numerator = [] if coeff == 1 else [_number_node(coeff)]
+            denominator = []
+        for base, exp in items:
+            if exp > 0:
+                numerator.append(_factor_node(base, exp))
+            else:
+                denominator.append(_factor_node(base, -exp))
+        if extra is not None:
+            numerator.append(extra)
+        result = _product(numerator) or NumberNode(1)
+        if denominator:
+            result = BinOpNode(result, '/', _product(denominator))
+        return result
+
+    def _sorted(self, factors):
+        # factors as a list of (base, exp) pairs in canonical order
+        key = self._key
+        return sorted(factors.items(), key=lambda item: (key(item[0]), -item[1]))
+
+    def _term_order(self, term):
+        # Terms are ordered by their factors, highest powers first, with the constant last
+        coeff, items = term
+        key = self._key
+        return (not items, [(key(base), -exp) for base, exp in items])
+
+    def _key(self, node):
+        # Sort key of a node: (kind, name or value, structural hash). The hash is computed
+        # with crc32 rather than hash() so the order is the same in every process
+        key = self._keys.get(node)
+        if key is None:
+            key = _fold(node, self._make_key, self._keys.get)
+        return key
+
+    def _make_key(self, node, keys):
+        if isinstance(node, NumberNode):
+            # 2 and 2.0 are different nodes (see NumberNode) but the same number, so both
+            # give the same key
+            kind, name = 0, node.value
+            if isinstance(name, float) and name.is_integer():
+                name = int(name)
+        elif isinstance(node, VarNode):
+            kind, name = 1, node.name
+        elif isinstance(node, FuncNode):
+            kind, name = 2, node.func_name
+        elif isinstance(node, BinOpNode):
+            kind, name = 3, node.op
+        else:
+            kind, name = 4, node.op
+        children = [keys[child][2] for child in node.children()]
+        key = (kind, name, zlib.crc32(repr((kind, name, children)).encode()))
+        self._keys[node] = key
+        return key
+
+
+def _term_key(factors):
+    return frozenset(factors.items())
+
+
+# Key of the constant term
+_CONST_KEY = _term_key({})
+
+
+def _poly_add_term(result, coeff, factors, key=None):
+    # Adds coeff*factors into result in place
+    if key is None:
+        key = _term_key(factors)
+    if key in result:
+        total = result[key][0] + coeff
+        if total == 0:
+            del result[key]
+        else:
+            result[key] = (total, factors)
+    elif coeff != 0:
+        result[key] = (coeff, factors)
+
+
+def _exact(value):
+    # Integer valued numbers become ints, so coefficient arithmetic stays exact (division
+    # makes a Fraction, see _power) instead of collecting rounding errors. Exact values that
+    # outgrow a float's 53 bits of precision go back to floats, so repeated multiplication
+    # doesn't build huge integers
+    if type(value) is int and -_EXACT_LIMIT < value < _EXACT_LIMIT:
+        return value
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < _EXACT_LIMIT:
+            return int(value)
+        return value
+    if isinstance(value, Fraction):
+        if value.denominator == 1:
+            value = value.numerator
+        elif abs(value.numerator) < _EXACT_LIMIT and value.denominator < _EXACT_LIMIT:
+            return value
+    if abs(value) < _EXACT_LIMIT:
+        return value
+    try:
+        return float(value)
+    except OverflowError:
+        # Too big for a float (a literal like 10**400 written out), kept exact
+        return value
+
+
+_EXACT_LIMIT = 2 ** 53
+
+
+def _content(coeffs):
+    # Largest number that divides every coefficient into an integer (gcd of the numerators
+    # over lcm of the denominators), 1 if any coefficient is a float
+    numerator, denominator = 0, 1
+    for coeff in coeffs:
+        if isinstance(coeff, float):
+            return 1
+        coeff = Fraction(coeff)
+        numerator = math.gcd(numerator, coeff.numerator)
+        denominator = math.lcm(denominator, coeff.denominator)
+    return _exact(Fraction(numerator, denominator))
+
+
+def _is_integer(n):
+    if isinstance(n, float):
+        return n.is_integer()
+    return isinstance(n, int) or n.denominator == 1
+
+
+def _power(coeff, n):
+    # coeff**n as an exact number where possible, None if it can't be computed as a real
+    # or an exact result would outgrow _EXACT_LIMIT, which leaves the power unfolded
+    if not isinstance(coeff, float) and _is_integer(n) and coeff not in (0, 1, -1):
+        coeff = Fraction(coeff)
+        size = max(abs(coeff.numerator), coeff.denominator)
+        if abs(n) * math.log2(size) > _EXACT_LIMIT.bit_length() - 1:
+            return None
+    try:
+        result = Fraction(coeff) ** n if isinstance(coeff, int) else coeff ** n
+    except (OverflowError, ZeroDivisionError):
+        return None
+    if isinstance(result, complex):
+        return None
+    return _exact(result)
+
+
+def _fold_call(name, value):
+    # name(value) as a number, None for unknown functions or values outside their domain
+    f = EVAL_GLOBALS.get(name) if name != '__builtins__' else None
+    if not callable(f):
+        return None
+    try:
+        result = f(float(value))
+    except (ValueError, OverflowError, ZeroDivisionError):
+        return None
+    if not math.isfinite(result):
+        return None
+    return _exact(result)
+
+
+def _number_node(value):
+    # Node for a number, a non-integer Fraction becomes p/q so it prints exactly. Folding
+    # constants out of a float's range (1e308*10) gives inf or nan, which the parser can't
+    # read back, so that raises ValueError
+    value = _exact(value)
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError(f"Constant out of range: {value}")
+    if isinstance(value, Fraction):
+        return BinOpNode(NumberNode(value.numerator), '/', NumberNode(value.denominator))
+    return NumberNode(value)
+
+
+def _factor_node(base, exp):
+    if exp == 1:
+        return base
+    return BinOpNode(base, '^', _number_node(exp))
+
+
+def _product(factors):
+    # Left-nested product of a list of nodes, None for an empty list
+    result = None
+    for factor in factors:
+        result = factor if result is None else BinOpNode(result, '*', factor)
+    return result
+
+
+def nth_derivative(tree, var, n):
+    # n-th derivative of an expression tree with respect to 'var'
+    # Stays in the tree between orders and simplifies after each one, so derivatives of
+    # things like x**2*sin(x) or exp(x)/x stay small instead of doubling every order
+    if n < 0:
+        raise ValueError("Derivative order must be non-negative")
+    for _ in range(n):
+        tree = tree.diff(var).simplify()
+    return tree
+
+
+def _sec(x):
+    return 1 / math.cos(x)
+
+
+def _cot(x):
+    return 1 / math.tan(x)
+
+
+def _csc(x):
+    return 1 / math.sin(x)
+
+
+# Names available to evaluated expressions. Built once at import time so that
+# evaluating a function doesn't rebuild the environment on every call.
+EVAL_GLOBALS = {
+    '__builtins__': {},
+    'sin': math.sin,
+    'cos': math.cos,
+    'tan': math.tan,
+    'sec': _sec,
+    'cot': _cot,
+    'csc': _csc,
+    'exp': math.exp,
+    'ln': math.log,
+    'log': math.log,
+    'e': math.e,
+    'pi': math.pi
+}
+
+
+def _lookup(name):
+    # Resolve a free name the same way eval would against EVAL_GLOBALS
+    if name == '__builtins__' or name not in EVAL_GLOBALS:
+        raise NameError(f"name '{name}' is not defined")
+    return EVAL_GLOBALS[name]
+
+
+# NumPy versions of the operations, used by eval_many to work on whole arrays
+if np is not None:
+    _NP_FUNCS = {
+        'sin': np.sin,
+        'cos': np.cos,
+        'tan': np.tan,
+        'sec': lambda a: 1 / np.cos(a),
+        'cot': lambda a: 1 / np.tan(a),
+        'csc': lambda a: 1 / np.sin(a),
+        'exp': np.exp,
+        'ln': np.log,
+        'log': np.log
+    }
+    _NP_OPS = {
+        '+': np.add,
+        '-': np.subtract,
+        '*': np.multiply,
+        '/': np.true_divide,
+        '^': np.power
+    }
+
+
+# Interval arithmetic, used by Node.interval and bounds. An interval is an Interval(lo, hi)
+# of floats, lo <= hi, that may be infinite (lo is never inf and hi never -inf). Every
+# operation rounds its result outwards by a unit in the last place, so it contains the
+# exact result for every point of the arguments even though the ends are computed in
+# floating point. Where a function is defined on only part of an interval (ln of an
+# interval reaching 0, division by one containing 0) the result covers the values on that
+# part, which are unbounded next to a pole. A function defined nowhere on its argument
+# raises ValueError.
+Interval = namedtuple('Interval', ['lo', 'hi'])
+
+_INF = math.inf
+_MAX = sys.float_info.max
+_IV_WHOLE = Interval(-_INF, _INF)
+_IV_ONE = Interval(1.0, 1.0)
+_IV_TRIG = Interval(-1.0, 1.0)
+
+
+def _widen(lo, hi):
+    # Interval(lo, hi) rounded outwards, a nan end (from inf - inf) becomes infinite
+    lo = -_INF if lo != lo else math.nextafter(min(lo, _MAX), -_INF)
+    hi = _INF if hi != hi else math.nextafter(max(hi, -_MAX), _INF)
+    return Interval(lo, hi)
+
+
+def _iv_point(value):
+    # The interval holding just value, widened where float(value) isn't exact
+    try:
+        x = float(value)
+    except OverflowError:
+        return Interval(_MAX, _INF) if value > 0 else Interval(-_INF, -_MAX)
+    return Interval(x, x) if x == value else _widen(x, x)
+
+
+def _iv_add(a, b):
+    return _widen(a.lo + b.lo, a.hi + b.hi)
+
+
+def _iv_sub(a, b):
+    return _widen(a.lo - b.hi, a.hi - b.lo)
+
+
+def _mul0(x, y):
+    # x*y where 0 times an infinite end is 0, the end isn't a value of the interval
+    return 0.0 if x == 0 or y == 0 else x * y
+
+
+def _iv_mul(a, b):
+    products = (_mul0(a.lo, b.lo), _mul0(a.lo, b.hi), _mul0(a.hi, b.lo), _mul0(a.hi, b.hi))
+    return _widen(min(products), max(products))
+
+
+def _iv_div(a, b):
+    # a times the reciprocal of b, over the part of b that isn't 0
+    lo, hi = b
+    if lo > 0 or hi < 0:
+        inverse = _widen(1 / hi, 1 / lo)
+    elif lo == hi == 0:
+        raise ValueError("Division by zero")
+    elif lo == 0:
+        inverse = _widen(1 / hi, _INF)
+    elif hi == 0:
+        inverse = _widen(-_INF, 1 / lo)
+    else:
+        inverse = _IV_WHOLE
+    return _iv_mul(a, inverse)
+
+
+def _pow(x, n):
+    # x**n for a float x and an int n, infinite where it overflows
+    try:
+        return x ** n
+    except OverflowError:
+        return math.copysign(_INF, x) if n % 2 else _INF
+
+
+def _iv_pow(a, b, n):
+    # a**b, n is the exponent's value if it is a constant (see _const_value) or None
+    if n is None and b.lo == b.hi:
+        n = b.lo
+    finite = n is None or not isinstance(n, float) or math.isfinite(n)
+    if n is not None and finite and n == int(n):
+        n = int(n)
+        if n == 0:
+            return _IV_ONE
+        if n < 0:
+            return _iv_div(_IV_ONE, _iv_pow(a, b, -n))
+        lo, hi = _pow(a.lo, n), _pow(a.hi, n)
+        if n % 2 or a.lo >= 0:
+            return _widen(lo, hi)
+        if a.hi <= 0:
+            return _widen(hi, lo)
+        return _widen(0.0, max(lo, hi))
+    if a.lo >= 0:
+        return _iv_pow_positive(a, b, n)
+    if n is not None and finite:
+        integers = False
+    else:
+        integers = (not (math.isfinite(b.lo) and math.isfinite(b.hi)) or
+                    math.floor(b.hi) >= b.lo)
+    if not integers:
+        # A negative base to a power that is never an integer isn't real, like ln only the
+        # base's non-negative part is left
+        if a.hi < 0:
+            raise ValueError(f"Fractional powers are not real on "
+                             f"[{a.lo!r}, {a.hi!r}]")
+        return _iv_pow_positive(Interval(0.0, a.hi), b, n)
+    # A negative base to exponents that include integers (or x**inf, real for negative x):
+    # a**b is +-|a|**b where it is real, so the result covers both signs
+    magnitude = Interval(0.0 if a.hi >= 0 else -a.hi, max(-a.lo, a.hi))
+    value = _iv_pow_positive(magnitude, b, n)
+    return Interval(-value.hi, value.hi)
+
+
+def _iv_pow_positive(a, b, n):
+    # a**b for a base with a.lo >= 0, n as for _iv_pow but never an integer
+    if n is None:
+        if a.hi == 0:
+            # 0**v is 0 for v > 0, 1 for v = 0 and undefined below
+            return _widen(0.0, 0.0 if b.lo > 0 else 1.0)
+        # u**v = exp(v*ln(u)) over u > 0, and 0**v is 0 for v > 0
+        value = _iv_exp(_iv_mul(b, _iv_ln(a)))
+        return Interval(min(value.lo, 0.0), value.hi) if a.lo == 0 else value
+    try:
+        ends = (_pow(a.lo, n), _pow(a.hi, n))
+    except ZeroDivisionError:  # 0 ** negative
+        ends = (_INF, _pow(a.hi, n))
+    return _widen(min(ends), max(ends))
+
+
+def _hits(a, offset, period):
+    # True if offset + k*period lies in a for some integer k. The test is widened by more
+    # than the rounding error of computing it, so it can be true for a point just outside
+    # but never false for one inside
+    if not (math.isfinite(a.lo) and math.isfinite(a.hi)) or a.hi - a.lo >= period:
+        return True
+    slack = 1e-12 * (1 + max(abs(a.lo), abs(a.hi)) / period)
+    return (math.ceil((a.lo - offset) / period - slack) <=
+            math.floor((a.hi - offset) / period + slack))
+
+
+def _iv_sin(a):
+    if a.hi - a.lo >= 2 * math.pi or not (math.isfinite(a.lo) and math.isfinite(a.hi)):
+        return _IV_TRIG
+    ends = (math.sin(a.lo), math.sin(a.hi))
+    lo = -1.0 if _hits(a, -0.5 * math.pi, 2 * math.pi) else max(min(ends), -1.0)
+    hi = 1.0 if _hits(a, 0.5 * math.pi, 2 * math.pi) else min(max(ends), 1.0)
+    return _widen(lo, hi)
+
+
+def _iv_cos(a):
+    if a.hi - a.lo >= 2 * math.pi or not (math.isfinite(a.lo) and math.isfinite(a.hi)):
+        return _IV_TRIG
+    ends = (math.cos(a.lo), math.cos(a.hi))
+    lo = -1.0 if _hits(a, math.pi, 2 * math.pi) else max(min(ends), -1.0)
+    hi = 1.0 if _hits(a, 0.0, 2 * math.pi) else min(max(ends), 1.0)
+    return _widen(lo, hi)
+
+
+def _iv_tan(a):
+    # Increasing between the poles at pi/2 + k*pi
+    if _hits(a, 0.5 * math.pi, math.pi):
+        return _IV_WHOLE
+    return _widen(math.tan(a.lo), math.tan(a.hi))
+
+
+def _iv_cot(a):
+    # Decreasing between the poles at k*pi, cot(x) = cos(x)/sin(x) rounds twice
+    if _hits(a, 0.0, math.pi):
+        return _IV_WHOLE
+    lo, hi = _widen(_cot(a.hi), _cot(a.lo))
+    return _widen(lo, hi)
+
+
+def _exp(x):
+    # math.exp, infinite where it overflows
+    try:
+        return math.exp(x)
+    except OverflowError:
+        return _INF
+
+
+def _iv_exp(a):
+    return _widen(_exp(a.lo), _exp(a.hi))
+
+
+def _iv_ln(a):
+    if a.hi <= 0:
+        raise ValueError(f"ln is not defined on [{a.lo!r}, {a.hi!r}]")
+    return _widen(math.log(a.lo) if a.lo > 0 else -_INF, math.log(a.hi))
+
+
+_IV_FUNCS = {
+    'sin': _iv_sin,
+    'cos': _iv_cos,
+    'tan': _iv_tan,
+    'sec': lambda a: _iv_div(_IV_ONE, _iv_cos(a)),
+    'cot': _iv_cot,
+    'csc': lambda a: _iv_div(_IV_ONE, _iv_sin(a)),
+    'exp': _iv_exp,
+    'ln': _iv_ln,
+    'log': _iv_ln
+}
+_IV_OPS = {
+    '+': _iv_add,
+    '-': _iv_sub,
+    '*': _iv_mul,
+    '/': _iv_div
+}
+
+
+# Python's compiler rejects expressions nested more than a couple of hundred levels deep, so
+# lowered expressions are split into temporaries every MAX_INLINE_DEPTH levels
+MAX_INLINE_DEPTH = 50
+
+
+def _check_vars(vars):
+    # Variables become argument names of generated functions
+    for name in vars:
+        if not name.isidentifier() or keyword.iskeyword(name):
+            raise ValueError(f"Invalid variable name: {name!r}")
+    if len(set(vars)) != len(vars):
+        raise ValueError("Duplicate variable name")
+
+
+def _temp_prefix(trees, vars):
+    # Prefix for temporaries in generated code that no variable name starts with
+    names = {node.name for node in _nodes(*trees) if isinstance(node, VarNode)}
+    names.update(vars)
+    prefix = '_t'
+    while any(name.startswith(prefix) for name in names):
+        prefix = '_' + prefix
+    return prefix
+
+
+class EvalPlan:
+    # Straight-line evaluation plan for an expression, lowered to Python source
+    # With cse on, every subexpression used in more than one place (common subexpression)
+    # is computed once into a temporary and reused, eg: sec(x)*tan(x)*sec(x)**2 computes
+    # sec(x) once. Interning makes equal subtrees the same node, so these are just the nodes
+    # with more than one parent. Deeply nested code is also cut into temporaries every
+    # MAX_INLINE_DEPTH levels so the Python compiler accepts it.
+    # tree can also be a list of expressions, which are computed together and returned as a
+    # tuple (subexpressions they share are computed once), and var a sequence of variable
+    # names, which become the function's arguments in that order.
+
+    def __init__(self, tree, var, cse=True):
+        self.tree = tree
+        self.var = var
+        trees = [tree] if isinstance(tree, Node) else list(tree)
+        self.vars = (var,) if isinstance(var, str) else tuple(var)
+        _check_vars(self.vars)
+        self.temps = []  # (name, source) of each temporary, in evaluation order
+        uses = {}
+        if cse:
+            for node in _nodes(*trees):
+                for child in node.children():
+                    uses[child] = uses.get(child, 0) + 1
+            for root in trees:
+                uses[root] = uses.get(root, 0) + 1
+        prefix = _temp_prefix(trees, self.vars)
+        sources = {}
+
+        def visit(node, depths):
+            children = node.children()
+            depth = 1 + max((depths[c] for c in children), default=0)
+            src = node._py(sources)
+            if children and (uses.get(node, 0) > 1 or depth >= MAX_INLINE_DEPTH):
+                temp = f"{prefix}{len(self.temps)}"
+                self.temps.append((temp, src))
+                src, depth = temp, 0
+            sources[node] = src
+            return depth
+
+        depths = {}
+        for root in trees:
+            _fold(root, visit, results=depths)
+        if isinstance(tree, Node):
+            self.result = sources[tree]  # source of the returned expression
+        else:
+            self.result = f"({', '.join(sources[root] for root in trees)},)"
+
+    def source(self, name='f'):
+        # Python source of a function 'name'(var, ...) that evaluates the plan
+        lines = [f"def {name}({', '.join(self.vars)}):"]
+        lines.extend(f"    {temp} = {src}" for temp, src in self.temps)
+        lines.append(f"    return {self.result}")
+        return "\n".join(lines)
+
+    def compile(self):
+        # The plan as a Python function of its variables
+        namespace = {}
+        exec(compile(self.source(), '<MathFunc>', 'exec'), EVAL_GLOBALS, namespace)
+        return namespace['f']
+
+
+# Instruction set of RegisterPlan, an opcode is an index into this table of operations,
+# each with the function that does it (the same ones eval uses) and its number of arguments
+_MACHINE_OPS = ('+', '-', '*', '/', '^', 'neg', 'sin', 'cos', 'tan', 'sec', 'cot', 'csc',
+                'exp', 'ln', 'log')
+_MACHINE_OPCODES = {op: i for i, op in enumerate(_MACHINE_OPS)}
+_MACHINE_TABLE = (
+    (operator.add, 2), (operator.sub, 2), (operator.mul, 2), (operator.truediv, 2),
+    (operator.pow, 2), (operator.neg, 1)
+) + tuple((EVAL_GLOBALS[name], 1) for name in _MACHINE_OPS[6:])
+
+
+class RegisterPlan:
+    # Evaluates expressions without eval, compile or exec, for runtimes where those are
+    # blocked. The tree is lowered to a flat program for a register machine: one register
+    # per node (so shared subexpressions are computed once), holding the constants from
+    # the start, and one instruction per operation, stored in parallel arrays: ops (opcode,
+    # see _MACHINE_OPS), dst (register written) and lhs and rhs (registers read, rhs unused
+    # by one-argument operations). A call writes the variables into their registers and
+    # runs the instructions in order, calling each operation's function straight from the
+    # fixed table. The register list is allocated once with the plan and reused by every
+    # call, so a call allocates nothing but the numbers computed (a plan is therefore not
+    # safe to call from several threads at once).
+    # tree and var work as for EvalPlan: a list of expressions gives a tuple of values and
+    # var can be a sequence of names, the arguments in order.
+
+    def __init__(self, tree, var):
+        self.tree = tree
+        self.var = var
+        trees = [tree] if isinstance(tree, Node) else list(tree)
+        self.vars = (var,) if isinstance(var, str) else tuple(var)
+        _check_vars(self.vars)
+        self.ops = array('B')
+        self.dst = array('I')
+        self.lhs = array('I')
+        self.rhs = array('I')
+        self.registers = []  # initial register values, constants and 0.0 for the rest
+        registers = {}       # node -> its register
+
+        def visit(node, results):
+            index = len(self.registers)
+            value = 0.0
+            if isinstance(node, NumberNode):
+                # The number as compiled code has it (see NumberNode._py)
+                value = node.value
+            elif isinstance(node, VarNode):
+                if node.name not in self.vars:
+                    # Unknown names raise NameError here, when the plan is built
+                    value = _lookup(node.name)
+            else:
+                if isinstance(node, BinOpNode):
+                    op, args = node.op, (node.left, node.right)
+                elif isinstance(node, UnaryOpNode):
+                    op, args = 'neg', (node.operand,)
+                else:
+                    op, args = node.func_name, (node.arg,)
+                if op not in _MACHINE_OPCODES:
+                    raise NotImplementedError(f"Unknown operation {op}")
+                self.ops.append(_MACHINE_OPCODES[op])
+                self.dst.append(index)
+                self.lhs.append(results[args[0]])
+                self.rhs.append(results[args[-1]])
+            self.registers.append(value)
+            return index
+
+        for root in trees:
+            _fold(root, visit, results=registers)
+        # register of each variable (None if the expression doesn't use it) and of each result
+        self.inputs = [registers.get(VarNode(name)) for name in self.vars]
+        self.outputs = [registers[root] for root in trees]
+        # Decoded once for __call__: the program as (function, arguments, dst, lhs, rhs)
+        # tuples, and (register, argument position) of the variables used
+        self._code = tuple(_MACHINE_TABLE[op] + (d, a, b)
+                           for op, d, a, b in zip(self.ops, self.dst, self.lhs, self.rhs))
+        self._inputs = tuple((index, i) for i, index in enumerate(self.inputs)
+                             if index is not None)
+        self._result = self.outputs[0] if isinstance(tree, Node) else None
+        self._registers = list(self.registers)
+
+    def __call__(self, *values):
+        r = self._registers
+        if len(values) != len(self.inputs):
+            raise TypeError(f"expected {len(self.inputs)} arguments, got {len(values)}")
+        for index, i in self._inputs:
+            r[index] = values[i]
+        for f, nargs, d, a, b in self._code:
+            if nargs == 2:
+                r[d] = f(r[a], r[b])
+            else:
+                r[d] = f(r[a])
+        if self._result is not None:
+            return r[self._result]
+        return tuple([r[i] for i in self.outputs])
+
+    def evaluate_many(self, points):
+        # Values at many points in an array.array('d'): one value per point, or for a list
+        # of expressions all of a point's values, point after point. With one variable the
+        # points are numbers, otherwise sequences of one value per variable.
+        # Runs each instruction over the whole batch (with map) rather than the program
+        # once per point, so the cost of going through the program is paid once per batch
+        if np is not None and isinstance(points, np.ndarray):
+            points = points.tolist()
+        if len(self.vars) == 1:
+            columns = [points if isinstance(points, list) else list(points)]
+        else:
+            columns = [list(column) for column in zip(*points)]
+        n = len(columns[0]) if columns else 0
+        out = array('d')
+        if n == 0:
+            return out
+        r = [[value] * n for value in self.registers]
+        for index, column in zip(self.inputs, columns):
+            if index is not None:
+                r[index] = column
+        for f, nargs, d, a, b in self._code:
+            if nargs == 2:
+                r[d] = list(map(f, r[a], r[b]))
+            else:
+                r[d] = list(map(f, r[a]))
+        if len(self.outputs) == 1:
+            out.extend(r[self.outputs[0]])
+        else:
+            for values in zip(*[r[i] for i in self.outputs]):
+                out.extend(values)
+        return out
+
+
+# Set to False for runtimes where eval, compile and exec are blocked: MathFunc and
+# VectorFunc then evaluate with RegisterPlan instead of compiled Python code
+USE_EVAL = True
+
+
+def compile_expr(expr: str, var: str):
+    # Turns an expression string into a plain Python function of one variable
+    # The string is parsed once and the tree is lowered to Python source, which is compiled
+    # to a function so each call just runs bytecode instead of going through eval
+    # Common subexpressions are computed once per call (see EvalPlan)
+    # With USE_EVAL off it returns a RegisterPlan, which needs the parser to understand expr
+    if not USE_EVAL:
+        return RegisterPlan(Parser(expr).parse(), var)
+    try:
+        return EvalPlan(Parser(expr).parse(), var).compile()
+    except (ValueError, SyntaxError):
+        # Anything the parser can't handle is still valid input for eval, so compile the
+        # raw text instead and keep the old behaviour for it
+        code = compile(expr, '<MathFunc>', 'eval')
+        return lambda value: eval(code, EVAL_GLOBALS, {var: value})
+
+
+class MathFunc:
+    def __init__(self, expr: str, var:str):
+        self.expr = expr    # string to eval, eg: "x**3 + 2*x + 1"
+        self.var = var      # variable name, eg: "x"
+        self._compiled = None  # function built from expr on first call
+        self._tree = None      # parsed expr, built on first use
+    
+    def __call__(self, value):
+        # Evaluates the expression with the variable bound to the value
+        fn = self._compiled
+        if fn is None:
+            fn = compile_expr(self.expr, self.var)
+            if instrumentation is not None:
+                fn = instrumentation.timed_call(fn)
+            self._compiled = fn
+        return fn(value)
+
+    def evaluate_many(self, values):
+        # Evaluates the function at every value in 'values' (a list, array.array, memoryview
+        # or NumPy array) and returns the results in a contiguous buffer of doubles
+        # NumPy input gets a NumPy array back: the tree is walked once and every operation
+        # is applied to the whole array. Everything else gets an array.array('d'), filled by
+        # mapping the compiled function over the values, which is faster in plain Python than
+        # building an intermediate list for every node
+        if np is not None and isinstance(values, np.ndarray):
+            xs = np.asarray(values, dtype=np.float64)
+            try:
+                result = self.tree().eval_many(self.var, xs)
+            except ValueError:
+                # Not something the parser understands, evaluate point by point instead
+                result = np.fromiter(map(self, xs), dtype=np.float64, count=len(xs))
+            return np.ascontiguousarray(np.broadcast_to(result, xs.shape), dtype=np.float64)
+        if self._compiled is None:
+            self._compiled = compile_expr(self.expr, self.var)
+        if isinstance(self._compiled, RegisterPlan):
+            return self._compiled.evaluate_many(values)
+        return array('d', map(self._compiled, values))
+
+    def tree(self):
+        # The parsed expression tree (parsed once and reused)
+        if self._tree is None:
+            self._tree = Parser(self.expr).parse()
+        return self._tree
+
+    def plan(self):
+        # The EvalPlan used to compile this function, plan().source() shows the generated code
+        return EvalPlan(self.tree(), self.var)
+
+    def integrate(self, a, b, abs_tol=None, rel_tol=None, workers=1):
+        # Definite integral from a to b, see integrate
+        # ex: func("x**2", "x").integrate(0, 3).value -> 9.0
+        return integrate(self, self.var, a, b, abs_tol, rel_tol, workers)
+
+    def approximate(self, a, b, tol=None):
+        # Chebyshev approximation on [a, b] for fast repeated evaluation, see approximate
+        return approximate(self, self.var, a, b, tol)
+
+    def find_roots(self, starts=None, method='newton', bracket=None, params=None, tol=None,
+                   max_iter=None):
+        # Roots from many starting points at once, see find_roots
+        return find_roots(self, self.var, starts, method, bracket, params, tol, max_iter)
+
+    def bounds(self, a, b, tol=None, max_pieces=None):
+        # Guaranteed bounds of the values on [a, b], see bounds
+        return bounds(self, self.var, a, b, tol, max_pieces)
+
+    def __str__(self):
+        return self.expr
+
+
+def func(expr: str, var: str) -> MathFunc:
+    # creates a symbolic function of one variable
+    # ex: y = func("x + 1","x")
+    return MathFunc(expr, var)
+
+
+def diff(f: MathFunc, var: str, n: int = 1) -> MathFunc:
+    # Differentiate f with resprect to 'var' and return another mathmatical function
+    # ex: dydx = diff(y, "x")
+    # Pass n for higher derivatives, ex: d3ydx3 = diff(y, "x", n=3)
+    if n == 1:
+        d_expr = symbolic_diff_expr(f.expr, var)
+        return MathFunc(d_expr, var)
+    tree = nth_derivative(f.tree(), var, n)
+    result = MathFunc(tree.to_str(), var)
+    result._tree = tree
+    return result
+
+
+class VectorFunc:
+    # Several expressions in the same variables, evaluated together: a call computes all of
+    # them in one pass, and subexpressions they have in common are computed once
+    # shape is (m,) for m expressions, or (m, n) for a matrix of them given row by row (see
+    # jacobian). Calls return a tuple of values, or a tuple of row tuples for a matrix.
+    def __init__(self, trees, vars, shape=None):
+        self.trees = list(trees)
+        self.vars = tuple(vars)
+        self.shape = (len(self.trees),) if shape is None else tuple(shape)
+        self._compiled = None  # function built from the plan on first call
+
+    def __call__(self, *values):
+        # Evaluates every expression with the variables bound to values, in order
+        result = self._function()(*values)
+        if len(self.shape) == 2:
+            n = self.shape[1]
+            return tuple(result[i * n:(i + 1) * n] for i in range(self.shape[0]))
+        return result
+
+    def evaluate_many(self, points):
+        # Evaluates at many points. A NumPy array with one row per point and one column per
+        # variable gives a NumPy array of shape (len(points),) + shape, computed a whole
+        # column at a time. Any other sequence of points gives an array.array('d') of all the
+        # values, point after point (each point's values flattened row by row)
+        if np is not None and isinstance(points, np.ndarray):
+            xs = np.asarray(points, dtype=np.float64).reshape(len(points), len(self.vars))
+            columns = [xs[:, i] for i in range(len(self.vars))]
+            results = {}
+            values = [np.broadcast_to(tree.eval_many(self.vars, columns, results), (len(xs),))
+                      for tree in self.trees]
+            out = np.stack(values, axis=-1) if values else np.empty((len(xs), 0))
+            return np.ascontiguousarray(out.reshape((len(xs),) + self.shape))
+        fn = self._function()
+        if isinstance(fn, RegisterPlan):
+            return fn.evaluate_many(points)
+        out = array('d')
+        for point in points:
+            out.extend(fn(*point))
+        return out
+
+    def _function(self):
+        # The compiled plan, returning all values as one flat tuple
+        if self._compiled is None:
+            if USE_EVAL:
+                self._compiled = self.plan().compile()
+            else:
+                self._compiled = RegisterPlan(self.trees, self.vars)
+        return self._compiled
+
+    def plan(self):
+        return EvalPlan(self.trees, self.vars)
+
+    def __str__(self):
+        exprs = [tree.to_str() for tree in self.trees]
+        if len(self.shape) == 2:
+            n = self.shape[1]
+            rows = [f"[{', '.join(exprs[i * n:(i + 1) * n])}]" for i in range(self.shape[0])]
+            return f"[{', '.join(rows)}]"
+        return f"[{', '.join(exprs)}]"
+
+
+def _as_tree(f):
+    # Expression tree of a MathFunc, an expression string or a node
+    if isinstance(f, MathFunc):
+        return f.tree()
+    if isinstance(f, Node):
+        return f
+    return Parser(f).parse()
+
+
+def gradient(f, vars) -> VectorFunc:
+    # Partial derivatives of f (a MathFunc or expression string) with respect to each of vars
+    # ex: g = gradient("x**2*y", ["x", "y"]); g(3, 2) -> (12, 9)
+    # f is parsed once and the partials are built from the same tree, so they share
+    # subtrees. Those are simplified once for all partials, and evaluating g computes them
+    # once per point
+    tree = _as_tree(f)
+    vars = tuple(vars)
+    return VectorFunc(Simplifier().run_all(tree.diff(var) for var in vars), vars)
+
+
+def jacobian(fs, vars) -> VectorFunc:
+    # Matrix of partial derivatives, one row per function in fs and one column per variable
+    # ex: J = jacobian(["x*y", "x + y"], ["x", "y"]); J(3, 2) -> ((2, 3), (1, 1))
+    trees = [_as_tree(f) for f in fs]
+    vars = tuple(vars)
+    partials = Simplifier().run_all(tree.diff(var) for tree in trees for var in vars)
+    return VectorFunc(partials, vars, (len(trees), len(vars)))
+
+
+def _times(adj, src):
+    # Source of adj*src for AdjointPlan, skipping the multiplication for the result's own
+    # adjoint, which is 1
+    if adj == '1.0':
+        return f"({src})"
+    return f"({adj}*{src})"
+
+
+class AdjointPlan:
+    # Reverse mode automatic differentiation of an expression, lowered to Python source like
+    # EvalPlan. The generated function does a forward sweep computing every node once, then a
+    # backward sweep over the nodes in reverse, accumulating each node's adjoint (the
+    # derivative of the result with respect to that node) from the adjoints of its parents
+    # with the node's local rule (_adjoint). The adjoints of the variables are the partial
+    # derivatives. No derivative expression is built, and a point costs a small constant
+    # times one evaluation of the expression no matter how many variables there are.
+    # Only nodes that depend on one of the variables get an adjoint.
+
+    def __init__(self, tree, vars):
+        self.tree = tree
+        self.vars = tuple(vars)
+        _check_vars(self.vars)
+        prefix = _temp_prefix([tree], self.vars)
+        self.forward = []   # (name, source) of the value of each node, in evaluation order
+        self.backward = []  # (name, op, source) adjoint updates, op is '=' or '+='
+        order = []
+        src = {}
+        active = set()
+
+        def visit(node, results):
+            children = node.children()
+            if children:
+                name = f"{prefix}{len(self.forward)}"
+                self.forward.append((name, node._py(src)))
+                src[node] = name
+            else:
+                src[node] = node._py(src)
+            if (isinstance(node, VarNode) and node.name in self.vars or
+                    any(child in active for child in children)):
+                active.add(node)
+            order.append(node)
+            return True
+
+        _fold(tree, visit)
+        self.value = src[tree]  # source of the value of the expression
+
+        adjoints = {}  # node -> source of its adjoint so far
+        owned = set()  # nodes with their adjoint in a variable of their own, which can be
+                       # added to in place (others may share their parent's)
+        if tree in active:
+            adjoints[tree] = '1.0'
+        for node in reversed(order):
+            if node not in active or not node.children():
+                continue
+            adj = adjoints[node]
+            for child, contribution in node._adjoint(src, adj):
+                if child not in active:
+                    continue
+                current = adjoints.get(child)
+                if current is None and contribution == adj:
+                    # Same adjoint as this node (eg: both sides of a +), no copy needed
+                    adjoints[child] = adj
+                elif child in owned:
+                    self.backward.append((current, '+=', contribution))
+                else:
+                    name = f"{prefix}a{len(owned)}"
+                    value = contribution if current is None else f"{current}+{contribution}"
+                    self.backward.append((name, '=', value))
+                    owned.add(child)
+                    adjoints[child] = name
+        # source of each partial derivative, in the order of vars
+        self.partials = [adjoints.get(VarNode(name), '0.0') for name in self.vars]
+
+    def source(self, name='f'):
+        # Python source of a function 'name'(var, ...) returning (value, (partials, ...))
+        lines = [f"def {name}({', '.join(self.vars)}):"]
+        lines.extend(f"    {temp} = {src}" for temp, src in self.forward)
+        lines.extend(f"    {adj} {op} {src}" for adj, op, src in self.backward)
+        lines.append(f"    return {self.value}, ({', '.join(self.partials)},)")
+        return "\n".join(lines)
+
+    def compile(self):
+        namespace = {}
+        exec(compile(self.source(), '<AdjointPlan>', 'exec'), EVAL_GLOBALS, namespace)
+        return namespace['f']
+
+
+def value_and_grad(f, vars):
+    # Function computing the value of f (a MathFunc, expression string or tree) and its
+    # partial derivatives with respect to vars at a point, by reverse mode automatic
+    # differentiation (see AdjointPlan). Unlike gradient there is no symbolic derivative,
+    # and u**v with a non-constant exponent is supported.
+    # ex: vg = value_and_grad("x**y", ["x", "y"]); vg(2, 3) -> (8, (12.0, 5.545...))
+    return AdjointPlan(_as_tree(f), vars).compile()
+
+
+# Truncated Taylor series for Node.taylor: lists of the first m coefficients of a function of
+# the point, [a0, a1, ...] standing for a0 + a1*h + a2*h**2 + ... Each operation computes the
+# coefficients of the result from those of its operands with the usual recurrences, which
+# take O(m**2) operations and no symbolic work
+
+def _series_one(m):
+    return [1.0] + [0.0] * (m - 1)
+
+
+def _series_mul(a, b):
+    return [sum(a[j] * b[k - j] for j in range(k + 1)) for k in range(len(a))]
+
+
+def _series_div(a, b):
+    # c = a/b: a = b*c, solved for each coefficient of c in turn
+    c = []
+    for k in range(len(a)):
+        c.append((a[k] - sum(b[j] * c[k - j] for j in range(1, k + 1))) / b[0])
+    return c
+
+
+def _series_exp(a, value=None):
+    # c = exp(a): c' = a'*c. value is exp(a0) if the caller already knows it (u**w)
+    c = [math.exp(a[0]) if value is None else value]
+    for k in range(1, len(a)):
+        c.append(sum(j * a[j] * c[k - j] for j in range(1, k + 1)) / k)
+    return c
+
+
+def _series_ln(a):
+    # c = ln(a): a*c' = a'
+    c = [math.log(a[0])]
+    for k in range(1, len(a)):
+        c.append((a[k] - sum(j * c[j] * a[k - j] for j in range(1, k)) / k) / a[0])
+    return c
+
+
+def _series_sin_cos(a):
+    # s = sin(a), c = cos(a): s' = a'*c, c' = -a'*s
+    s, c = [math.sin(a[0])], [math.cos(a[0])]
+    for k in range(1, len(a)):
+        s.append(sum(j * a[j] * c[k - j] for j in range(1, k + 1)) / k)
+        c.append(-sum(j * a[j] * s[k - j] for j in range(1, k + 1)) / k)
+    return s, c
+
+
+def _series_pow(a, n):
+    # a**n for a constant n. Integer powers are repeated multiplication (by squaring), which
+    # works where a0 is 0, others use a*c' = n*a'*c, which divides by a0
+    if _is_integer(n) and abs(n) <= _EXACT_LIMIT:
+        n = int(n)
+        result, base, e = _series_one(len(a)), a, abs(n)
+        while e:
+            if e & 1:
+                result = _series_mul(result, base)
+            e >>= 1
+            if e:
+                base = _series_mul(base, base)
+        if n < 0:
+            result = _series_div(_series_one(len(a)), result)
+        result[0] = a[0] ** n  # the value exactly as evaluating the expression gives it
+        return result
+    c = [a[0] ** n]
+    if not any(a[1:]):
+        # A constant, eg: (y - y)**0.5
+        return c + [0.0] * (len(a) - 1)
+    if a[0] == 0:
+        # a = a_m*t**m + ..., so a**n = a_m**n*t**(m*n)*(1 + ...)**n. Below order m*n the
+        # coefficients are 0, from there on they are infinite or undefined (t**0.5 at 0)
+        m = next(j for j, value in enumerate(a) if value)
+        return c + [0.0 if k < m * n else math.nan for k in range(1, len(a))]
+    for k in range(1, len(a)):
+        c.append(sum((n * j - (k - j)) * a[j] * c[k - j] for j in range(1, k + 1))
+                 / (k * a[0]))
+    return c
+
+
+def derivatives(f, var, x, n=1):
+    # Value of f (a MathFunc, expression string or tree) and its first n derivatives with
+    # respect to var at x, in one pass by forward mode automatic differentiation (see
+    # Node.taylor). Nothing symbolic is built, so this is the cheap way to get f and f' for
+    # a Newton step. Supports u**v with a non-constant exponent.
+    # ex: derivatives("x**3", "x", 2.0) -> (8.0, 12.0); derivatives("x**3", "x", 2.0, n=3)
+    # -> (8.0, 12.0, 12.0, 6.0)
+    if n < 0:
+        raise ValueError("Derivative order must be non-negative")
+    coeffs = _as_tree(f).taylor(var, x, n)
+    factorial = 1
+    result = [coeffs[0]]
+    for k in range(1, n + 1):
+        factorial *= k
+        result.append(coeffs[k] * factorial)
+    return tuple(result)
+
+
+# Adaptive quadrature (integrate). The 15 point Gauss-Kronrod rule on [-1, 1]: nodes, the
+# Kronrod weights and the weights of the 7 point Gauss rule on every other node (zero on
+# the rest), from QUADPACK's qk15
+_KRONROD_X = (0.991455371120812639206854697526329, 0.949107912342758524526189684047851,
+              0.864864423359769072789712788640926, 0.741531185599394439863864773280788,
+              0.586087235467691130294144845693013, 0.405845151377397166906606412076961,
+              0.207784955007898467600689403773245)
+_KRONROD_W = (0.022935322010529224963732008058970, 0.063092092629978553290700663189204,
+              0.104790010322250183839876322541518, 0.140653259715525918745189590510238,
+              0.169004726639267902826583426598550, 0.190350578064785409913256402421014,
+              0.204432940075298892414161999234649)
+_KRONROD_W0 = 0.209482141084727828012999174891714
+_GAUSS_W = (0.0, 0.129484966168869693270611432679082, 0.0, 0.279705391489276667901467771423780,
+            0.0, 0.381830050505118944950369775488975, 0.0)
+_GAUSS_W0 = 0.417959183673469387755102040816327
+_QUAD_NODES = tuple(-x for x in _KRONROD_X) + (0.0,) + _KRONROD_X[::-1]
+_QUAD_KRONROD = _KRONROD_W + (_KRONROD_W0,) + _KRONROD_W[::-1]
+_QUAD_GAUSS = _GAUSS_W + (_GAUSS_W0,) + _GAUSS_W[::-1]
+
+# Default tolerances of integrate, and the most panels it splits the interval into
+INTEGRATE_ABS_TOL = 1e-10
+INTEGRATE_REL_TOL = 1e-10
+INTEGRATE_MAX_PANELS = 4096
+
+Integral = namedtuple('Integral', ['value', 'error', 'evaluations'])
+
+
+def integrate(f, var, a, b, abs_tol=None, rel_tol=None, workers=1):
+    # Definite integral of f (a MathFunc, expression string or tree) over var from a to b,
+    # by adaptive Gauss-Kronrod quadrature. Returns Integral(value, error, evaluations):
+    # the estimate, a bound on its error (the difference of the 15 point Kronrod and 7 point
+    # Gauss rules, summed over the panels) and how many times f was evaluated.
+    # The interval is split in halves until every panel's error is below its share (by
+    # width) of max(abs_tol, rel_tol * |value|). Each round evaluates the new panels of all
+    # the panels it splits in one evaluate_many call, which with NumPy walks the tree once
+    # for the whole batch. Splitting stops at INTEGRATE_MAX_PANELS panels, the error then
+    # tells how far the result is from the tolerance (eg: for a divergent integral).
+    # With workers > 1 the interval is cut into pieces that are integrated in that many
+    # processes.
+    # ex: integrate("x**2", "x", 0, 3) -> Integral(value=9.0, error=..., evaluations=15)
+    abs_tol = INTEGRATE_ABS_TOL if abs_tol is None else abs_tol
+    rel_tol = INTEGRATE_REL_TOL if rel_tol is None else rel_tol
+    if not (math.isfinite(a) and math.isfinite(b)):
+        raise ValueError("Integration bounds must be finite")
+    if abs_tol < 0 or rel_tol < 0:
+        raise ValueError("Tolerances must not be negative")
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    f = _as_func(f, var)
+    if a == b:
+        return Integral(0.0, 0.0, 0)
+    sign = 1
+    if a > b:
+        a, b, sign = b, a, -1
+    if workers == 1:
+        value, error, evaluations = _integrate(f, a, b, abs_tol, rel_tol,
+                                               INTEGRATE_MAX_PANELS)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        # A few pieces per worker, so one piece needing many panels doesn't hold up the rest
+        pieces = 4 * workers
+        width = (b - a) / pieces
+        bounds = [a + i * width for i in range(pieces)] + [b]
+        with ProcessPoolExecutor(workers) as pool:
+            parts = list(pool.map(
+                _integrate_piece, repeat(f.expr), repeat(var), bounds, bounds[1:],
+                repeat(abs_tol / pieces), repeat(rel_tol),
+                repeat(max(INTEGRATE_MAX_PANELS // pieces, 1))))
+        value = math.fsum(part[0] for part in parts)
+        error = sum(part[1] for part in parts)
+        evaluations = sum(part[2] for part in parts)
+    return Integral(sign * value, error, evaluations)
+
+
+def _integrate_piece(expr, var, a, b, abs_tol, rel_tol, max_panels):
+    # One piece of a parallel integrate, in a worker process
+    return _integrate(MathFunc(expr, var), a, b, abs_tol, rel_tol, max_panels)
+
+
+def _integrate(f, a, b, abs_tol, rel_tol, max_panels):
+    # (value, error, evaluations) of f over [a, b], a < b, see integrate
+    panels = []      # (lo, hi, kronrod, error) of every panel
+    split = [(a, b)]  # panels to evaluate next
+    evaluations = 0
+    while split:
+        values = _panel_values(f, split)
+        evaluations += len(values)
+        for i, (lo, hi) in enumerate(split):
+            half = 0.5 * (hi - lo)
+            fx = values[15 * i:15 * i + 15]
+            kronrod = half * math.fsum(map(operator.mul, _QUAD_KRONROD, fx))
+            gauss = half * math.fsum(map(operator.mul, _QUAD_GAUSS, fx))
+            panels.append((lo, hi, kronrod, abs(kronrod - gauss)))
+        value = math.fsum(panel[2] for panel in panels)
+        error = sum(panel[3] for panel in panels)
+        target = max(abs_tol, rel_tol * abs(value))
+        if error <= target or len(panels) >= max_panels:
+            break
+        # Split every panel over its share of the tolerance, unless it is too narrow to
+        # split further. Panels are split in halves until there are max_panels
+        keep, split = [], []
+        for lo, hi, kronrod, err in panels:
+            mid = 0.5 * (lo + hi)
+            if (err > target * (hi - lo) / (b - a) and lo < mid < hi and
+                    len(panels) + len(split) // 2 < max_panels):
+                split.append((lo, mid))
+                split.append((mid, hi))
+            else:
+                keep.append((lo, hi, kronrod, err))
+        panels = keep
+    return value, error, evaluations
+
+
+def _as_func(f, var):
+    # A MathFunc of var for a MathFunc, an expression string or a tree
+    if isinstance(f, Node):
+        tree = f
+        f = MathFunc(tree.to_str(), var)
+        f._tree = tree
+    elif not isinstance(f, MathFunc) or f.var != var:
+        f = MathFunc(f if isinstance(f, str) else f.expr, var)
+    return f
+
+
+def _panel_values(f, panels):
+    # f at the 15 Kronrod nodes of every panel, in one batch
+    return _sample(f, [0.5 * (lo + hi) + 0.5 * (hi - lo) * x
+                       for lo, hi in panels for x in _QUAD_NODES])
+
+
+def _sample(f, points):
+    # f at every point as a list, in one evaluate_many call. Raises ValueError if a value
+    # isn't finite
+    if np is not None:
+        with np.errstate(all='ignore'):
+            values = f.evaluate_many(np.array(points)).tolist()
+    else:
+        try:
+            values = f.evaluate_many(points)
+        except (ZeroDivisionError, OverflowError) as e:
+            raise ValueError(f"{f.expr} can't be evaluated on the interval: {e}") from e
+    for x, value in zip(points, values):
+        if not math.isfinite(value):
+            raise ValueError(f"{f.expr} is not finite at {f.var} = {x!r}")
+    return values
+
+
+# Defaults of approximate: the error to approximate within, the highest degree of the
+# polynomial on one piece (above that the piece is split) and the most pieces
+APPROX_TOL = 1e-12
+APPROX_MAX_DEGREE = 32
+APPROX_MAX_PIECES = 4096
+
+_chebyshev_tables = {}  # n -> (points on [-1, 1], cos table), see _chebyshev_fit
+
+
+def approximate(f, var, a, b, tol=None):
+    # Piecewise Chebyshev approximation of f (a MathFunc, expression string or tree) as a
+    # function of var on [a, b], for evaluating it many times: a Chebyshev object, which is
+    # called like a MathFunc but only runs a short polynomial recurrence per call, whatever
+    # the expression.
+    # On each piece f is interpolated at 9, 17 and then 33 Chebyshev points until the
+    # coefficients have decayed below tol, and the series is cut where the coefficients
+    # left out add up to less than tol/2. tol is relative to the size of f on the piece
+    # where that is above 1 (so the error is below tol * max(1, |f|)), floating point can't
+    # do better than that for large values. A piece that needs a degree above
+    # APPROX_MAX_DEGREE is split in half. The coefficients bound the error for smooth f,
+    # they can't see features narrower than the spacing of the points.
+    # Raises ValueError if f isn't finite at a sample point or can't be approximated in
+    # APPROX_MAX_PIECES pieces (eg: it isn't continuous).
+    # ex: p = approximate("sin(x)*exp(x)", "x", 0, 1); p(0.5) -> 0.79043908321362...
+    tol = APPROX_TOL if tol is None else tol
+    if not (math.isfinite(a) and math.isfinite(b)) or not a < b:
+        raise ValueError("The interval must be finite with a < b")
+    if tol <= 0:
+        raise ValueError("tol must be positive")
+    f = _as_func(f, var)
+    pieces = []
+    stack = [(a, b)]
+    while stack:
+        lo, hi = stack.pop()
+        coeffs = _chebyshev_fit(f, lo, hi, tol)
+        if coeffs is None:
+            mid = 0.5 * (lo + hi)
+            if not lo < mid < hi or len(pieces) + len(stack) + 2 > APPROX_MAX_PIECES:
+                raise ValueError(f"Can't approximate {f.expr} within {tol} on "
+                                 f"[{a!r}, {b!r}], is it smooth there?")
+            # Right half first on the stack so pieces come out from left to right
+            stack.append((mid, hi))
+            stack.append((lo, mid))
+        else:
+            pieces.append((lo, hi, coeffs))
+    return Chebyshev([lo for lo, hi, coeffs in pieces] + [b],
+                     [coeffs for lo, hi, coeffs in pieces], var)
+
+
+def _chebyshev_fit(f, lo, hi, tol):
+    # Chebyshev coefficients of f on [lo, hi] within tol (see approximate) as an
+    # array('d'), or None if that needs a degree above APPROX_MAX_DEGREE
+    n = 9
+    while n <= APPROX_MAX_DEGREE + 1:
+        table = _chebyshev_tables.get(n)
+        if table is None:
+            # Points of the first kind, cos(pi*(j + 1/2)/n), they don't include the ends
+            points = [math.cos(math.pi * (j + 0.5) / n) for j in range(n)]
+            cosines = [[math.cos(math.pi * k * (j + 0.5) / n) for j in range(n)]
+                       for k in range(n)]
+            table = _chebyshev_tables[n] = (points, cosines)
+        points, cosines = table
+        mid, half = 0.5 * (lo + hi), 0.5 * (hi - lo)
+        values = _sample(f, [mid + half * t for t in points])
+        try:
+            coeffs = [2 / n * math.fsum(map(operator.mul, row, values)) for row in cosines]
+        except OverflowError as e:
+            raise ValueError(f"{f.expr} is too large on [{lo!r}, {hi!r}] to approximate") from e
+        coeffs[0] /= 2
+        limit = tol * max(1.0, max(map(abs, values)))
+        if abs(coeffs[-1]) + abs(coeffs[-2]) <= limit / 4:
+            # Converged, leave out the highest terms as long as they add up to under tol/2
+            tail = 0.0
+            m = n
+            while m > 1 and tail + abs(coeffs[m - 1]) <= limit / 2:
+                m -= 1
+                tail += abs(coeffs[m])
+            return array('d', coeffs[:m])
+        n = 2 * n - 1
+    return None
+
+
+class Chebyshev:
+    # Piecewise polynomial approximation built by approximate(). Piece i covers
+    # [breaks[i], breaks[i + 1]] and holds the coefficients of a Chebyshev series in
+    # t = (2x - lo - hi) / (hi - lo), evaluated with Clenshaw's recurrence. Calls outside
+    # [breaks[0], breaks[-1]] raise ValueError, the series isn't meant for extrapolation.
+
+    def __init__(self, breaks, coeffs, var):
+        self.breaks = breaks  # piece boundaries, from a to b
+        self.coeffs = coeffs  # array('d') of coefficients for every piece
+        self.var = var
+        self.a = breaks[0]
+        self.b = breaks[-1]
+        # Per piece what a call needs: 2t = x*scale + shift, the constant term and the
+        # other coefficients from the highest down
+        self._pieces = []
+        for lo, hi, c in zip(breaks, breaks[1:], coeffs):
+            scale = 4 / (hi - lo)
+            self._pieces.append((scale, -(lo + hi) * scale / 2, c[0], tuple(c[:0:-1])))
+
+    @property
+    def degree(self):
+        # Highest degree of the pieces
+        return max(len(c) for c in self.coeffs) - 1
+
+    def __call__(self, x):
+        if not self.a <= x <= self.b:
+            raise ValueError(f"{x!r} is outside [{self.a!r}, {self.b!r}]")
+        pieces = self._pieces
+        if len(pieces) == 1:
+            scale, shift, c0, rest = pieces[0]
+        else:
+            scale, shift, c0, rest = pieces[min(bisect_right(self.breaks, x), len(pieces)) - 1]
+        t2 = x * scale + shift
+        b1 = b2 = 0.0
+        for c in rest:
+            b2, b1 = b1, c + t2 * b1 - b2
+        return c0 + 0.5 * t2 * b1 - b2
+
+    def evaluate_many(self, values):
+        # Like MathFunc.evaluate_many: NumPy input gets a NumPy array back, computed with
+        # the recurrence applied to whole arrays (one pass per piece), anything else an
+        # array('d')
+        if np is None or not isinstance(values, np.ndarray):
+            return array('d', map(self, values))
+        xs = np.asarray(values, dtype=np.float64)
+        if xs.size and not (self.a <= xs.min() and xs.max() <= self.b):
+            raise ValueError(f"Values outside [{self.a!r}, {self.b!r}]")
+        index = np.clip(np.searchsorted(self.breaks, xs, side='right') - 1, 0,
+                        len(self.coeffs) - 1)
+        result = np.empty_like(xs)
+        for i, c in enumerate(self.coeffs):
+            mask = index == i
+            if len(self.coeffs) > 1 and not mask.any():
+                continue
+            x = xs[mask] if len(self.coeffs) > 1 else xs
+            lo, hi = self.breaks[i], self.breaks[i + 1]
+            t2 = 2 * (2 * x - lo - hi) / (hi - lo)
+            b1 = b2 = 0.0
+            for k in range(len(c) - 1, 0, -1):
+                b1, b2 = c[k] + t2 * b1 - b2, b1
+            value = c[0] + 0.5 * t2 * b1 - b2
+            if len(self.coeffs) > 1:
+                result[mask] = value
+            else:
+                result[...] = value
+        return result
+
+    def derivative(self):
+        # Chebyshev approximation of the derivative, from the coefficients alone. It is
+        # less accurate than the original (by up to about the degree squared), approximate
+        # diff(f) instead where that matters
+        coeffs = []
+        for i, c in enumerate(self.coeffs):
+            n = len(c) - 1
+            d = [0.0] * (n + 2)
+            for k in range(n, 0, -1):
+                d[k - 1] = d[k + 1] + 2 * k * c[k]
+            d[0] /= 2
+            scale = 2 / (self.breaks[i + 1] - self.breaks[i])
+            coeffs.append(array('d', [x * scale for x in d[:max(n, 1)]]))
+        return Chebyshev(self.breaks, coeffs, self.var)
+
+
+# Defaults of find_roots: the step (relative to max(1, |x|)) below which a lane has
+# converged, and the most iterations per lane
+ROOT_TOL = 1e-12
+ROOT_MAX_ITER = 50
+ROOT_METHODS = ('newton', 'halley')
+
+Roots = namedtuple('Roots', ['x', 'converged', 'iterations'])
+
+
+def find_roots(f, var, starts=None, method='newton', bracket=None, params=None, tol=None,
+               max_iter=None):
+    # Roots of f (a MathFunc, expression string or tree) in var from many starting points at
+    # once, by Newton's method or (method='halley') Halley's, which also uses f'' and
+    # converges cubically. Every start is a lane iterated on its own. Returns
+    # Roots(x, converged, iterations): each lane's root, whether it converged (its last
+    # step was below tol * max(1, |x|), or f was 0 there) and how many times it evaluated f.
+    # f' (and f'') are differentiated and simplified once, then evaluated together with f
+    # from one tree, so subexpressions they share are computed once per iteration. NumPy
+    # starts are iterated as arrays, one tree walk per iteration for all the active lanes,
+    # and converged lanes are dropped from the working set. Anything else runs the lanes one
+    # after the other on the compiled plan. Results come back like evaluate_many's: NumPy
+    # arrays, otherwise an array('d') of roots and lists.
+    # params maps other variables of f to a value or one value per lane, so the lanes can
+    # solve different equations, eg: Kepler's equation "E - e*sin(E) - M" for many M.
+    # bracket=(lo, hi), values or one per lane, keeps each lane in an interval where f
+    # changes sign: the interval shrinks to the iterate's side every step, and a step that
+    # leaves it (or can't be computed) is replaced by bisection, so the lane converges.
+    # starts default to the middles of the brackets, a lane whose bracket doesn't change
+    # sign doesn't converge. Without a bracket, a lane stops unconverged where f' = 0 or a
+    # value isn't finite.
+    # ex: find_roots("x**2 - 2", "x", [1.0, -3.0]).x
+    # -> array('d', [1.414213562373095, -1.414213562373095])
+    tol = ROOT_TOL if tol is None else tol
+    max_iter = ROOT_MAX_ITER if max_iter is None else max_iter
+    if method not in ROOT_METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of "
+                         f"{', '.join(ROOT_METHODS)}")
+    if tol <= 0:
+        raise ValueError("tol must be positive")
+    if max_iter < 1:
+        raise ValueError("max_iter must be at least 1")
+    if starts is None and bracket is None:
+        raise ValueError("find_roots needs starting points, a bracket or both")
+    lo, hi = (None, None) if bracket is None else bracket
+    params = dict(params or {})
+    names = (var,) + tuple(params)
+    tree = _as_tree(f)
+    missing = tree.variables() - set(names)
+    if missing:
+        raise ValueError(f"No values for {', '.join(sorted(missing))}")
+    trees = [tree]
+    for _ in range(2 if method == 'halley' else 1):
+        trees.append(trees[-1].diff(var).simplify())
+
+    given = [starts, lo, hi, *params.values()]
+    sizes = {len(v) for v in given if v is not None and not isinstance(v, (int, float))}
+    if len(sizes) > 1:
+        raise ValueError("Per-lane values must all have the same length")
+    n = sizes.pop() if sizes else 1
+    if np is not None and any(isinstance(v, np.ndarray) for v in given):
+        def lanes(v):
+            return np.array(np.broadcast_to(np.asarray(v, dtype=np.float64), (n,)))
+        x = None if starts is None else lanes(starts)
+        if lo is not None:
+            lo, hi = lanes(lo), lanes(hi)
+        return _find_roots_numpy(trees, names, x, lo, hi, [lanes(v) for v in params.values()],
+                                 tol, max_iter)
+
+    def lanes(v):
+        return [float(v)] * n if isinstance(v, (int, float)) else [float(x) for x in v]
+    fn = VectorFunc(trees, names)._function()
+    roots, converged, iterations = array('d'), [], []
+    for root in map(_find_root, repeat(fn), repeat((math.nan,) * len(trees)),
+                    repeat(None, n) if starts is None else lanes(starts),
+                    repeat(None, n) if lo is None else lanes(lo),
+                    repeat(None, n) if hi is None else lanes(hi),
+                    zip(*map(lanes, params.values())) if params else repeat((), n),
+                    repeat(tol), repeat(max_iter)):
+        roots.append(root[0])
+        converged.append(root[1])
+        iterations.append(root[2])
+    return Roots(roots, converged, iterations)
+
+
+def _call_lane(fn, x, args, failed):
+    # The values fn computes at x, failed (all nan) where it can't be evaluated
+    try:
+        return fn(x, *args)
+    except (ArithmeticError, ValueError):
+        return failed
+
+
+def _find_root(fn, failed, x, lo, hi, args, tol, max_iter):
+    # One lane of find_roots without NumPy: (root, converged, evaluations). failed is the
+    # tuple of nan fn's values are replaced by where it raises
+    evaluations = 0
+    if lo is not None:
+        if lo > hi:
+            lo, hi = hi, lo
+        flo = _call_lane(fn, lo, args, failed)[0]
+        fhi = _call_lane(fn, hi, args, failed)[0]
+        evaluations = 2
+        if flo == 0 or fhi == 0:
+            return (lo if flo == 0 else hi), True, evaluations
+        if x is None or not lo < x < hi:
+            x = 0.5 * (lo + hi)
+        if not (math.isfinite(flo) and math.isfinite(fhi)) or (flo < 0) == (fhi < 0):
+            return x, False, evaluations
+        negative = flo < 0
+    halley = len(failed) == 3
+    for evaluations in range(evaluations + 1, evaluations + max_iter + 1):
+        try:
+            values = fn(x, *args)
+        except (ArithmeticError, ValueError):
+            values = failed
+        fx = values[0]
+        if fx == 0:
+            return x, True, evaluations
+        try:
+            step = fx / values[1]
+            if halley:
+                # Halley's step is Newton's divided by 1 - step * f'' / 2f'
+                step /= 1 - 0.5 * step * values[2] / values[1]
+        except ZeroDivisionError:
+            step = math.nan
+        new = x - step
+        if lo is not None:
+            if math.isfinite(fx):
+                if (fx < 0) == negative:
+                    lo = x
+                else:
+                    hi = x
+            if not lo < new < hi:
+                new = 0.5 * (lo + hi)
+            if hi - lo <= tol * max(1.0, abs(new)):
+                return new, True, evaluations
+            step = x - new
+        elif not math.isfinite(new):
+            return x, False, evaluations
+        if abs(step) <= tol * max(1.0, abs(x)):
+            return new, True, evaluations
+        x = new
+    return x, False, evaluations
+
+
+def _find_roots_numpy(trees, names, x, lo, hi, params, tol, max_iter):
+    # find_roots on NumPy arrays of lanes, see there. active holds the indices of the lanes
+    # still iterating, every iteration evaluates f and its derivatives at those only
+    n = len(x if x is not None else lo)
+    converged = np.zeros(n, dtype=bool)
+    iterations = np.zeros(n, dtype=np.int64)
+    active = np.arange(n)
+
+    def evaluate(trees, xs, active):
+        results = {}
+        columns = [xs] + [p[active] for p in params]
+        return [np.broadcast_to(tree.eval_many(names, columns, results), xs.shape)
+                for tree in trees]
+
+    with np.errstate(all='ignore'):
+        if lo is not None:
+            lo, hi = np.minimum(lo, hi), np.maximum(lo, hi)
+            flo = evaluate(trees[:1], lo, active)[0]
+            fhi = evaluate(trees[:1], hi, active)[0]
+            iterations += 2
+            middle = 0.5 * (lo + hi)
+            x = middle if x is None else np.where((lo < x) & (x < hi), x, middle)
+            x = np.where(flo == 0, lo, np.where(fhi == 0, hi, x))
+            converged = (flo == 0) | (fhi == 0)
+            changes = np.isfinite(flo) & np.isfinite(fhi) & ((flo < 0) != (fhi < 0))
+            active = np.flatnonzero(changes & ~converged)
+            negative = flo < 0
+        for _ in range(max_iter):
+            if not active.size:
+                break
+            xs = x[active]
+            values = evaluate(trees, xs, active)
+            iterations[active] += 1
+            fx, d1 = values[0], values[1]
+            step = fx / d1
+            if len(trees) == 3:
+                step = step / (1 - 0.5 * step * values[2] / d1)
+            zero = fx == 0
+            new = np.where(zero, xs, xs - step)
+            if lo is not None:
+                finite = np.isfinite(fx)
+                left = finite & ((fx < 0) == negative[active])
+                los = lo[active] = np.where(left, xs, lo[active])
+                his = hi[active] = np.where(finite & ~left, xs, hi[active])
+                new = np.where(zero | ((los < new) & (new < his)), new, 0.5 * (los + his))
+                failed = np.zeros(len(xs), dtype=bool)
+                done = zero | (his - los <= tol * np.maximum(1.0, np.abs(new)))
+            else:
+                failed = ~np.isfinite(new)
+                done = zero
+            done |= ~failed & (np.abs(new - xs) <= tol * np.maximum(1.0, np.abs(xs)))
+            x[active] = np.where(failed, xs, new)
+            converged[active[done]] = True
+            active = active[~(done | failed)]
+    return Roots(x, converged, iterations)
+
+
+# Defaults of bounds: how close (relative to max(1, |f|)) the guaranteed bounds must come
+# to values f actually takes, and the most pieces the interval is cut into
+BOUNDS_TOL = 1e-9
+BOUNDS_MAX_PIECES = 4096
+
+Bounds = namedtuple('Bounds', ['lo', 'hi', 'error', 'evaluations'])
+
+
+def bounds(f, var, a, b, tol=None, max_pieces=None):
+    # Guaranteed range of f (a MathFunc, expression string or tree) as a function of var on
+    # [a, b], by interval arithmetic on subintervals. Returns Bounds(lo, hi, error,
+    # evaluations): f(x) is in [lo, hi] for every x in [a, b] where f is defined, f takes a
+    # value within error of lo and one within error of hi, and evaluations counts the
+    # interval evaluations of f and f' it took.
+    # A piece is bounded by the intersection of f's interval over it and the mean value form
+    # f(m) + f'(piece)*(piece - m) around its middle m, which is tight to the square of the
+    # piece's width. Each round splits in half only the pieces whose bounds reach past the
+    # lowest and highest values seen at the middles by more than tol * max(1, |f|), so the
+    # work goes to the neighbourhoods of the extremes. Stops when none do, or at max_pieces
+    # pieces or pieces too narrow to split, with error telling how loose the result is
+    # (infinite next to a pole). For the range of f' (eg: to prove f monotonic), bound
+    # diff(f) instead.
+    # Raises ValueError if f isn't defined anywhere on [a, b].
+    # ex: bounds("x**2 - x", "x", 0, 2) -> Bounds(lo=-0.25..., hi=2.0..., error=..., ...)
+    tol = BOUNDS_TOL if tol is None else tol
+    max_pieces = BOUNDS_MAX_PIECES if max_pieces is None else max_pieces
+    if not (math.isfinite(a) and math.isfinite(b)) or not a <= b:
+        raise ValueError("The interval must be finite with a <= b")
+    if tol <= 0:
+        raise ValueError("tol must be positive")
+    tree = _as_tree(f)
+    missing = tree.variables() - {var}
+    if missing:
+        raise ValueError(f"No values for {', '.join(sorted(missing))}")
+    try:
+        slope = tree.diff(var).simplify()
+    except NotImplementedError:  # u**v, bounded without the mean value form
+        slope = None
+    evaluations = 0
+
+    def piece(lo, hi):
+        # (lo, hi, bounds of f, bounds of f at the middle or None), or None where f is
+        # defined nowhere on [lo, hi]
+        nonlocal evaluations
+        evaluations += 1
+        try:
+            box = tree.interval(var, (lo, hi))
+        except ValueError:
+            return None
+        m = 0.5 * (lo + hi)
+        evaluations += 1
+        try:
+            middle = tree.interval(var, (m, m))
+        except ValueError:
+            return lo, hi, box, None
+        if slope is not None and lo < hi:
+            evaluations += 1
+            try:
+                mean = _iv_add(middle, _iv_mul(slope.interval(var, (lo, hi)),
+                                               _iv_sub(Interval(lo, hi), Interval(m, m))))
+            except ValueError:
+                mean = _IV_WHOLE
+            box = Interval(max(box.lo, mean.lo), min(box.hi, mean.hi))
+        return lo, hi, box, middle
+
+    pieces = [p for p in (piece(a, b),) if p is not None]
+    while True:
+        if not pieces:
+            raise ValueError(f"{tree.to_str()} is not defined on [{a!r}, {b!r}]")
+        lo = min(p[2].lo for p in pieces)
+        hi = max(p[2].hi for p in pieces)
+        # f takes a value at most 'low' and one at least 'high', from the middles
+        middles = [p[3] for p in pieces if p[3] is not None]
+        low = min((m.hi for m in middles), default=_INF)
+        high = max((m.lo for m in middles), default=-_INF)
+        target = tol * max(1.0, abs(low) if low < _INF else 1.0,
+                           abs(high) if high > -_INF else 1.0)
+        keep, split = [], []
+        for p in pieces:
+            m = 0.5 * (p[0] + p[1])
+            if ((p[2].lo < low - target or p[2].hi > high + target) and p[0] < m < p[1] and
+                    len(pieces) + len(split) < max_pieces):
+                split.append(p)
+            else:
+                keep.append(p)
+        if not split:
+            break
+        pieces = keep
+        for p in split:
+            m = 0.5 * (p[0] + p[1])
+            pieces.extend(q for q in (piece(p[0], m), piece(m, p[1])) if q is not None)
+    return Bounds(lo, hi, max(low - lo, hi - high, 0.0), evaluations)
+
+
+# Binary form of expressions (dumps/loads), a faster and smaller hand-off than to_str and
+# Parser that keeps shared subtrees shared. Layout, little-endian:
+#   header    b'DRV', version byte, then u32 counts: node words, numbers, names, roots and
+#             flags (1 if a list was dumped)
+#   numbers   the constant pool, per number a kind byte and its value: 0 float64, 1 int64,
+#             2 u32 length and the decimal digits of an int too big for int64, 3 int32
+#   names     variable and function names, per name a u32 length and the UTF-8 bytes
+#   words     padded to an even offset, one u16 per node in postfix order:
+#             opcode | saved << 4 | operand << 5, where an operand of _WIDE means the
+#             real operand follows as two more words (low half first)
+# Decoding runs the words on a stack: NUM, VAR and FUNC take an index into the pools, INT
+# and FLOAT are small whole numbers held in the operand itself, NEG and the binary ops pop
+# their operands. A node used more than once is written once with its saved bit set, which
+# adds it to a table, and later uses are REF words with its index in that table.
+SERIAL_MAGIC = b'DRV'
+SERIAL_VERSION = 1
+_SERIAL_HEADER = struct.Struct('<3sBIIIII')
+_OP_NUM, _OP_VAR, _OP_FUNC, _OP_REF, _OP_INT, _OP_FLOAT, _OP_NEG = range(7)
+_OP_BINARY = {'+': 7, '-': 8, '*': 9, '/': 10, '^': 11}
+_BINARY_OPS = {code: op for op, code in _OP_BINARY.items()}
+_WIDE = (1 << 11) - 1  # operands from this up don't fit in a word
+_INT32 = struct.Struct('<i')
+_INT64 = struct.Struct('<q')
+_FLOAT64 = struct.Struct('<d')
+_U32 = struct.Struct('<I')
+
+
+def dumps(tree):
+    # Binary form of an expression tree, or of a list of them (which share their common
+    # subtrees), see the layout above. loads turns it back into the same nodes.
+    roots = list(tree) if isinstance(tree, (list, tuple)) else [tree]
+    uses = {}
+    for node in _nodes(*roots):
+        for child in node.children():
+            uses[child] = uses.get(child, 0) + 1
+    for root in roots:
+        uses[root] = uses.get(root, 0) + 1
+    numbers, names = {}, {}   # value or name -> index in its pool
+    saved = {}                # node -> index in the decoder's table
+    words = array('H')
+
+    def emit(op, operand=0, save=False):
+        if operand < _WIDE:
+            words.append(op | save << 4 | operand << 5)
+        else:
+            words.extend((op | save << 4 | _WIDE << 5, operand & 0xFFFF, operand >> 16))
+
+    # Walk the tree in postfix order, a node seen before is a REF to it
+    stack = [(root, False) for root in reversed(roots)]
+    while stack:
+        node, expanded = stack.pop()
+        if node in saved:
+            emit(_OP_REF, saved[node])
+            continue
+        if not expanded and node.children():
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children()))
+            continue
+        save = uses[node] > 1
+        if save:
+            saved[node] = len(saved)
+        if isinstance(node, NumberNode):
+            value = node.value
+            if isinstance(value, int) and 0 <= value < _WIDE:
+                emit(_OP_INT, value, save)
+            elif isinstance(value, float) and value.is_integer() and 0 <= value < _WIDE:
+                emit(_OP_FLOAT, int(value), save)
+            else:
+                # keyed on type too, 2 and 2.0 print differently
+                emit(_OP_NUM, numbers.setdefault((type(value), value), len(numbers)), save)
+        elif isinstance(node, VarNode):
+            emit(_OP_VAR, names.setdefault(node.name, len(names)), save)
+        elif isinstance(node, FuncNode):
+            emit(_OP_FUNC, names.setdefault(node.func_name, len(names)), save)
+        elif isinstance(node, UnaryOpNode):
+            emit(_OP_NEG, 0, save)
+        else:
+            emit(_OP_BINARY[node.op], 0, save)
+    if sys.byteorder != 'little':
+        words.byteswap()
+
+    out = bytearray(_SERIAL_HEADER.pack(
+        SERIAL_MAGIC, SERIAL_VERSION, len(words), len(numbers), len(names), len(roots),
+        isinstance(tree, (list, tuple))))
+    for kind, value in numbers:
+        if kind is float:
+            out.append(0)
+            out += _FLOAT64.pack(value)
+        elif -2 ** 31 <= value < 2 ** 31:
+            out.append(3)
+            out += _INT32.pack(value)
+        elif -2 ** 63 <= value < 2 ** 63:
+            out.append(1)
+            out += _INT64.pack(value)
+        else:
+            digits = str(value).encode()
+            out.append(2)
+            out += _U32.pack(len(digits)) + digits
+    for name in names:
+        encoded = name.encode()
+        out += _U32.pack(len(encoded)) + encoded
+    out += bytes(len(out) % 2)
+    out += words.tobytes()
+    return bytes(out)
+
+
+def loads(data):
+    # Expression tree from dumps' output, read straight from data: bytes, bytearray, a
+    # memoryview or an mmap (nothing is copied but the names). Returns a list if a list was
+    # dumped. Raises ValueError if data isn't in this format.
+    with memoryview(data) as view, view.cast('B') as buf:
+        if len(buf) < _SERIAL_HEADER.size:
+            raise ValueError("Not a serialized expression")
+        magic, version, count, n_numbers, n_names, n_roots, flags = \
+            _SERIAL_HEADER.unpack_from(buf)
+        if magic != SERIAL_MAGIC:
+            raise ValueError("Not a serialized expression")
+        if version != SERIAL_VERSION:
+            raise ValueError(f"Unsupported serialization version: {version}")
+        try:
+            offset = _SERIAL_HEADER.size
+            numbers = []
+            for _ in range(n_numbers):
+                kind = buf[offset]
+                if kind == 0:
+                    value = _FLOAT64.unpack_from(buf, offset + 1)[0]
+                    offset += 9
+                elif kind == 3:
+                    value = _INT32.unpack_from(buf, offset + 1)[0]
+                    offset += 5
+                elif kind == 1:
+                    value = _INT64.unpack_from(buf, offset + 1)[0]
+                    offset += 9
+                elif kind == 2:
+                    (size,) = _U32.unpack_from(buf, offset + 1)
+                    value = int(str(buf[offset + 5:offset + 5 + size], 'ascii'))
+                    offset += 5 + size
+                else:
+                    raise ValueError(f"Bad number kind {kind}")
+                numbers.append(NumberNode(value))
+            names = []
+            for _ in range(n_names):
+                (size,) = _U32.unpack_from(buf, offset)
+                names.append(str(buf[offset + 4:offset + 4 + size], 'utf-8'))
+                offset += 4 + size
+            offset += offset % 2
+            end = offset + 2 * count
+            if end > len(buf):
+                raise ValueError("Truncated serialized expression")
+            if sys.byteorder == 'little':
+                with buf[offset:end] as raw, raw.cast('H') as words:
+                    roots = _run_words(words, numbers, names)
+            else:
+                words = array('H', buf[offset:end])
+                words.byteswap()
+                roots = _run_words(words, numbers, names)
+        except (IndexError, struct.error):
+            raise ValueError("Truncated serialized expression") from None
+    if len(roots) != n_roots:
+        raise ValueError("Corrupt serialized expression")
+    return roots if flags & 1 else roots[0]
+
+
+def _run_words(words, numbers, names):
+    # Runs the postfix words of loads, returning the nodes left on the stack
+    stack = []
+    push, pop = stack.append, stack.pop
+    table = []
+    binary = _BINARY_OPS
+    words = iter(words)
+    try:
+        for word in words:
+            op = word & 15
+            if op >= _OP_NEG:
+                if op == _OP_NEG:
+                    node = UnaryOpNode('-', pop())
+                else:
+                    right = pop()
+                    node = BinOpNode(pop(), binary[op], right)
+            else:
+                operand = word >> 5
+                if operand == _WIDE:
+                    operand = next(words) | next(words) << 16
+                if op == _OP_REF:
+                    push(table[operand])
+                    continue
+                if op == _OP_NUM:
+                    node = numbers[operand]
+                elif op == _OP_INT:
+                    node = NumberNode(operand)
+                elif op == _OP_FLOAT:
+                    node = NumberNode(float(operand))
+                elif op == _OP_VAR:
+                    node = VarNode(names[operand])
+                else:
+                    node = FuncNode(names[operand], pop())
+            if word & 16:
+                table.append(node)
+            push(node)
+    except (IndexError, KeyError, StopIteration):
+        raise ValueError("Corrupt serialized expression") from None
+    return stack
+
+
+# Expressions per task sent to a worker by diff_many, and how many recent results it keeps to
+# answer repeated expressions without differentiating them again
+DIFF_MANY_CHUNKSIZE = 256
+DIFF_MANY_CACHE_SIZE = 65536
+
+
+def _diff_chunk(exprs, var):
+    # Derivatives of a list of expressions, run in a diff_many worker. Whatever parsing or
+    # differentiating an expression raises is returned in its place
+    results = []
+    for expr in exprs:
+        try:
+            results.append(symbolic_diff_expr(expr, var))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _init_diff_worker(cache_args):
+    # Opens the parent's disk_diff_cache in a diff_many worker (workers started with spawn
+    # rather than fork don't inherit it)
+    global disk_diff_cache
+    disk_diff_cache = None if cache_args is None else DiskCache(*cache_args)
+
+
+class _DiffJob:
+    # The distinct new expressions of one chunk of diff_many's input and the future for
+    # their derivatives
+    __slots__ = ('exprs', 'future', '_results')
+
+    def __init__(self, exprs, future):
+        self.exprs = exprs
+        self.future = future
+        self._results = None
+
+    def results(self):
+        # expr -> derivative or error, waiting for the worker if needed
+        if self._results is None:
+            self._results = dict(zip(self.exprs, self.future.result()))
+        return self._results
+
+
+def diff_many(exprs, var, workers=1, chunksize=None):
+    # Derivatives of many expression strings with respect to 'var', like calling
+    # symbolic_diff_expr on each, yielded lazily in input order. An expression that can't
+    # be parsed or differentiated yields the exception it raised instead (usually a
+    # ValueError or NotImplementedError), so one bad input doesn't stop the run.
+    # With workers > 1 the input is split into chunks of chunksize expressions that are
+    # differentiated in a pool of worker processes, with about two chunks per worker in
+    # flight so memory stays bounded however long the input is. Expressions seen recently
+    # (in the same chunk, a chunk still in flight or the last DIFF_MANY_CACHE_SIZE results)
+    # are only sent to a worker once.
+    # ex: list(diff_many(["x**2", "sin(x)", "x +"], "x")) -> ['2*x', 'cos(x)', ValueError(...)]
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    if chunksize is None:
+        chunksize = DIFF_MANY_CHUNKSIZE
+    if chunksize < 1:
+        raise ValueError("chunksize must be at least 1")
+    pool = None
+    if workers > 1:
+        # Imported here, multiprocessing adds a good part to the time it takes to import
+        # this module
+        from concurrent.futures import ProcessPoolExecutor
+        disk = disk_diff_cache
+        cache_args = None if disk is None else (disk.path, disk.maxsize)
+        pool = ProcessPoolExecutor(workers, initializer=_init_diff_worker,
+                                   initargs=(cache_args,))
+    try:
+        yield from _diff_many(iter(exprs), var, pool, 2 * workers, chunksize)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def _diff_many(exprs, var, pool, window, chunksize):
+    seen = LRUCache(DIFF_MANY_CACHE_SIZE)  # expr -> derivative or error
+    inflight = {}    # expr -> job of a chunk not yet yielded that differentiates it
+    pending = deque()  # (chunk, expr -> result or job, job) in input order
+
+    def finish(chunk, refs, job):
+        results = job.results()
+        for expr in job.exprs:
+            seen.put(expr, results[expr])
+            del inflight[expr]
+        values = {expr: ref.results()[expr] if isinstance(ref, _DiffJob) else ref
+                  for expr, ref in refs.items()}
+        return [values[expr] for expr in chunk]
+
+    while True:
+        chunk = list(islice(exprs, chunksize))
+        if not chunk:
+            break
+        refs = {}
+        new = []
+        for expr in chunk:
+            if expr in refs:
+                continue
+            ref = seen.get(expr)
+            if ref is None:
+                ref = inflight.get(expr)
+            if ref is None:
+                new.append(expr)
+            refs[expr] = ref
+        if pool is None:
+            future = Future()
+            future.set_result(_diff_chunk(new, var))
+        else:
+            future = pool.submit(_diff_chunk, new, var)
+        job = _DiffJob(new, future)
+        for expr in new:
+            refs[expr] = inflight[expr] = job
+        pending.append((chunk, refs, job))
+        if len(pending) >= window:
+            yield from finish(*pending.popleft())
+    while pending:
+        yield from finish(*pending.popleft())
+
+
+# Limits of DiffServer: requests being worked on at once (reading stops beyond that), the
+# longest request line in bytes and how many recent latencies the percentiles are over
+SERVER_QUEUE_SIZE = 1024
+SERVER_LINE_LIMIT = 1 << 24
+SERVER_LATENCY_WINDOW = 10000
+
+
+def _percentile(values, q):
+    # Nearest rank q-th percentile (0 < q <= 100) of a sorted list, None if it is empty
+    if not values:
+        return None
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+class DiffServer:
+    # asyncio server differentiating and evaluating expressions for clients on a local
+    # socket, so worker processes can share one instance instead of each importing this
+    # module. The protocol is JSON Lines: every line a client sends is a request object,
+    # answered with one response line carrying the request's "id". Responses come back as
+    # they are ready, not necessarily in the order the requests were sent.
+    #   {"id": 1, "op": "diff", "expr": "x**2", "var": "x"} -> {"id": 1, "derivative": "2*x"}
+    #   {"id": 2, "op": "diff", "expr": "x**2", "at": [3]}
+    #       -> {"id": 2, "derivative": "2*x", "values": [6]}
+    #   {"id": 3, "op": "eval", "expr": "x**2", "at": [3, 4]} -> {"id": 3, "values": [9, 16]}
+    #   {"id": 4, "op": "stats"} -> {"id": 4, "requests": ..., "latency_ms": {...}, ...}
+    # "op" defaults to "diff" and "var" to "x". A failed request gets {"id": ..., "error":
+    # "ValueError: ..."}, a value that can't be computed at a point is null.
+    #
+    # Derivatives are computed with symbolic_diff_expr in a pool of 'workers' processes, so
+    # the event loop only reads, writes and evaluates. Results are kept in expr_diff_cache,
+    # and identical requests arriving while a derivative is being computed wait for that
+    # computation instead of starting their own. At most queue_size requests are worked on
+    # at once, beyond that the server stops reading from its clients until some finish, so
+    # a flood of requests queues up in the clients and the socket buffers, not here.
+    # stats() reports counts, the number of derivatives being computed (queue_depth) and
+    # percentiles of the latency of the last SERVER_LATENCY_WINDOW requests (from reading
+    # the line to writing the response).
+    # ex: asyncio.run(DiffServer().serve("unix:/tmp/derivative.sock")), or from the command
+    #     line: python -m derivative --serve 127.0.0.1:8765 --workers 4
+
+    def __init__(self, workers=1, queue_size=SERVER_QUEUE_SIZE):
+        if workers < 1 or queue_size < 1:
+            raise ValueError("workers and queue_size must be at least 1")
+        self.workers = workers
+        self.queue_size = queue_size
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.computed = 0
+        self.active = 0
+        self.connections = 0
+        self._pool = None
+        self._slots = None
+        self._inflight = {}  # (expr, var) -> future of its derivative
+        self._funcs = LRUCache(DIFF_MANY_CACHE_SIZE)  # (expr, var) -> compiled function
+        self._latencies = deque(maxlen=SERVER_LATENCY_WINDOW)
+
+    async def start(self, address):
+        # Starts listening on address, "unix:PATH" or "HOST:PORT", and returns the
+        # asyncio.Server (its sockets tell the port when it was 0)
+        import asyncio
+        from concurrent.futures import ProcessPoolExecutor
+        if self._pool is None:
+            disk = disk_diff_cache
+            cache_args = None if disk is None else (disk.path, disk.maxsize)
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_diff_worker,
+                                             initargs=(cache_args,))
+            self._slots = asyncio.Semaphore(self.queue_size)
+        if address.startswith('unix:'):
+            return await asyncio.start_unix_server(self._connection, address[5:],
+                                                   limit=SERVER_LINE_LIMIT)
+        host, sep, port = address.rpartition(':')
+        if not sep or not port.isdigit():
+            raise ValueError(f"Bad address {address!r}, expected unix:PATH or HOST:PORT")
+        return await asyncio.start_server(self._connection, host or None, int(port),
+                                          limit=SERVER_LINE_LIMIT)
+
+    async def serve(self, address, started=None):
+        # Serves on address until cancelled, calling started(server) once it listens
+        server = await self.start(address)
+        if started is not None:
+            started(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        # Stops the worker processes, waiting for derivatives they are computing
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def _connection(self, reader, writer):
+        import asyncio
+        self.connections += 1
+        lock = asyncio.Lock()  # one response written (and drained) at a time
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Longer than SERVER_LINE_LIMIT, the rest of the stream can't be framed
+                    break
+                if not line:
+                    break
+                start = time.perf_counter()
+                await self._slots.acquire()
+                task = asyncio.create_task(self._respond(line, writer, lock, start))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                # Released when the task is done, also if it is cancelled before it starts
+                task.add_done_callback(self._release_slot)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.connections -= 1
+            writer.close()
+
+    async def _respond(self, line, writer, lock, start):
+        self.active += 1
+        try:
+            try:
+                message = json.loads(line)
+                if not isinstance(message, dict):
+                    raise ValueError("A request must be a JSON object")
+            except ValueError as e:
+                response = {'id': None, 'error': _error_text(e)}
+            else:
+                response = await self.request(message)
+            try:
+                data = json.dumps(response)
+            except (TypeError, ValueError) as e:
+                # A result JSON can't write still gets its error reply
+                self.errors += 1
+                data = json.dumps({'id': response.get('id'), 'error': _error_text(e)})
+            data = (data + '\n').encode()
+            try:
+                async with lock:
+                    writer.write(data)
+                    await writer.drain()
+            except ConnectionError:
+                # The client went away, there is no one left to reply to
+                return
+            self._latencies.append(time.perf_counter() - start)
+        finally:
+            self.active -= 1
+
+    def _release_slot(self, task):
+        self._slots.release()
+
+    async def request(self, message):
+        # The response (a dict) to one request (a dict parsed from its line)
+        self.requests += 1
+        response = {'id': message.get('id')}
+        try:
+            op = message.get('op', 'diff')
+            if op == 'stats':
+                response.update(self.stats())
+                return response
+            if op not in ('diff', 'eval'):
+                raise ValueError(f"Unknown op {op!r}")
+            expr = message.get('expr')
+            var = message.get('var', 'x')
+            if not isinstance(expr, str) or not isinstance(var, str):
+                raise ValueError("expr and var must be strings")
+            points = message.get('at')
+            if points is not None and not (
+                    isinstance(points, list) and
+                    all(isinstance(x, (int, float)) and not isinstance(x, bool)
+                        for x in points)):
+                raise ValueError("at must be a list of numbers")
+            if op == 'diff':
+                expr = response['derivative'] = await self.derivative(expr, var)
+                if points is None:
+                    return response
+            response['values'] = self._values(expr, var, points or [])
+        except Exception as e:
+            # Every request gets a reply, whatever went wrong with it (including a broken
+            # process pool), rather than an exception lost in its task
+            self.errors += 1
+            response = {'id': response['id'], 'error': _error_text(e)}
+        return response
+
+    async def derivative(self, expr, var):
+        # symbolic_diff_expr(expr, var), computed in the pool and shared by every request
+        # for it that arrives before it is done
+        import asyncio
+        key = (expr, var)
+        result = expr_diff_cache.get(key)
+        if result is not None:
+            self.cache_hits += 1
+            return result
+        future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._pool, symbolic_diff_expr, expr, var)
+            self._inflight[key] = future
+            self.computed += 1
+
+            def done(future):
+                del self._inflight[key]
+                if not future.cancelled() and future.exception() is None:
+                    expr_diff_cache.put(key, future.result())
+            future.add_done_callback(done)
+        else:
+            self.coalesced += 1
+        # A waiting client that goes away mustn't cancel the computation for the others
+        return await asyncio.shield(future)
+
+    def _values(self, expr, var, points):
+        # Values at each point, None where they can't be computed (or are complex)
+        key = (expr, var)
+        f = self._funcs.get(key)
+        if f is None:
+            # Only what the parser accepts: compile_expr (and so MathFunc) would hand
+            # anything else to eval, which mustn't see text from a socket
+            tree = Parser(expr).parse()
+            f = EvalPlan(tree, var).compile() if USE_EVAL else RegisterPlan(tree, var)
+            self._funcs.put(key, f)
+        values = []
+        for x in points:
+            try:
+                # As floats: an integer point would be evaluated exactly, and x**9999 at 10
+                # makes an integer too long to compute quickly or to write as JSON
+                value = f(float(x))
+                if isinstance(value, int):
+                    value = float(value)
+            except (ValueError, ZeroDivisionError, OverflowError):
+                value = None
+            if isinstance(value, complex) or (isinstance(value, float) and
+                                              not math.isfinite(value)):
+                # JSON has no complex numbers, infinities or nan
+                value = None
+            values.append(value)
+        return values
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'cache_hits': self.cache_hits,
+            'coalesced': self.coalesced,
+            'computed': self.computed,
+            'queue_depth': len(self._inflight),
+            'active': self.active,
+            'connections': self.connections,
+            'latency_ms': {
+                name: None if value is None else value * 1e3
+                for name, value in (('p50', _percentile(latencies, 50)),
+                                    ('p90', _percentile(latencies, 90)),
+                                    ('p99', _percentile(latencies, 99)),
+                                    ('max', latencies[-1] if latencies else None))
+            },
+        }
+
+
+# Output of the command line, written to the output CLI_WRITE_SIZE characters at a time
+CLI_FORMATS = ('text', 'jsonl', 'csv')
+CLI_CSV_HEADER = ('expr', 'derivative', 'x', 'value', 'slope', 'error')
+CLI_WRITE_SIZE = 1 << 16
+
+
+def _cli_records(lines, points):
+    # (expr, points, error) for each input line, "expr" or "expr<TAB>x<TAB>x..." where the
+    # x are points to evaluate at (the points given on the command line if there are none)
+    for line in lines:
+        expr, *fields = line.rstrip('\r\n').split('\t')
+        try:
+            yield expr, [float(x) for x in fields] if fields else points, None
+        except ValueError as e:
+            yield expr, (), e
+
+
+def _cli_values(expr, var, points, trees):
+    # (x, f(x), f'(x)) at each point by forward mode, values that can't be computed there
+    # (or are complex) are None. trees caches parsed expressions, inputs tend to repeat.
+    # The expression is parsed even without points, so one that doesn't parse is reported
+    tree = trees.get(expr)
+    if tree is None:
+        tree = Parser(expr).parse()
+        trees.put(expr, tree)
+    values = []
+    for x in points:
+        try:
+            value, slope = derivatives(tree, var, x)
+        except (ValueError, ZeroDivisionError, OverflowError):
+            value = slope = None
+        if isinstance(value, complex) or isinstance(slope, complex):
+            value = slope = None
+        values.append((x, value, slope))
+    return values
+
+
+def _cli_results(lines, args):
+    # (expr, derivative, values, error) for each line of input, computed lazily: lines are
+    # read, differentiated (by diff_many) and evaluated a chunk at a time
+    records = _cli_records(lines, args.at)
+    if args.eval_only:
+        derivs = repeat(None)
+    else:
+        records, exprs = tee(records)
+        exprs = (expr for expr, points, error in exprs)
+        derivs = diff_many(exprs, args.var, args.workers, args.chunksize)
+    trees = LRUCache(DIFF_MANY_CACHE_SIZE)
+    for (expr, points, error), deriv in zip(records, derivs):
+        if error is None and isinstance(deriv, Exception):
+            error = deriv
+        values = []
+        # With a derivative a line without points has nothing left to check
+        if error is None and (points or args.eval_only):
+            try:
+                values = _cli_values(expr, args.var, points, trees)
+            except Exception as e:
+                error = e
+        yield expr, deriv, values, error
+
+
+def _error_text(error):
+    return f"{type(error).__name__}: {error}"
+
+
+def _number_text(value):
+    return 'nan' if value is None else repr(value)
+
+
+def _format_text(out, expr, deriv, values, error):
+    # The derivative, then f(x) and f'(x) for each point, separated by tabs
+    if error is not None:
+        out.write(f"error: {_error_text(error)}\n")
+        return
+    fields = [] if deriv is None else [deriv]
+    for x, value, slope in values:
+        fields.append(_number_text(value))
+        fields.append(_number_text(slope))
+    out.write('\t'.join(fields) + '\n')
+
+
+def _format_jsonl(out, expr, deriv, values, error):
+    record = {'expr': expr}
+    if error is not None:
+        record['error'] = _error_text(error)
+    else:
+        if deriv is not None:
+            record['derivative'] = deriv
+        if values:
+            record['points'] = [{'x': x, 'value': value, 'slope': slope}
+                                for x, value, slope in values]
+    out.write(json.dumps(record) + '\n')
+
+
+def _csv_formatter(out):
+    # One row per point, or one row without x, value and slope for a line without points
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(CLI_CSV_HEADER)
+
+    def format_csv(out, expr, deriv, values, error):
+        if error is not None:
+            writer.writerow((expr, '', '', '', '', _error_text(error)))
+        elif not values:
+            writer.writerow((expr, deriv or '', '', '', '', ''))
+        else:
+            writer.writerows((expr, deriv or '', repr(x), _number_text(value),
+                              _number_text(slope), '') for x, value, slope in values)
+    return format_csv
+
+
+def _serve(args):
+    # main with --serve: runs the server until interrupted or terminated, printing where it
+    # listens. Either way the worker processes are shut down before it returns
+    import asyncio
+    import signal
+
+    def started(server):
+        names = [sock.getsockname() for sock in server.sockets]
+        where = ', '.join(f"{name[0]}:{name[1]}" if isinstance(name, tuple) else f"unix:{name}"
+                          for name in names)
+        print(f"derivative: serving on {where}", file=sys.stderr, flush=True)
+
+    async def run():
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                          asyncio.current_task().cancel)
+        except NotImplementedError:  # no signal handlers in this event loop (Windows)
+            pass
+        await server.serve(args.serve, started)
+
+    server = DiffServer(args.workers, args.queue_size)
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    return 0
+
+
+def main(argv=None):
+    # Command line entry point, differentiates expressions read one per line from a file or
+    # stdin and writes one result per line in the same order, streaming: memory use doesn't
+    # grow with the input. A line can give points after the expression, separated by tabs,
+    # to also get the value and derivative there (see _cli_records and the formats above).
+    # ex: python -m derivative formulas.txt --var x --workers 4 > derivatives.txt
+    #     printf 'x**2\t3\n' | python -m derivative --format jsonl
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='derivative',
+        description="Differentiate expressions, one per line, optionally followed by "
+                    "tab separated points to evaluate them and their derivatives at.")
+    parser.add_argument('file', nargs='?', help="file of expressions (default: stdin)")
+    parser.add_argument('-v', '--var', default='x',
+                        help="variable to differentiate with respect to (default: x)")
+    parser.add_argument('-f', '--format', choices=CLI_FORMATS, default='text',
+                        help="output format (default: text)")
+    parser.add_argument('-o', '--output', help="output file (default: stdout)")
+    parser.add_argument('--at', type=float, action='append', default=[], metavar='X',
+                        help="point to evaluate lines without points at, can be repeated")
+    parser.add_argument('--eval-only', action='store_true',
+                        help="only evaluate at the points, without a symbolic derivative")
+    parser.add_argument('--cache', metavar='PATH',
+                        help="persistent derivative cache file (see DiskCache)")
+    parser.add_argument('--cache-size', type=int, default=DISK_CACHE_SIZE, metavar='N',
+                        help=f"entries the cache keeps (default: {DISK_CACHE_SIZE})")
+    parser.add_argument('--warm', action='store_true',
+                        help="only fill the cache with the derivatives, write no output")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="worker processes (default: 1, no pool)")
+    parser.add_argument('--chunksize', type=int, default=DIFF_MANY_CHUNKSIZE,
+                        help=f"expressions per task (default: {DIFF_MANY_CHUNKSIZE})")
+    parser.add_argument('--serve', metavar='ADDRESS',
+                        help="run a DiffServer on unix:PATH or HOST:PORT instead, with "
+                             "--workers worker processes")
+    parser.add_argument('--queue-size', type=int, default=SERVER_QUEUE_SIZE, metavar='N',
+                        help=f"requests the server works on at once (default: "
+                             f"{SERVER_QUEUE_SIZE})")
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.chunksize < 1 or args.queue_size < 1:
+        parser.error("--workers, --chunksize and --queue-size must be at least 1")
+    if args.warm and (args.cache is None or args.eval_only):
+        parser.error("--warm needs --cache and a symbolic derivative")
+    global disk_diff_cache
+    previous_cache = disk_diff_cache
+    if args.cache is not None:
+        disk_diff_cache = DiskCache(args.cache, args.cache_size)
+    if args.serve is not None:
+        try:
+            return _serve(args)
+        finally:
+            if disk_diff_cache is not previous_cache:
+                disk_diff_cache.close()
+                disk_diff_cache = previous_cache
+    # Results are formatted into a buffer that is written out in large pieces
+    buffer = io.StringIO()
+    if args.format == 'csv':
+        formatter = _csv_formatter(buffer)
+    else:
+        formatter = _format_jsonl if args.format == 'jsonl' else _format_text
+    files = ExitStack()
+    try:
+        source = files.enter_context(open(args.file)) if args.file else sys.stdin
+        target = (files.enter_context(open(args.output, 'w', newline=''))
+                  if args.output else sys.stdout)
+        if args.warm:
+            for _ in diff_many((line.split('\t')[0].rstrip('\r\n') for line in source),
+                               args.var, args.workers, args.chunksize):
+                pass
+            return 0
+        for result in _cli_results(source, args):
+            formatter(buffer, *result)
+            if buffer.tell() >= CLI_WRITE_SIZE:
+                target.write(buffer.getvalue())
+                buffer.seek(0)
+                buffer.truncate()
+        target.write(buffer.getvalue())
+        target.flush()
+    except BrokenPipeError:
+        # The reader went away (eg: piped into head), stop quietly. stdout is pointed at
+        # devnull so the flush at exit doesn't fail again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    finally:
+        files.close()
+        if disk_diff_cache is not previous_cache:
+            disk_diff_cache.close()
+            disk_diff_cache = previous_cache
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
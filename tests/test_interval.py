@@ -0,0 +1,127 @@
+# Interval arithmetic (Node.interval) and bounds, checked against dense sampling: every value
+# an expression takes at the sample points must lie inside the bounds
+#
+# Run from the repository root: python -m pytest tests
+
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import Parser, bounds, compile_expr
+
+POINTS = 2001
+
+CASES = [
+    # (expression, a, b)
+    ("x**(2**1)", -2, 1),
+    ("x**(2**1)", -2, -1),
+    ("x**3 - 2*x", -2, 2),
+    ("x**-2 + x**(-3)", -3, -0.5),
+    ("(x - 1)**4/(x**2 + 1)", -3, 3),
+    ("sin(x)*exp(-x/10) + cos(3*x)/(2 + x**2)", 0, 20),
+    ("tan(x)*cos(x)", -1.5, 1.5),
+    ("sec(x) + csc(x + 2)", 0.2, 1),
+    ("cot(x)*x", 0.1, 3),
+    ("ln(x**2 + 1)*x", -5, 5),
+    ("x**(1/2)*ln(x)", 0.01, 4),
+    ("2**x - x**2", -1, 5),
+    ("x**x", 0.1, 2),
+    ("x**0.5 + x", -4, 1),
+]
+
+
+def samples(expr, var, a, b):
+    f = compile_expr(expr, var)
+    values = []
+    for i in range(POINTS):
+        x = a + (b - a) * i / (POINTS - 1)
+        try:
+            value = f(x)
+        except (ValueError, ZeroDivisionError, OverflowError):
+            continue
+        if isinstance(value, float) and math.isfinite(value) or isinstance(value, int):
+            values.append(value)
+    return values
+
+
+@pytest.mark.parametrize('expr, a, b', CASES)
+def test_interval_contains_samples(expr, a, b):
+    tree = Parser(expr).parse()
+    values = samples(expr, "x", a, b)
+    box = tree.interval("x", (a, b))
+    assert all(box.lo <= v <= box.hi for v in values)
+    # And on pieces, where the bounds get close to the values
+    for i in range(10):
+        lo, hi = a + (b - a) * i / 10, a + (b - a) * (i + 1) / 10
+        try:
+            box = tree.interval("x", (lo, hi))
+        except ValueError:
+            continue
+        assert all(box.lo <= v <= box.hi for v in samples(expr, "x", lo, hi))
+
+
+@pytest.mark.parametrize('expr, a, b', CASES)
+def test_bounds_contain_samples(expr, a, b):
+    values = samples(expr, "x", a, b)
+    r = bounds(expr, "x", a, b)
+    assert r.lo <= min(values) and max(values) <= r.hi
+
+
+def test_bounds_are_tight():
+    # x**3 - 2*x on [-2, 2] takes its extremes -4 and 4 at the ends
+    r = bounds("x**3 - 2*x", "x", -2, 2)
+    assert r.error < 1e-8
+    assert -4 - 1e-8 < r.lo <= -4 and 4 <= r.hi < 4 + 1e-8
+    # x**(2**1) on [-2, 1] is x**2, with range [0, 4]
+    r = bounds("x**(2**1)", "x", -2, 1)
+    assert -1e-8 < r.lo <= 0 and 4 <= r.hi < 4 + 1e-8
+
+
+def test_negative_base_with_point_exponent():
+    # A variable exponent that is a single integer uses the integer power rule
+    tree = Parser("x**y").parse()
+    box = tree.interval(("x", "y"), ((-2, 1), (2, 2)))
+    assert box.lo <= 0 and 4 <= box.hi < 4.001
+    box = tree.interval(("x", "y"), ((-2, 1), (3, 3)))
+    assert box.lo <= -8 and 1 <= box.hi
+
+
+def test_negative_base_with_interval_exponent():
+    # (-2)**3 = -8 and (-2)**2 = 4 are real values for y in [2, 3]
+    box = Parser("x**y").parse().interval(("x", "y"), ((-2, 1), (2, 3)))
+    assert box.lo <= -8 and 8 <= box.hi
+
+
+def test_negative_base_without_integer_exponent():
+    # y in [0.2, 0.7] holds no integer, so only x in [0, 1] gives real values
+    box = Parser("x**y").parse().interval(("x", "y"), ((-2, 1), (0.2, 0.7)))
+    assert -1e-300 < box.lo <= 0 and 1 <= box.hi < 1.001
+
+
+def test_infinite_exponent():
+    # 1e308*10 folds to inf, where (-2.0)**inf is a real inf
+    box = Parser("x**(1e308*10)").parse().interval("x", (-2, -1))
+    assert box.hi == math.inf
+    box = Parser("x**(1e308*10)").parse().interval("x", (0.2, 0.5))
+    assert box.lo <= 0 <= box.hi < 1e-300
+
+
+@pytest.mark.parametrize('expr, a, b', [("tan(x)", 1, 2), ("1/x", -1, 1), ("csc(x)", -1, 1)])
+def test_poles_are_unbounded(expr, a, b):
+    box = Parser(expr).parse().interval("x", (a, b))
+    assert box.lo == -math.inf and box.hi == math.inf
+
+
+def test_undefined_everywhere():
+    with pytest.raises(ValueError):
+        Parser("ln(x)").parse().interval("x", (-2, -1))
+    with pytest.raises(ValueError):
+        bounds("ln(x)", "x", -2, -1)
+    with pytest.raises(ValueError):
+        Parser("x**0.5").parse().interval("x", (-4, -1))
+    with pytest.raises(ValueError):
+        bounds("x**0.5", "x", -4, -1)
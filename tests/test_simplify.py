@@ -0,0 +1,61 @@
+# Simplification of constants: folded values must print in a form the parser reads back,
+# large exact powers must stay unfolded instead of failing, and numbers out of a float's
+# range are reported rather than printed as inf
+#
+# Run from the repository root: python -m pytest tests
+
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from derivative import Parser, diff, func, symbolic_diff_expr
+
+
+@pytest.mark.parametrize('expr', [
+    'exp(-20)*x**2', 'exp(50)*x', 'ln(2)*x**3', '1e-5*x + 2E+3', 'x*10**400',
+    'sin(1)/1000000*x',
+])
+def test_simplified_output_parses_again(expr):
+    tree = Parser(expr).parse().simplify()
+    assert Parser(tree.to_str()).parse().simplify() is tree
+
+
+def test_second_derivative_of_folded_constant():
+    f = diff(diff(func('exp(-20)*x**2', 'x'), 'x'), 'x')
+    assert f(1.0) == pytest.approx(2 * 2.061153622438558e-09)
+
+
+@pytest.mark.parametrize('expr, expected', [
+    ('2**1100*x', '2**1100'),
+    ('x*10**400', '10**400'),
+    ('(3*x)**5', '1215*x**4'),
+])
+def test_large_exact_powers(expr, expected):
+    assert symbolic_diff_expr(expr, 'x') == expected
+
+
+@pytest.mark.parametrize('expr', ['(2*x)**1100', '(3*x)**10000000'])
+def test_huge_powers_stay_unfolded(expr):
+    # Would need thousands of digits (or minutes) to fold, so the power is kept symbolic
+    assert '**' in symbolic_diff_expr(expr, 'x')
+
+
+@pytest.mark.parametrize('expr', ['1e400*x', 'x + 1E999', '.5e309'])
+def test_literals_out_of_range_are_rejected(expr):
+    with pytest.raises(ValueError, match='out of range'):
+        Parser(expr).parse()
+
+
+@pytest.mark.parametrize('expr', ['1e308*10*x', '1e308*x**2', 'x**(1e308*10)'])
+def test_constants_folded_out_of_range_are_rejected(expr):
+    with pytest.raises(ValueError, match='out of range'):
+        symbolic_diff_expr(expr, 'x')
+
+
+def test_literal_out_of_range_still_evaluates():
+    # func falls back to evaluating text the parser rejects, which gives inf like Python
+    assert func('1e400 + x', 'x')(1) == math.inf
@@ -0,0 +1,34 @@
+# Node._vars bitsets: diff skips subtrees without the variable and variables() lists them,
+# also for names past MAX_VAR_BITS, and the name registry stays bounded however many names
+# a long running process sees
+#
+# Run from the repository root: python -m pytest tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import derivative
+from derivative import Parser, symbolic_diff_expr
+
+
+def test_variables():
+    assert Parser("x*sin(y) + 3").parse().variables() == {"x", "y"}
+    assert Parser("2*pi").parse().variables() == {"pi"}
+
+
+def test_registry_is_bounded():
+    # Hostile input: many more distinct names than the registry holds
+    for i in range(derivative.MAX_VAR_BITS + 500):
+        Parser(f"v{i}_reg*x").parse()
+    assert len(derivative._var_bits) <= derivative.MAX_VAR_BITS
+    assert len(derivative._var_names) <= derivative.MAX_VAR_BITS
+    # Later names share one bit, so no node's bitset grows past it
+    tree = Parser("late_a**2*sin(late_b) + x").parse()
+    assert tree._vars.bit_length() == derivative.MAX_VAR_BITS + 1
+    assert tree.variables() == {"late_a", "late_b", "x"}
+    assert symbolic_diff_expr("late_a**2*sin(late_b) + x", "late_a") == "2*late_a*sin(late_b)"
+    assert symbolic_diff_expr("late_a**2*sin(late_b) + x", "late_b") == "late_a**2*cos(late_b)"
+    assert symbolic_diff_expr("late_a**2 + x", "never_seen") == "0"
+